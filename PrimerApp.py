@@ -46,6 +46,7 @@ import view_output as vo
 import read_counts as rc
 import utils
 import platform
+import multiprocessing
 
 # logging imports
 import traceback
@@ -202,7 +203,6 @@ class PrimerFrame(wx.Frame):
 
         self.gtf, self.bam, self.output, self.fasta = [], [], '', None
         pub.subscribe(self.update_after_dialog, "update")
-        pub.subscribe(self.update_after_unsorted_gtf, "update_after_unsorted_gtf")
         pub.subscribe(self.update_after_run, "update_after_run")
         pub.subscribe(self.update_after_error, "update_after_error")
 
@@ -454,15 +454,6 @@ class PrimerFrame(wx.Frame):
             else:
                 webbrowser.open(abs_path)
 
-    def update_after_unsorted_gtf(self, msg):
-        """Alerts user if their GTF file is not sorted properly"""
-        dlg = wx.MessageDialog(self, 'Your GTF file was not properly sorted. Please read '
-                               'the GTF documentation for details on sorting (http://primerseq.sourceforge.net/gtf.html).'
-                               , style=wx.OK)
-        dlg.ShowModal()
-        self.load_progress.Update(100)
-        self.enable_load_buttons()
-
     def update_after_dialog(self, msg):
         '''
         Updates attributes and gui components from a started Process
@@ -529,11 +520,14 @@ class PrimerFrame(wx.Frame):
 
     def process_bam(self, fnames, fnames_without_path, anc_len):
         """This method is threaded by the set_bam method"""
-        tmp_bam = []  # a list of sam.Sam obj to be returned
-        for i, f in enumerate(fnames):
-            wx.CallAfter(pub.sendMessage, "update", (int(float(i) / len(fnames) * 100), 'Reading %s . . .' % fnames_without_path[i]))
-            tmp_bam.append(sam.Sam(f, anc_len))
-        return tmp_bam
+        names = dict(zip(fnames, fnames_without_path))
+        wx.CallAfter(pub.sendMessage, "update", (0, 'Reading %s . . .' % ', '.join(fnames_without_path)))
+
+        def progress(num_done, f):
+            wx.CallAfter(pub.sendMessage, "update", (int(float(num_done) / len(fnames) * 100), 'Finished %s . . .' % names[f]))
+
+        # unsorted files are converted concurrently (see sam.open_sams)
+        return sam.open_sams(fnames, anc_len, progress=progress)
 
     def on_quit(self, event):  # wxGlade: PrimerFrame.<event_handler>
         """Quit PrimerSeq when user presses File -> Quit"""
@@ -742,6 +736,12 @@ class PrimerFrame(wx.Frame):
             return
 
 
+        # apply the current anchor length to the loaded BAM files. Junctions
+        # are counted by min anchor so this only re-filters cached counts
+        anchor_length = int(self.anchor_length_text_field.GetValue())
+        for sam_obj in self.bam:
+            sam_obj.set_anchor_length(anchor_length)
+
         # options for primer.py's main function
         self.options = {}
         self.options['target'] = zip(range(1, len(coordinates) + 1), coordinates)
@@ -787,11 +787,10 @@ class PrimerFrame(wx.Frame):
         pos_list = [utils.get_pos(c) for c in coord]
         tmp = [p for sublist in pos_list for p in sublist]
         start, end = min(tmp), max(tmp)
-        for gene_key in self.gtf[chr]:
-            if self.gtf[chr][gene_key]['strand'] == strand and self.gtf[chr][gene_key]['start'] <= start and self.gtf[chr][gene_key]['end'] >= end:
-                for k, pos in enumerate(pos_list):
-                    if pos in self.gtf[chr][gene_key]['exons']:
-                        found[k] = True
+        for k, pos in enumerate(pos_list):
+            for gene_key in self.gtf.exon_genes(chr, strand, pos[0], pos[1]):
+                if self.gtf[chr][gene_key]['start'] <= start and self.gtf[chr][gene_key]['end'] >= end:
+                    found[k] = True
         return found
 
     def run_primer_design(self, opts):
@@ -885,6 +884,9 @@ class PrimerApp(wx.App):
 # end of class PrimerApp
 
 if __name__ == "__main__":
+    # needed for worker processes when PrimerSeq is frozen into an executable
+    multiprocessing.freeze_support()
+
     # handle all uncaught exceptions
     sys.excepthook = handle_uncaught_exceptions
 
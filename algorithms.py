@@ -14,7 +14,6 @@
 # You should have received a copy of the GNU General Public License
 # along with this program. If not, see <http://www.gnu.org/licenses/>.
 
-import networkx as nx
 import numpy as np
 import sys
 import logging
@@ -26,14 +25,13 @@ oldsettings = np.seterr(all='raise')
 
 def get_biconnected(G):
     """
-    Wrapper arround the networkx biconnected_components function. To find out
+    Wrapper arround the ExonGraph biconnected_components method. To find out
     why the biconnected components algorithm is useful for finding
     constitutive exons check the information section or wikipedia.
     """
 
-    G_undirected = G.to_undirected()  # make sure undirected graph for biconnected components
     components = filter(lambda x: len(
-        x) > 2, map(list, nx.biconnected_components(G_undirected)))  # filter out trivial dyad biconnected components
+        x) > 2, G.biconnected_components())  # filter out trivial dyad biconnected components (edge direction is ignored)
 
     # assert len(components) > 0, 'what nothing in it' + str(components)
     # assert components != None, 'Oddly there is a none object in the biconnected comp' + str(components)
@@ -60,15 +58,14 @@ def bellman_ford_longest_path(G, num_nodes, visited, weight='weight'):
     for tail_node in sorted_nodes:
         for head_node in G.successors(tail_node):
             # want longest path of unexplained edges, so all explained edges have zero weight
-            edge_weight = G[tail_node][head_node][
-                weight] if visited[tail_node][head_node] == 0 else 0
+            edge_weight = G.weight(tail_node, head_node) if visited[tail_node][head_node] == 0 else 0
 
             # larger total weight case
             if d[head_node] < d[tail_node] + edge_weight:
                 d[head_node] = d[tail_node] + edge_weight
                 p[head_node] = p[tail_node] + [head_node]
             # same total weight case, choose edge with greater weight into head node
-            elif d[head_node] == (d[tail_node] + edge_weight) and G[tail_node][head_node][weight] > G[p[head_node][-2]][head_node][weight]:
+            elif d[head_node] == (d[tail_node] + edge_weight) and G.weight(tail_node, head_node) > G.weight(p[head_node][-2], head_node):
                 d[head_node] = d[tail_node] + edge_weight
                 p[head_node] = p[tail_node] + [head_node]
 
@@ -112,12 +109,10 @@ class AllPaths(object):
                            for i in range(len(tx) - 1)])
         self.component = component
         self.target = target
-        self.sub_graph = nx.subgraph(self.graph, self.component)
+        self.sub_graph = self.graph.subgraph(self.component)
 
         # add any possible tx that uses novel edges to list of known txs
-        for tx in nx.all_simple_paths(self.sub_graph,
-                                      source=self.component[0],
-                                      target=self.component[-1]):
+        for tx in self.sub_graph.iter_paths(self.component[0], self.component[-1]):
             novel = False
             for i in range(len(tx) - 1):
                 if (tx[i], tx[i + 1]) not in known_edges:
@@ -135,7 +130,7 @@ class AllPaths(object):
         self.original_tx_paths = sg.annotation  # tx paths all ways without trimming
         self.component = component
         self.target = target
-        self.sub_graph = nx.subgraph(self.graph, self.component)
+        self.sub_graph = self.graph.subgraph(self.component)
 
         # add novel txs
         novel_txs = self.all_paths_with_novel_junctions()
@@ -151,42 +146,25 @@ class AllPaths(object):
         known_edges = set([(tx[i], tx[i + 1])
                           for tx in self.tx_paths
                           for i in range(len(tx) - 1)])
-        tmp_sub_graph = self.add_dummy_nodes_to_graph(self.sub_graph)
-        tmp_src, tmp_sink = (float('-inf'), float('-inf')), (float('inf'), float('inf'))
 
-        # only add paths that include a novel jct
-        for l, tx in enumerate(nx.all_simple_paths(tmp_sub_graph,
-                                                   source=tmp_src,
-                                                   target=tmp_sink)):
+        # only add paths that include a novel jct. A component may have
+        # several first/last exons (e.g. alternative first exons) so paths
+        # start at every exon without predecessors and end at every exon
+        # without successors, like the dummy source/sink nodes used before
+        for l, tx in enumerate(self.sub_graph.iter_paths()):
             # set the maximum number of iterations
             if l >= iter_limit:
                 raise utils.PrimerSeqError('Iteration limit reached in all paths algorithm.')
 
             # find all paths with novel edge
             novel = False
-            # for i in range(len(tx) - 1):
-            for i in range(1, len(tx) - 2):
+            for i in range(len(tx) - 1):
                 if (tx[i], tx[i + 1]) not in known_edges:
                     novel = True
             if novel:
-                tx_list.append(tx[1:-1])
+                tx_list.append(tx)
         return tx_list
 
-    def add_dummy_nodes_to_graph(self, my_graph):
-        """Add a sink and source node to a graph"""
-        # setup variables
-        tmp_graph = my_graph.copy()  # make sure not editing the original graph
-        src_connected_nodes = [node for node in tmp_graph.nodes() if not tmp_graph.predecessors(node)]
-        sink_connected_nodes = [node for node in tmp_graph.nodes() if not tmp_graph.successors(node)]
-
-        # add edges to source and sink node
-        src, sink = (float('-inf'), float('-inf')), (float('inf'), float('inf'))
-        for node in src_connected_nodes:
-            tmp_graph.add_edge(src, node)
-        for node in sink_connected_nodes:
-            tmp_graph.add_edge(node, sink)
-        return tmp_graph
-
     def trim_tx_paths_old(self):
         '''
         Remove all exons outside the biconnected component.
@@ -319,12 +297,13 @@ class AllPaths(object):
     def keep_weakly_connected(self):
         '''This method filters out exons (nodes) not involved in AS events'''
         # find weakly connected subgraphs
-        weakly_connected_list = nx.weakly_connected_component_subgraphs(self.sub_graph)
+        weakly_connected_list = self.sub_graph.weakly_connected_components()
 
         # iterate to find which subgraph has the target exon
-        for subgraph in weakly_connected_list:
-            if self.target in subgraph.nodes():
-                self.sub_graph = subgraph  # assign subgraph that actually connects to target exon
+        for component in weakly_connected_list:
+            if self.target in component:
+                self.sub_graph = self.sub_graph.subgraph(component)  # assign subgraph that actually connects to target exon
+                break
 
     def estimate_counts(self):
         '''
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: annotation_index.py
+Author: Collin Tokheim
+Description: Random access to a GTF without loading it into memory. The GTF
+is sorted once and written as a BGZF file (the block gzip format used by
+bgzip/tabix, so zcat still works on it) along with an index holding the span
+and BGZF virtual offset of every gene. :class:`~annotation_index.IndexedAnnotation`
+answers the same queries as :class:`~gene_index.GeneAnnotation` but only
+decompresses and parses the genes that are actually asked for.
+
+To build the index from the command line:
+python annotation_index.py -i annotation.gtf
+'''
+import cPickle as pickle
+import os
+import tempfile
+import argparse
+import itertools as it
+from collections import OrderedDict, Mapping
+import gtf
+import gtf_cache
+from bgzf import BgzfWriter, BgzfReader
+import gene_index
+from gene_index import IntervalIndex
+
+# for logging purposes
+import logging
+import time
+
+BGZF_EXT = '.bgz'  # extension of the block compressed GTF
+INDEX_EXT = '.gidx'  # extension of the gene index (appended to the BGZF path)
+INDEX_VERSION = 1
+
+
+def index_path(bgz_path):
+    return bgz_path + INDEX_EXT
+
+
+def build_index(gtf_path, bgz_path=None, memory=1536, workers=1, tmp_dir=None):
+    """
+    Sort the exons of a GTF, write them as BGZF and save an index of where
+    each gene is. The index file holds a header pickle (describing the
+    source GTF) followed by a pickle of the gene spans/offsets. Returns the
+    path to the BGZF file.
+    """
+    bgz_path = bgz_path if bgz_path else gtf_path + BGZF_EXT
+    logging.debug('Building indexed annotation %s from %s . . .' % (bgz_path, gtf_path))
+    begin_time = time.time()
+    header = gtf_cache.make_header(gtf_path, None)
+
+    # sort GTF so each gene's lines are contiguous
+    tmp_handle, sorted_path = tempfile.mkstemp(suffix='.gtf', dir=tmp_dir)
+    os.close(tmp_handle)
+    try:
+        gtf.sort_gtf(gtf_path, sorted_path, memory=memory, workers=workers, tmp_dir=tmp_dir)
+
+        # write one gene at a time recording its span and virtual offset
+        genes = {}
+        writer = BgzfWriter(bgz_path)
+        with open(sorted_path, 'rb') as handle:
+            gene_lines = it.groupby(handle, lambda line: gtf.gtf_sort_key(line.rstrip('\n').split('\t', gtf.ATTRIBUTE))[:2])
+            for (chr, gene_id), lines in gene_lines:
+                lines = list(lines)
+                exons = list(gtf.exon_reader(lines))
+                voffset = writer.tell()
+                writer.write(''.join(lines))
+                genes.setdefault(chr, {})[gene_id] = (exons[0].strand,
+                                                      min(exon.start for exon in exons),
+                                                      max(exon.end for exon in exons),
+                                                      voffset,
+                                                      sum(len(line) for line in lines))
+        writer.close()
+    finally:
+        os.remove(sorted_path)
+
+    with open(index_path(bgz_path), 'wb') as handle:
+        pickle.dump({'version': INDEX_VERSION, 'source': header}, handle, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(genes, handle, pickle.HIGHEST_PROTOCOL)
+    logging.debug('Finished building %s in %.2f seconds' % (bgz_path, time.time() - begin_time))
+    return bgz_path
+
+
+def is_index_valid(gtf_path, bgz_path):
+    """Check the index exists and was built from the current GTF."""
+    if not os.path.exists(bgz_path) or not os.path.exists(index_path(bgz_path)):
+        return False
+    try:
+        with open(index_path(bgz_path), 'rb') as handle:
+            header = pickle.load(handle)  # only read the header, not the genes
+    except (EOFError, IOError, pickle.UnpicklingError):
+        return False
+    return header.get('version') == INDEX_VERSION and gtf_cache.is_valid(header['source'], gtf_path, None)
+
+
+def open_annotation(gtf_path, memory=1536, workers=1, tmp_dir=None):
+    """
+    Return an IndexedAnnotation for a GTF, building the BGZF file and index
+    next to the GTF if they are missing or out of date. A path to an
+    already built BGZF file can also be given.
+    """
+    if gtf_path.endswith(BGZF_EXT) and os.path.exists(index_path(gtf_path)):
+        return IndexedAnnotation(gtf_path)
+    bgz_path = gtf_path + BGZF_EXT
+    if not is_index_valid(gtf_path, bgz_path):
+        build_index(gtf_path, bgz_path, memory=memory, workers=workers, tmp_dir=tmp_dir)
+    else:
+        logging.debug('Using existing indexed annotation %s' % bgz_path)
+    return IndexedAnnotation(bgz_path)
+
+
+class IndexedChromosome(Mapping):
+    """
+    Read-only mapping view of the genes on one chromosome of an
+    IndexedAnnotation, i.e. annotation[chr][gene_id] fetches a single gene.
+    """
+    def __init__(self, annotation, chr):
+        self.annotation = annotation
+        self.chr = chr
+
+    def __getitem__(self, gene_id):
+        return self.annotation.fetch_gene(self.chr, gene_id)
+
+    def __contains__(self, gene_id):
+        return gene_id in self.annotation.offsets[self.chr]
+
+    def __iter__(self):
+        return iter(self.annotation.offsets[self.chr])
+
+    def __len__(self):
+        return len(self.annotation.offsets[self.chr])
+
+
+class IndexedAnnotation(Mapping):
+    """
+    Same queries as gene_index.GeneAnnotation but genes are only read from
+    the BGZF file when they are needed. Up to max_genes parsed genes are kept
+    in memory (least recently used genes are dropped first). It is a
+    read-only mapping of chr to IndexedChromosome and, like
+    compact_annotation.CompactAnnotation, returns a copy of a gene so
+    callers may change it without changing the cached gene.
+    """
+    def __init__(self, bgz_path, max_genes=1000):
+        logging.debug('Opening indexed annotation %s' % bgz_path)
+        with open(index_path(bgz_path), 'rb') as handle:
+            header = pickle.load(handle)
+            genes = pickle.load(handle)
+        self.path = bgz_path
+        self.reader = BgzfReader(bgz_path)
+        self.max_genes = max_genes
+        self.genes = OrderedDict()  # (chr, gene_id) -> gene, in order of use
+        self.offsets = {}
+        spans = {}
+        for chr in genes:
+            self.offsets[chr] = {}
+            for gene_id, (strand, start, end, voffset, nbytes) in genes[chr].iteritems():
+                self.offsets[chr][gene_id] = (voffset, nbytes)
+                spans.setdefault((chr, strand), []).append((start, end, gene_id))
+        self.gene_index = dict((key, IntervalIndex(spans[key])) for key in spans)
+
+    def __getitem__(self, chr):
+        if chr not in self.offsets:
+            raise KeyError(chr)
+        return IndexedChromosome(self, chr)
+
+    def __contains__(self, chr):
+        return chr in self.offsets
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def fetch_gene(self, chr, gene_id):
+        """Copy of a single gene, read and parsed from the BGZF file unless cached."""
+        return gene_index.copy_gene(self.cached_gene(chr, gene_id))
+
+    def cached_gene(self, chr, gene_id):
+        """The cached gene dictionary of fetch_gene, which must not be changed."""
+        key = (chr, gene_id)
+        if key in self.genes:
+            gene = self.genes.pop(key)
+        else:
+            voffset, nbytes = self.offsets[chr][gene_id]
+            lines = self.reader.read(voffset, nbytes).splitlines(True)
+            tmp = gene_index.GeneAnnotation()
+            for tx_id, tx in it.groupby(gtf.exon_reader(lines), lambda x: x.transcript_id):
+                tmp.add_transcript(list(tx))
+            gene = tmp[chr][gene_id]
+        self.genes[key] = gene
+        if len(self.genes) > self.max_genes: self.genes.popitem(last=False)
+        return gene
+
+    def overlapping_genes(self, chr, strand, start, end):
+        """
+        Gene keys of genes on strand overlapping or touching [start, end],
+        i.e. genes with start <= end and end >= start like the scan of
+        genes that the interval index replaced.
+        """
+        if (chr, strand) not in self.gene_index:
+            return []
+        return self.gene_index[(chr, strand)].overlap(start - 1, end + 1)
+
+    def containing_genes(self, chr, strand, start, end):
+        """Gene keys of genes on strand that completely contain [start, end)."""
+        if (chr, strand) not in self.gene_index:
+            return []
+        return self.gene_index[(chr, strand)].contain(start, end)
+
+    def exon_genes(self, chr, strand, start, end):
+        """Gene keys of genes with an annotated exon at exactly [start, end)."""
+        return [gene_id for gene_id in self.containing_genes(chr, strand, start, end)
+                if (start, end) in self.cached_gene(chr, gene_id)['exons']]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sort, block compress and index a GTF for use with primer.py --indexed-gtf')
+    parser.add_argument('-i', required=True, dest='gtf', action='store', help='path to gtf file')
+    parser.add_argument('-o', default='', dest='output', action='store', help='path of the block compressed gtf (Default: <gtf>.bgz)')
+    parser.add_argument('-m', '--memory', type=int, default=1536, dest='memory', action='store', help='memory budget in MB for sorting (Default: 1536)')
+    parser.add_argument('-w', '--workers', type=int, default=1, dest='workers', action='store', help='number of processes used to sort the gtf (Default: 1)')
+    options = vars(parser.parse_args())
+
+    output = build_index(options['gtf'], options['output'], options['memory'], options['workers'])
+    print 'Wrote %s and %s' % (output, index_path(output))
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: bam.py
+Author: Collin Tokheim
+Description: Reads the alignments of a sorted, indexed BAM file that overlap
+a region without calling out to java. The BAM header and the BAI index are
+read once when a :class:`~bam.BamReader` is created and the file handle is
+kept open so each region query only decompresses the BGZF blocks the index
+points at. :func:`~bam.iter_alignments` instead streams every alignment of a
+BAM file, which does not have to be sorted or indexed, or the alignments of
+one part of it (see :func:`~bam.block_ranges`). See the SAM specification
+for the BAM and BAI formats.
+'''
+import struct
+import os
+import bgzf
+from bgzf import BgzfReader
+
+# CIGAR operations
+CIGAR_M, CIGAR_I, CIGAR_D, CIGAR_N, CIGAR_S, CIGAR_H, CIGAR_P, CIGAR_EQ, CIGAR_X = range(9)
+REFERENCE_OPS = set([CIGAR_M, CIGAR_D, CIGAR_N, CIGAR_EQ, CIGAR_X])  # ops that consume the reference
+
+FLAG_UNMAPPED = 0x4
+BAM_RECORD = struct.Struct('<iiBBHHHiiii')  # fixed length fields of an alignment
+INT32 = struct.Struct('<i')
+LINEAR_SHIFT = 14  # the linear index has one offset per 16kb window
+PSEUDO_BIN = 37450  # bin holding index metadata instead of chunks
+NAME_CHARS = ''.join(chr(c) for c in range(33, 127))  # characters allowed in a read name
+RECORD_CHAIN = 4  # consecutive valid records needed to guess where an alignment starts
+GUESS_SIZE = 2 ** 18  # bytes read past the start of a block when guessing an alignment start
+
+
+class BamError(Exception):
+    """Raised when a BAM or BAI file can not be read."""
+    pass
+
+
+def index_path(bam_path):
+    """Path to the BAI index of a BAM file or None if there is no index."""
+    for path in (bam_path + '.bai', bam_path[:-4] + '.bai'):
+        if os.path.exists(path):
+            return path
+    return None
+
+
+def reg2bins(start, end):
+    """The bins that may hold alignments overlapping [start, end)."""
+    end -= 1
+    bins = [0]
+    for shift, offset in ((26, 1), (23, 9), (20, 73), (17, 585), (14, 4681)):
+        bins.extend(range(offset + (start >> shift), offset + (end >> shift) + 1))
+    return bins
+
+
+def read_header(reader):
+    """
+    Read the header at the start of a BAM file from a BgzfReader. Returns the
+    header text and a list of (name, length) pairs for the references.
+    """
+    if reader.read_bytes(4) != 'BAM\1':
+        raise BamError('%s is not a BAM file' % reader.handle.name)
+    l_text = INT32.unpack(reader.read_bytes(4))[0]
+    header_text = reader.read_bytes(l_text)
+    n_ref = INT32.unpack(reader.read_bytes(4))[0]
+    references = []
+    for i in range(n_ref):
+        l_name = INT32.unpack(reader.read_bytes(4))[0]
+        name = reader.read_bytes(l_name).rstrip('\0')
+        l_ref = INT32.unpack(reader.read_bytes(4))[0]
+        references.append((name, l_ref))
+    return header_text, references
+
+
+def junction_blocks(cigar, anchor=0):
+    """
+    Lengths of the M blocks and N gaps of a read given as a list of
+    (operation, length) CIGAR pairs. Returns None for reads with other
+    operations, without a junction or without a junction that has M blocks of
+    at least anchor on both sides (the reads jct_counts.py does not count).
+    """
+    incs, skips = [], []
+    for op, length in cigar:
+        if op == CIGAR_M:
+            incs.append(length)
+        elif op == CIGAR_N:
+            skips.append(length)
+        else:
+            return None
+    for i in range(len(incs) - 1):
+        if i < len(skips) and incs[i] >= anchor and incs[i+1] >= anchor:
+            return incs, skips
+    return None
+
+
+def is_record(data, pos, n_ref):
+    """
+    True if the bytes of data at pos look like the start of an alignment
+    record of a BAM file with n_ref references. Records that run past the
+    end of data are only checked as far as data goes.
+    """
+    if pos + 4 + BAM_RECORD.size > len(data):
+        return pos + 4 <= len(data)
+    block_size = INT32.unpack_from(data, pos)[0]
+    ref_id, ref_pos, l_read_name, mapq, bin, n_cigar_op, flag, l_seq, next_ref_id, next_pos, tlen = \
+        BAM_RECORD.unpack_from(data, pos + 4)
+    name_start = pos + 4 + BAM_RECORD.size
+    name_end = min(name_start + l_read_name, len(data) + 1)
+    return -1 <= ref_id < n_ref and -1 <= next_ref_id < n_ref and ref_pos >= -1 and next_pos >= -1 and \
+        l_read_name > 1 and l_seq >= 0 and \
+        BAM_RECORD.size + l_read_name + 4 * n_cigar_op + (l_seq + 1) // 2 + l_seq <= block_size and \
+        data[name_end - 1:name_end] in ('\0', '') and not data[name_start:name_end - 1].translate(None, NAME_CHARS)
+
+
+def block_ranges(bam_path, chunk_size):
+    """
+    Split a BAM (or any BGZF) file into (start, stop) ranges of compressed
+    offsets of about chunk_size bytes that start and stop at block starts.
+    """
+    size = os.path.getsize(bam_path)
+    starts = sorted(set(bgzf.find_block(bam_path, offset) for offset in range(0, size, chunk_size)))
+    return zip(starts, starts[1:] + [size])
+
+
+def guess_record_start(bam_path, block_offset):
+    """
+    Virtual offset of the first alignment that starts in the BGZF block at
+    block_offset, or None if none is found. The first alignment after the
+    header is known exactly. Within other blocks the first offset followed by
+    RECORD_CHAIN valid looking records (see is_record) is only a guess, so
+    callers have to check it against the end of the previous alignment.
+    """
+    reader = BgzfReader(bam_path)
+    try:
+        header_text, references = read_header(reader)
+        header_end = reader.tell()
+        if block_offset << 16 <= header_end:
+            return header_end
+        reader.seek(block_offset << 16)
+        block_size = len(reader.data)
+        data = reader.read_bytes(block_size + GUESS_SIZE)
+        for start in xrange(block_size):
+            pos = start
+            for i in range(RECORD_CHAIN):
+                if pos + 4 > len(data) or not is_record(data, pos, len(references)): break
+                pos += 4 + INT32.unpack_from(data, pos)[0]
+            else:
+                return (block_offset << 16) | start
+            if pos + 4 > len(data) and pos > start:
+                return (block_offset << 16) | start  # valid up to the end of the data read
+        return None
+    finally:
+        reader.close()
+
+
+def iter_alignments(bam_path, anchor=None, stats=None, start=None, stop=None):
+    """
+    Iterate over the mapped alignments of a whole BAM file in file order.
+    Each alignment is yielded as a tuple of the reference name, the 0-based
+    position and a list of (operation, length) CIGAR pairs. If anchor is
+    given only reads with a countable junction are yielded (see
+    junction_blocks) and reads with less than three CIGAR operations are
+    skipped without decoding their CIGAR. The number of records scanned and
+    kept is added to the stats dict if one is given.
+
+    Only part of the file is read if the virtual offsets of the first
+    alignment (start) or of the alignment to stop before (stop) are given.
+    In that case the alignments that start before stop are read and the
+    virtual offset right after the last one is stored as stats['offset'].
+    """
+    reader = BgzfReader(bam_path)
+    scanned, kept = 0, 0
+    try:
+        header_text, references = read_header(reader)
+        names = [name for name, l_ref in references]
+        min_ops = 0 if anchor is None else 3
+        if start is not None: reader.seek(start)
+        while stop is None or reader.tell() < stop:
+            block_size = reader.read_bytes(4)
+            if len(block_size) < 4: break
+            data = reader.read_bytes(INT32.unpack(block_size)[0])
+            scanned += 1
+            ref_id, pos, l_read_name, mapq, bin, n_cigar_op, flag = BAM_RECORD.unpack_from(data)[:7]
+            if flag & FLAG_UNMAPPED or ref_id < 0 or n_cigar_op < min_ops: continue
+            cigar = [(op & 0xf, op >> 4) for op in
+                     struct.unpack_from('<%dI' % n_cigar_op, data, BAM_RECORD.size + l_read_name)]
+            if anchor is not None and junction_blocks(cigar, anchor) is None: continue
+            kept += 1
+            yield names[ref_id], pos, cigar
+    finally:
+        if stats is not None:
+            stats['scanned'] = stats.get('scanned', 0) + scanned
+            stats['kept'] = stats.get('kept', 0) + kept
+            stats['offset'] = reader.tell()
+        reader.close()
+
+
+def read_index(bai_path):
+    """
+    Read a BAI index. Returns a list with a (bins, linear index) pair for
+    each reference where bins maps bin number to a list of (start, end)
+    virtual offset chunks.
+    """
+    with open(bai_path, 'rb') as handle:
+        data = handle.read()
+    if data[:4] != 'BAI\1':
+        raise BamError('%s is not a BAI index' % bai_path)
+    n_ref = INT32.unpack_from(data, 4)[0]
+    pos = 8
+    index = []
+    for i in range(n_ref):
+        bins = {}
+        n_bin = INT32.unpack_from(data, pos)[0]
+        pos += 4
+        for j in range(n_bin):
+            bin, n_chunk = struct.unpack_from('<Ii', data, pos)
+            pos += 8
+            offsets = struct.unpack_from('<%dQ' % (2 * n_chunk), data, pos)
+            pos += 16 * n_chunk
+            if bin != PSEUDO_BIN:
+                bins[bin] = zip(offsets[::2], offsets[1::2])
+        n_intv = INT32.unpack_from(data, pos)[0]
+        pos += 4
+        linear_index = struct.unpack_from('<%dQ' % n_intv, data, pos)
+        pos += 8 * n_intv
+        index.append((bins, linear_index))
+    return index
+
+
+class BamReader(object):
+    """
+    Random access to a coordinate sorted BAM file with a BAI index.
+    """
+    def __init__(self, bam_path, bai_path=None):
+        self.path = bam_path
+        bai_path = bai_path if bai_path else index_path(bam_path)
+        if bai_path is None:
+            raise BamError('%s does not have a BAI index' % bam_path)
+        self.reader = BgzfReader(bam_path)
+        self.__read_header()
+        self.index = read_index(bai_path)
+
+    def __read_header(self):
+        """Read the reference names from the BAM header."""
+        self.header_text, self.references = read_header(self.reader)
+        self.tids = dict((name, tid) for tid, (name, l_ref) in enumerate(self.references))
+
+    def chunks(self, tid, start, end):
+        """Merged virtual offset chunks that may hold alignments in [start, end)."""
+        if tid >= len(self.index):
+            return []
+        bins, linear_index = self.index[tid]
+        min_offset = 0
+        if linear_index:
+            min_offset = linear_index[min(start >> LINEAR_SHIFT, len(linear_index) - 1)]
+        chunks = sorted(chunk for bin in reg2bins(start, end) if bin in bins
+                        for chunk in bins[bin] if chunk[1] > min_offset)
+        merged = []
+        for chunk_start, chunk_end in chunks:
+            if merged and chunk_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], chunk_end)
+            else:
+                merged.append([chunk_start, chunk_end])
+        return merged
+
+    def fetch(self, chr, start, end, anchor=None, stats=None):
+        """
+        Iterate over the mapped alignments overlapping the 0-based, half-open
+        region [start, end) of chr. Each alignment is yielded as a tuple of
+        the 0-based position and a list of (operation, length) CIGAR pairs.
+        anchor and stats filter and count the records like iter_alignments.
+        """
+        reader = self.reader
+        scanned, kept = 0, 0
+        min_ops = 0 if anchor is None else 3
+        tid = self.tids.get(chr)
+        try:
+            if tid is None:
+                return
+            for chunk_start, chunk_end in self.chunks(tid, start, end):
+                reader.seek(chunk_start)
+                while reader.tell() < chunk_end:
+                    block_size = reader.read_bytes(4)
+                    if len(block_size) < 4: break
+                    data = reader.read_bytes(INT32.unpack(block_size)[0])
+                    ref_id, pos, l_read_name, mapq, bin, n_cigar_op, flag = BAM_RECORD.unpack_from(data)[:7]
+                    if ref_id != tid or pos >= end:
+                        return  # sorted so nothing else overlaps
+                    scanned += 1
+                    if flag & FLAG_UNMAPPED or n_cigar_op < min_ops: continue
+                    cigar = [(op & 0xf, op >> 4) for op in
+                             struct.unpack_from('<%dI' % n_cigar_op, data, BAM_RECORD.size + l_read_name)]
+                    if pos + sum(length for op, length in cigar if op in REFERENCE_OPS) <= start: continue
+                    if anchor is not None and junction_blocks(cigar, anchor) is None: continue
+                    kept += 1
+                    yield pos, cigar
+        finally:
+            if stats is not None:
+                stats['scanned'] = stats.get('scanned', 0) + scanned
+                stats['kept'] = stats.get('kept', 0) + kept
+
+    def close(self):
+        self.reader.close()
@@ -20,6 +20,7 @@ import subprocess
 import traceback
 import os
 import ConfigParser
+import java_daemon
 
 
 class BaseBedWig(object):
@@ -37,6 +38,9 @@ class BaseBedWig(object):
         self.BIN_DIR = 'bin'
         cfg_options = dict(cfg.items('memory'))
         self.BIG_MEM = cfg_options['big']
+        # java calls ExtractBigRegion.jar for each region while daemon asks a
+        # long running ExtractDaemon.jar (see java_daemon.py)
+        self.BACKEND = cfg.get('backend', 'big') if cfg.has_option('backend', 'big') else 'java'
         self.ext = ext  # the file extension (either "bed" or "wig")
         if not os.path.exists(self.TMP_DIR + '/' + self.ext):
             os.mkdir(self.TMP_DIR + '/' + self.ext)  # mkdir in case it doesn't exist
@@ -57,14 +61,34 @@ class BaseBedWig(object):
         self.end = None
 
     def extractBigRegion(self, chr, start, end, strand='+'):
+        self.strand, self.chr, self.start, self.end = strand, chr, start, end  # hold on to target information just in case
+        self.current_file = self.TMP_DIR + '/%s/%s_%d_%d.%s' % (self.ext, self.chr, self.start, self.end, self.ext)  # path to current bed file the class is working on
+        if self.BACKEND == 'daemon' and java_daemon.is_available():
+            try:
+                return self.__extract_with_daemon(chr, start, end)
+            except java_daemon.DaemonError:
+                logging.debug('%s. Extracting with ExtractBigRegion.jar instead' % sys.exc_info()[1])
+        self.__extract_with_jar(chr, start, end)
+
+    def __extract_with_daemon(self, chr, start, end):
+        """Write the region to self.current_file using the ExtractDaemon.jar process for self.bbfile"""
+        logging.debug('Extracting %s lines overlaping %s:%d-%d' % (self.ext, chr, start, end))
+        daemon = java_daemon.get_daemon(self.bbfile, self.BIG_MEM)
+        # ExtractBigRegion.jar compares the contained argument with == so
+        # partially overlapping features were always extracted
+        lines = daemon.query([(chr, start, end, 'false')])[0]
+        with open(self.current_file, 'w') as handle:
+            for line in lines:
+                handle.write(line + '\n')
+        logging.debug('Finished extracting %s lines for %s:%d-%d' % (self.ext, chr, start, end))
+
+    def __extract_with_jar(self, chr, start, end):
         try:
             logging.debug('Extracting %s lines overlaping %s:%d-%d' % (self.ext, chr, start, end))
-            cmd = 'java -jar -Xmx%sm "%s/ExtractBigRegion.jar" "%s" "%s/%s/%s_%d_%d.%s" %s %d %d true' % (
-                self.BIG_MEM, self.BIN_DIR, self.bbfile, self.TMP_DIR, self.ext, chr, start, end, self.ext, chr, start, end)
+            cmd = 'java -jar -Xmx%sm "%s/ExtractBigRegion.jar" "%s" "%s" %s %d %d true' % (
+                self.BIG_MEM, self.BIN_DIR, self.bbfile, self.current_file, chr, start, end)
             logging.debug('CMD is [%s]' % cmd)
             subprocess.check_call(cmd, shell=True)  # call to ExtractBigRegion.jar
-            self.strand, self.chr, self.start, self.end = strand, chr, start, end  # hold on to target information just in case
-            self.current_file = self.TMP_DIR + '/%s/%s_%d_%d.%s' % (self.ext, self.chr, self.start, self.end, self.ext)  # path to current bed file the class is working on
             logging.debug('Finished extracting %s lines for %s:%d-%d' % (self.ext, chr, start, end))
         except subprocess.CalledProcessError:
             t, v, trace = sys.exc_info()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: bgzf.py
+Author: Collin Tokheim
+Description: Reading and writing BGZF, the block gzip format used by BAM
+files and bgzip/tabix. Positions in a BGZF file are virtual offsets, i.e.
+the file offset of a compressed block << 16 | the offset within the
+uncompressed block. :func:`~bgzf.find_block` finds block starts from an
+arbitrary file offset so a BGZF file can be split between processes.
+'''
+from collections import OrderedDict
+import struct
+import zlib
+import os
+
+# BGZF constants (see the SAM specification)
+BGZF_MAX_BLOCK = 0xff00  # max uncompressed bytes per block
+BGZF_HEADER = struct.Struct('<4BI2BH2BHH')  # gzip header with the BC extra field
+GZIP_HEADER = struct.Struct('<4BI2BH')  # gzip header up to XLEN
+EXTRA_SUBFIELD = struct.Struct('<2BH')  # SI1, SI2, SLEN
+BGZF_FOOTER = struct.Struct('<II')  # crc32, uncompressed size
+BGZF_MAGIC = '\x1f\x8b\x08\x04'  # gzip id, deflate and FEXTRA flag at the start of each block
+SEARCH_SIZE = 2 ** 17  # bytes read at a time when looking for a block start
+BGZF_EOF = '\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00'
+
+
+class BgzfError(Exception):
+    """Raised when a file is not valid BGZF."""
+    pass
+
+
+def is_block_start(handle, offset, size):
+    """
+    True if a BGZF block header (with the BC subfield first, like every BGZF
+    writer) starts at offset of an open file of size bytes and is followed
+    by another block header or the end of the file.
+    """
+    handle.seek(offset)
+    header = handle.read(BGZF_HEADER.size)
+    if len(header) < BGZF_HEADER.size or not header.startswith(BGZF_MAGIC):
+        return False
+    xlen, si1, si2, slen, bsize = BGZF_HEADER.unpack(header)[7:]
+    if xlen < EXTRA_SUBFIELD.size + 2 or si1 != 66 or si2 != 67 or slen != 2:
+        return False
+    next_offset = offset + bsize + 1
+    if next_offset >= size:
+        return next_offset == size
+    handle.seek(next_offset)
+    return handle.read(len(BGZF_MAGIC)) == BGZF_MAGIC
+
+
+def find_block(path, offset):
+    """
+    Compressed offset of the first BGZF block that starts at or after offset
+    or the file size if there is none.
+    """
+    size = os.path.getsize(path)
+    with open(path, 'rb') as handle:
+        while offset < size:
+            handle.seek(offset)
+            window = handle.read(SEARCH_SIZE)
+            pos = window.find(BGZF_MAGIC)
+            while pos >= 0:
+                if is_block_start(handle, offset + pos, size):
+                    return offset + pos
+                pos = window.find(BGZF_MAGIC, pos + 1)
+            offset += max(len(window) - len(BGZF_MAGIC) + 1, 1)
+    return size
+
+
+class BgzfWriter(object):
+    """
+    Writes BGZF blocks. tell() returns the virtual offset (compressed offset
+    of the block << 16 | offset within the uncompressed block) that the next
+    write will start at.
+    """
+    def __init__(self, path, level=6):
+        self.handle = open(path, 'wb')
+        self.level = level
+        self.buffer = ''
+        self.block_offset = 0
+
+    def tell(self):
+        return (self.block_offset << 16) | len(self.buffer)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= BGZF_MAX_BLOCK:
+            self.__write_block(self.buffer[:BGZF_MAX_BLOCK])
+            self.buffer = self.buffer[BGZF_MAX_BLOCK:]
+
+    def __write_block(self, data):
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)  # raw deflate
+        cdata = compressor.compress(data) + compressor.flush()
+        bsize = BGZF_HEADER.size + len(cdata) + BGZF_FOOTER.size - 1
+        self.handle.write(BGZF_HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, bsize))
+        self.handle.write(cdata)
+        self.handle.write(BGZF_FOOTER.pack(zlib.crc32(data) & 0xffffffff, len(data)))
+        self.block_offset += bsize + 1
+
+    def close(self):
+        if self.buffer:
+            self.__write_block(self.buffer)
+            self.buffer = ''
+        self.handle.write(BGZF_EOF)
+        self.handle.close()
+
+
+class BgzfReader(object):
+    """
+    Reads uncompressed bytes from a BGZF file. Either read a given number of
+    bytes at a virtual offset with read or use seek/tell/read_bytes to
+    stream through the file. The most recently used blocks are cached.
+    """
+    def __init__(self, path, cache_size=16):
+        self.handle = open(path, 'rb')
+        self.cache_size = cache_size
+        self.block_cache = OrderedDict()  # compressed offset -> (data, next offset)
+        self.block_offset, self.within_offset = 0, 0
+        self.data, self.next_offset = self.__read_block(0)
+
+    def __read_block(self, block_offset):
+        if block_offset in self.block_cache:
+            return self.block_cache[block_offset]
+        self.handle.seek(block_offset)
+        header = self.handle.read(GZIP_HEADER.size)
+        if not header:
+            return '', block_offset  # end of file
+        id1, id2, cm, flg, mtime, xfl, os_, xlen = GZIP_HEADER.unpack(header)
+        if id1 != 31 or id2 != 139 or not flg & 4:
+            raise BgzfError('%s is not BGZF (bad block header at %d)' % (self.handle.name, block_offset))
+
+        # find the BC subfield holding the block size
+        extra, bsize, pos = self.handle.read(xlen), None, 0
+        while pos < xlen:
+            si1, si2, slen = EXTRA_SUBFIELD.unpack_from(extra, pos)
+            if si1 == 66 and si2 == 67:
+                bsize = struct.unpack_from('<H', extra, pos + EXTRA_SUBFIELD.size)[0]
+            pos += EXTRA_SUBFIELD.size + slen
+        if bsize is None:
+            raise BgzfError('%s is not BGZF (no block size at %d)' % (self.handle.name, block_offset))
+
+        cdata = self.handle.read(bsize + 1 - GZIP_HEADER.size - xlen - BGZF_FOOTER.size)
+        self.handle.read(BGZF_FOOTER.size)
+        block = (zlib.decompress(cdata, -15), block_offset + bsize + 1)
+        self.block_cache[block_offset] = block
+        if len(self.block_cache) > self.cache_size: self.block_cache.popitem(last=False)
+        return block
+
+    def seek(self, virtual_offset):
+        self.block_offset, self.within_offset = virtual_offset >> 16, virtual_offset & 0xffff
+        self.data, self.next_offset = self.__read_block(self.block_offset)
+
+    def tell(self):
+        if self.within_offset >= len(self.data) and self.data:
+            return self.next_offset << 16  # the end of a block is the start of the next one
+        return (self.block_offset << 16) | self.within_offset
+
+    def read_bytes(self, size):
+        """Read up to size bytes from the current position."""
+        pieces, total = [], 0
+        while total < size:
+            piece = self.data[self.within_offset:self.within_offset + size - total]
+            if piece:
+                pieces.append(piece)
+                total += len(piece)
+                self.within_offset += len(piece)
+            if total < size:
+                if self.next_offset == self.block_offset: break  # reached the end of the file
+                self.block_offset, self.within_offset = self.next_offset, 0
+                self.data, self.next_offset = self.__read_block(self.block_offset)
+        return ''.join(pieces)
+
+    def read(self, virtual_offset, size):
+        """Read size bytes starting at virtual_offset."""
+        self.seek(virtual_offset)
+        return self.read_bytes(size)
+
+    def close(self):
+        self.handle.close()
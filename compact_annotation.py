@@ -0,0 +1,439 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: compact_annotation.py
+Author: Collin Tokheim
+Description: Array backed gene models. Instead of holding every transcript as
+a list of tuples (and every gene's exons as a set of tuples) each chromosome
+keeps a few NumPy arrays:
+
+    * exon_starts/exon_ends: int32 coordinates of each unique exon sorted by
+      position, so an exon is identified by its position in these arrays
+    * tx_exons/tx_offsets: exon ids of every transcript stored back to back,
+      transcript t has exons tx_exons[tx_offsets[t]:tx_offsets[t+1]]
+    * gene_tx_offsets: the transcripts of gene g are
+      gene_tx_offsets[g] to gene_tx_offsets[g+1]
+
+:class:`~compact_annotation.CompactAnnotation` answers the same queries as
+:class:`~gene_index.GeneAnnotation`. annotation[chr][gene_id] builds the
+usual gene dictionary (graph, exons, strand, chr, start, end) on demand and
+keeps the most recently used ones around. Both are read-only mappings, so
+every lookup returns a new copy of the gene dictionary and changing it never
+changes the annotation.
+
+Running this script reports the load time and memory of a GTF read into a
+dict based gene_index.GeneAnnotation and into a CompactAnnotation.
+:class:`~compact_annotation.LazyAnnotation` does the same but only reads a
+chromosome from the GTF when it is first used.
+'''
+from array import array
+from collections import OrderedDict, Mapping
+import itertools as it
+import argparse
+import multiprocessing
+import sys
+import numpy as np
+import gtf
+import gene_index
+from gene_index import IntervalIndex, copy_gene
+
+# for logging purposes
+import logging
+import time
+
+# open_lazy_annotation gives up if seqnames are split into more ranges than this on average
+MAX_BLOCKS_PER_SEQNAME = 8
+
+
+class CompactChromosome(Mapping):
+    """
+    Gene models of a single chromosome. Transcripts are appended with
+    add_transcript and packed into arrays by finish. Once packed it is a
+    read-only mapping of gene_id to gene dictionary. The max_genes most
+    recently used dictionaries are cached and a copy is returned, so callers
+    may change it (e.g. set 'target') without changing the cached gene.
+    """
+    def __init__(self, chr, max_genes=100):
+        self.chr = chr
+        self.max_genes = max_genes
+        self.packed = False  # set by finish
+        self.genes = OrderedDict()  # gene_id -> gene dictionary, in order of use
+        self.gene_ids = []
+        self.gene_lookup = {}  # gene_id -> position in the gene arrays
+        self.gene_strands = []
+
+        # transcripts are buffered in compact python arrays until finish
+        self._starts, self._ends = array('i'), array('i')
+        self._tx_lengths, self._tx_genes = array('i'), array('i')
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['genes'] = OrderedDict()  # do not pickle the gene dictionaries
+        return state
+
+    def __getitem__(self, gene_id):
+        if gene_id in self.genes:
+            gene = self.genes.pop(gene_id)
+        else:
+            gene = self.gene(gene_id)
+        self.genes[gene_id] = gene
+        if len(self.genes) > self.max_genes: self.genes.popitem(last=False)
+        return copy_gene(gene)
+
+    def __contains__(self, gene_id):
+        return gene_id in self.gene_lookup
+
+    def __iter__(self):
+        return iter(self.gene_ids)
+
+    def __len__(self):
+        return len(self.gene_ids)
+
+    def add_transcript(self, gene_id, strand, tx_path):
+        """Buffer a transcript given as a sorted list of (start, end) exons."""
+        g = self.gene_lookup.get(gene_id)
+        if g is None:
+            g = self.gene_lookup[gene_id] = len(self.gene_ids)
+            self.gene_ids.append(gene_id)
+            self.gene_strands.append(strand)
+        for start, end in tx_path:
+            self._starts.append(start)
+            self._ends.append(end)
+        self._tx_lengths.append(len(tx_path))
+        self._tx_genes.append(g)
+
+    def finish(self):
+        """Pack the buffered transcripts into arrays."""
+        # intern exons by sorting the unique (start, end) pairs
+        keys = (np.array(self._starts, dtype=np.int64) << 32) | np.array(self._ends, dtype=np.int64)
+        exon_keys, exon_ids = np.unique(keys, return_inverse=True)
+        self.exon_keys = exon_keys
+        self.exon_starts = (exon_keys >> 32).astype(np.int32)
+        self.exon_ends = (exon_keys & 0xffffffff).astype(np.int32)
+
+        # group transcripts by gene while keeping the GTF order within a gene
+        tx_lengths = np.array(self._tx_lengths, dtype=np.int64)
+        tx_genes = np.array(self._tx_genes, dtype=np.int64)
+        old_offsets = np.concatenate(([0], np.cumsum(tx_lengths)))
+        order = np.argsort(tx_genes, kind='mergesort')
+        lengths = tx_lengths[order]
+        offsets = np.concatenate(([0], np.cumsum(lengths)))
+        positions = np.repeat(old_offsets[order] - offsets[:-1], lengths) + np.arange(offsets[-1])
+        self.tx_exons = exon_ids[positions].astype(np.int32)
+        self.tx_offsets = offsets.astype(np.int32)
+        gene_counts = np.bincount(tx_genes, minlength=len(self.gene_ids))
+        self.gene_tx_offsets = np.concatenate(([0], np.cumsum(gene_counts))).astype(np.int32)
+
+        # exons of a transcript are sorted so the first/last exon give its span
+        tx_starts = self.exon_starts[self.tx_exons[self.tx_offsets[:-1]]]
+        tx_ends = self.exon_ends[self.tx_exons[self.tx_offsets[1:] - 1]]
+        self.gene_starts = np.minimum.reduceat(tx_starts, self.gene_tx_offsets[:-1])
+        self.gene_ends = np.maximum.reduceat(tx_ends, self.gene_tx_offsets[:-1])
+
+        del self._starts, self._ends, self._tx_lengths, self._tx_genes
+        self.packed = True
+
+    def gene_span(self, gene_id):
+        """(strand, start, end) of a gene without building its dictionary."""
+        g = self.gene_lookup[gene_id]
+        return self.gene_strands[g], int(self.gene_starts[g]), int(self.gene_ends[g])
+
+    def gene(self, gene_id):
+        """Build the gene dictionary used by the rest of PrimerSeq."""
+        g = self.gene_lookup[gene_id]
+        offsets = self.tx_offsets[self.gene_tx_offsets[g]:self.gene_tx_offsets[g + 1] + 1].tolist()
+        ids = self.tx_exons[offsets[0]:offsets[-1]]
+        exons = zip(self.exon_starts[ids].tolist(), self.exon_ends[ids].tolist())
+        graph = [exons[i - offsets[0]:j - offsets[0]] for i, j in zip(offsets[:-1], offsets[1:])]
+        return {'chr': self.chr,
+                'strand': self.gene_strands[g],
+                'start': int(self.gene_starts[g]),
+                'end': int(self.gene_ends[g]),
+                'graph': graph,
+                'exons': set(exons)}
+
+    def has_exon(self, gene_id, start, end):
+        """Check if a gene has an exon at exactly [start, end)."""
+        key = (start << 32) | end
+        i = np.searchsorted(self.exon_keys, key)
+        if i == len(self.exon_keys) or self.exon_keys[i] != key:
+            return False
+        g = self.gene_lookup[gene_id]
+        ids = self.tx_exons[self.tx_offsets[self.gene_tx_offsets[g]]:self.tx_offsets[self.gene_tx_offsets[g + 1]]]
+        return bool((ids == i).any())
+
+
+class CompactAnnotation(Mapping):
+    """
+    Array backed replacement for :class:`~gene_index.GeneAnnotation`. Genes
+    are added with add_transcript and build_index must be called once all
+    transcripts are added. It is a read-only mapping of chr to
+    CompactChromosome.
+    """
+    def __init__(self, max_genes=100):
+        self.max_genes = max_genes
+        self.chromosomes = {}
+        self.gene_index = {}
+
+    def __getitem__(self, chr):
+        return self.chromosomes[chr]
+
+    def __contains__(self, chr):
+        return chr in self.chromosomes
+
+    def __iter__(self):
+        return iter(self.chromosomes)
+
+    def __len__(self):
+        return len(self.chromosomes)
+
+    def add_transcript(self, tx):
+        """
+        Add the exons (gtf.GtfExon) of a single transcript.
+        """
+        if len(tx) == 0: return  # no 'exon' feature case
+
+        # needs to be sorted because gtf files might not have them in proper order
+        tx_path = sorted([(exon.start, exon.end) for exon in tx], key=lambda x: (x[0], x[1]))
+        chr = tx[0].seqname
+        if chr not in self.chromosomes:
+            self.chromosomes[chr] = CompactChromosome(chr, self.max_genes)
+        self.chromosomes[chr].add_transcript(tx[0].gene_id, tx[0].strand, tx_path)
+
+    def add_chromosome(self, chrom):
+        """Add a CompactChromosome read elsewhere (e.g. by a worker process)."""
+        self.chromosomes[chrom.chr] = chrom
+
+    def index_chromosome(self, chrom):
+        """Pack a chromosome into arrays (if needed) and index its gene spans."""
+        if not chrom.packed: chrom.finish()
+        spans = {}
+        for gene_id in chrom.gene_ids:
+            strand, start, end = chrom.gene_span(gene_id)
+            spans.setdefault(strand, []).append((start, end, gene_id))
+        for strand in spans:
+            self.gene_index[(chrom.chr, strand)] = IntervalIndex(spans[strand])
+
+    def build_index(self):
+        """Pack each chromosome into arrays and index the gene spans."""
+        self.gene_index = {}
+        for chr in self.chromosomes:
+            self.index_chromosome(self.chromosomes[chr])
+
+    def overlapping_genes(self, chr, strand, start, end):
+        """
+        Gene keys of genes on strand overlapping or touching [start, end],
+        i.e. genes with start <= end and end >= start like the scan of
+        genes that the interval index replaced.
+        """
+        if (chr, strand) not in self.gene_index:
+            return []
+        return self.gene_index[(chr, strand)].overlap(start - 1, end + 1)
+
+    def containing_genes(self, chr, strand, start, end):
+        """Gene keys of genes on strand that completely contain [start, end)."""
+        if (chr, strand) not in self.gene_index:
+            return []
+        return self.gene_index[(chr, strand)].contain(start, end)
+
+    def exon_genes(self, chr, strand, start, end):
+        """Gene keys of genes with an annotated exon at exactly [start, end)."""
+        return [gene_id for gene_id in self.containing_genes(chr, strand, start, end)
+                if self.chromosomes[chr].has_exon(gene_id, start, end)]
+
+
+class LazyAnnotation(CompactAnnotation):
+    """
+    CompactAnnotation that only reads a chromosome from the GTF the first
+    time it is used. blocks maps each seqname to the byte ranges of the GTF
+    holding its lines (see gtf.seqname_blocks). If evict is True then
+    release(chr) drops a chromosome that is no longer needed.
+    """
+    def __init__(self, file_path, blocks, evict=False, max_genes=100):
+        super(LazyAnnotation, self).__init__(max_genes)
+        self.path = file_path
+        self.blocks = blocks
+        self.evict = evict
+        self.loaded = set()
+
+    def __getitem__(self, chr):
+        self.load(chr)
+        return self.chromosomes[chr]
+
+    def __contains__(self, chr):
+        return chr in self.blocks
+
+    def __iter__(self):
+        return iter(self.blocks)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def load(self, chr):
+        """Read the genes of chr from the GTF unless they are already loaded."""
+        if chr in self.loaded or chr not in self.blocks:
+            return
+        begin_time = time.time()
+        with open(self.path, 'rb') as handle:
+            read_lines = lambda: it.chain.from_iterable(gtf.read_range(handle, start, end)
+                                                        for start, end in self.blocks[chr])
+            gene_dict = read_gtf_lines(read_lines)
+        if chr in gene_dict:
+            self.add_chromosome(gene_dict[chr])
+            self.index_chromosome(gene_dict[chr])
+        self.loaded.add(chr)
+        logging.debug('Loaded %s from %s in %.2f seconds' % (chr, self.path, time.time() - begin_time))
+
+    def release(self, chr):
+        """Drop a loaded chromosome if eviction is turned on."""
+        if not self.evict or chr not in self.loaded:
+            return
+        self.loaded.remove(chr)
+        self.chromosomes.pop(chr, None)
+        for key in [key for key in self.gene_index if key[0] == chr]:
+            del self.gene_index[key]
+        logging.debug('Released %s of %s' % (chr, self.path))
+
+    def overlapping_genes(self, chr, strand, start, end):
+        """Gene keys of genes on strand overlapping or touching [start, end]."""
+        self.load(chr)
+        return super(LazyAnnotation, self).overlapping_genes(chr, strand, start, end)
+
+    def containing_genes(self, chr, strand, start, end):
+        """Gene keys of genes on strand that completely contain [start, end)."""
+        self.load(chr)
+        return super(LazyAnnotation, self).containing_genes(chr, strand, start, end)
+
+
+def read_gtf_lines(read_lines):
+    """
+    Build a :class:`~compact_annotation.CompactAnnotation` (not yet indexed)
+    from the GTF lines returned by read_lines(). Sorted lines are read in a
+    single pass while checking that exons are sorted. If an out of order exon
+    is found then read_lines() is called again and all exons are buffered and
+    sorted in memory instead.
+    """
+    gene_dict = CompactAnnotation()
+    try:
+        for tx_id, tx in it.groupby(gtf.sorted_exon_reader(read_lines()), lambda x: x.transcript_id):
+            gene_dict.add_transcript(list(tx))
+    except gtf.GtfSortError:
+        t, v, trace = sys.exc_info()
+        logging.debug('GTF file is not sorted (%s). Sorting exons in memory . . .' % str(v))
+        exons = sorted(gtf.exon_reader(read_lines()), key=gtf.exon_sort_key)
+        gene_dict = CompactAnnotation()
+        for tx_id, tx in it.groupby(exons, lambda x: x.transcript_id):
+            gene_dict.add_transcript(list(tx))
+        del exons
+    return gene_dict
+
+
+def read_gtf_chromosome(args):
+    """
+    Worker for :func:`~primer.read_gtf_parallel`. Reads the genes of a
+    single seqname from the byte range [start, end) of a GTF and returns
+    them as a packed :class:`~compact_annotation.CompactChromosome` (or
+    None if the range has no exons). GtfSortError is raised if the range
+    holds any other seqname.
+    """
+    file_path, seqname, start, end = args
+    with open(file_path, 'rb') as handle:
+        gene_dict = read_gtf_lines(lambda: gtf.read_range(handle, start, end))
+    if [chr for chr in gene_dict if chr != seqname]:
+        raise gtf.GtfSortError('%s is not grouped by seqname' % file_path)
+    if seqname not in gene_dict:
+        return None
+    gene_dict[seqname].finish()
+    return gene_dict[seqname]
+
+
+def open_lazy_annotation(file_path, evict=False):
+    """
+    Scan the GTF for the byte ranges of each seqname and return a
+    LazyAnnotation. None is returned if the lines of a seqname are spread
+    over too many separate ranges (i.e. the GTF is far from sorted) since
+    reading a chromosome would then mean seeking all over the file.
+    """
+    begin_time = time.time()
+    blocks = gtf.seqname_blocks(file_path)
+    num_blocks = sum(len(blocks[chr]) for chr in blocks)
+    logging.debug('Found %d seqname(s) in %d block(s) of %s in %.2f seconds' % (len(blocks), num_blocks, file_path, time.time() - begin_time))
+    if num_blocks > MAX_BLOCKS_PER_SEQNAME * len(blocks):
+        logging.debug('%s is not grouped by seqname so it can not be read lazily' % file_path)
+        return None
+    return LazyAnnotation(file_path, blocks, evict)
+
+
+def resident_memory():
+    """Resident memory of this process in MB (0 if /proc is not available)"""
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.
+    except IOError:
+        pass
+    return 0.
+
+
+def load_annotation(args):
+    """
+    Read a GTF into a GeneAnnotation ('dict') or a CompactAnnotation
+    ('compact') and return the seconds taken and the resident memory in MB
+    before and after. Meant to run in a fresh process (see benchmark).
+    """
+    file_path, layout = args
+    before = resident_memory()
+    begin_time = time.time()
+    if layout == 'dict':
+        gene_dict = gene_index.GeneAnnotation()
+        with open(file_path) as handle:
+            exons = sorted(gtf.exon_reader(handle), key=gtf.exon_sort_key)
+        for tx_id, tx in it.groupby(exons, lambda x: x.transcript_id):
+            gene_dict.add_transcript(list(tx))
+        del exons
+    else:
+        with open(file_path, 'rb') as handle:
+            def read_lines():
+                handle.seek(0)
+                return handle
+            gene_dict = read_gtf_lines(read_lines)
+    gene_dict.build_index()
+    return time.time() - begin_time, before, resident_memory()
+
+
+def benchmark(file_path):
+    """load_annotation of both layouts, each in its own process"""
+    results = []
+    for layout in ('dict', 'compact'):
+        pool = multiprocessing.Pool(1)
+        try:
+            results.append((layout,) + pool.apply(load_annotation, [(file_path, layout)]))
+        finally:
+            pool.close()
+            pool.join()
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report load time and memory of a GTF read into the dict based and the array backed gene annotation.')
+    parser.add_argument('-g', '--gtf', required=True, action='store', dest='gtf', help='path to gtf file, e.g. a full human GTF')
+    options = vars(parser.parse_args())
+
+    print '\t'.join(['layout', 'load (s)', 'memory (MB)'])
+    for layout, seconds, before, after in benchmark(options['gtf']):
+        print '%s\t%.2f\t%.0f' % (layout, seconds, after - before)
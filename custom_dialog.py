@@ -564,13 +564,13 @@ class SortGtfDialog(wx.Dialog):
             dlg.Destroy()
 
     def sort_gtf(self, infile, outfile):
-        """Sort a GTF file using SortGtf.jar"""
+        """Sort a GTF file using an external merge sort (gtf.sort_gtf)"""
         my_config = ConfigParser.ConfigParser()
         my_config.read('PrimerSeq.cfg')
-        config_options = dict(my_config.items('memory'))
-        cmd = 'java -jar -Xmx%sm "bin/SortGtf.jar" "%s" "%s"' % (config_options['sort'], infile, outfile)
-        logging.debug('Sort GTF cmd: ' + cmd)
-        subprocess.check_call(cmd, shell=True)
+        memory = int(my_config.get('memory', 'sort'))
+        workers = int(my_config.get('workers', 'sort')) if my_config.has_option('workers', 'sort') else 1
+        gtf.sort_gtf(infile, outfile, memory=memory, workers=workers,
+                     tmp_dir=primer.config_options['tmp'])
 
     def sort_button_event(self, event):
         self.sort_button.SetLabel('Sorting . . .')
@@ -1239,9 +1239,13 @@ class SavePlotDialog(wx.Dialog):
 
 
 class Primer3PathDialog(wx.Dialog):
-    """This class handles configuring the path to Primer3 and to the Primer3 configuration file"""
+    """
+    This class handles configuring the path to Primer3, the Primer3
+    configuration file and the number of processes reading a GTF
+    ([workers] gtf in PrimerSeq.cfg)
+    """
     def __init__(self, parent, id, title, text=''):
-        wx.Dialog.__init__(self, parent, id, title, size=(400, 125), style=wx.DEFAULT_DIALOG_STYLE)
+        wx.Dialog.__init__(self, parent, id, title, size=(400, 160), style=wx.DEFAULT_DIALOG_STYLE)
 
         self.parent = parent
         # self.text = wx.StaticText(self, -1, text)
@@ -1249,6 +1253,7 @@ class Primer3PathDialog(wx.Dialog):
         # set primer3 attributes
         self.primer3_directory = primer.config_options['primer3']
         self.primer3_config = primer.config_options['primer3_cfg']
+        self.gtf_workers = int(primer.my_config.get('workers', 'gtf')) if primer.my_config.has_option('workers', 'gtf') else 1
 
         # widgets for handling choice of primer3 directory
         grid_sizer = wx.GridSizer(1, 3, 0, 0)
@@ -1276,6 +1281,17 @@ class Primer3PathDialog(wx.Dialog):
         grid_sizer_primer3_config.Add(self.primer3_config_button, 0, wx.ALIGN_CENTER, 10)
         grid_sizer_primer3_config.Add(self.primer3_config_choice_label, 0, wx.EXPAND, 10)
 
+        # widgets for handling the number of processes reading a GTF
+        grid_sizer_workers = wx.GridSizer(1, 3, 0, 0)
+        self.gtf_workers_label = wx.StaticText(self, -1, "GTF Workers:")
+        self.gtf_workers_label.SetFont(wx.Font(12, wx.FONTFAMILY_DEFAULT, wx.FONTSTYLE_NORMAL, wx.FONTWEIGHT_NORMAL))
+        self.gtf_workers_spin = wx.SpinCtrl(self, -1, str(self.gtf_workers), min=1, max=64, initial=self.gtf_workers)
+        self.gtf_workers_spin.SetToolTip(wx.ToolTip('Number of processes used to read the chromosomes of a GTF file.\n'
+                                                    'Only GTF files grouped by chromosome are read in parallel.'))
+        grid_sizer_workers.Add(self.gtf_workers_label, 0, wx.ALIGN_RIGHT | wx.ALIGN_CENTER_VERTICAL, 10)
+        grid_sizer_workers.Add(self.gtf_workers_spin, 0, wx.ALIGN_CENTER, 10)
+        grid_sizer_workers.Add((10, 10), 0)
+
         # apply and close buttons
         button_sizer = wx.BoxSizer(wx.HORIZONTAL)
         self.apply_button = wx.Button(self, -1, 'Apply')
@@ -1290,18 +1306,21 @@ class Primer3PathDialog(wx.Dialog):
                        ((10, 10), 0),  # add spacer
                        (grid_sizer_primer3_config, 0, wx.EXPAND, 10),
                        ((10, 10), 0),  # add spacer
+                       (grid_sizer_workers, 0, wx.EXPAND, 10),
+                       ((10, 10), 0),  # add spacer
                        (button_sizer, 0, wx.ALIGN_CENTER)])  # add button
-        sizer.SetMinSize((500, 100))
+        sizer.SetMinSize((500, 135))
 
         self.Bind(wx.EVT_BUTTON, self.on_primer3_config_choice, self.primer3_config_button)
         self.Bind(wx.EVT_BUTTON, self.on_close, self.close_button)
         self.Bind(wx.EVT_BUTTON, self.on_apply, self.apply_button)
         self.Bind(wx.EVT_BUTTON, self.on_directory_choice, self.choose_directory_button)
+        self.Bind(wx.EVT_SPINCTRL, self.on_gtf_workers, self.gtf_workers_spin)
         self.SetSizer(sizer)
         self.Show()
 
     def on_apply(self, event):
-        """Set values related to primer3 in PrimerSeq.cfg"""
+        """Set values related to primer3 and GTF workers in PrimerSeq.cfg"""
         # read the existing options and then set to new value
         with open('PrimerSeq.cfg', 'r') as handle:
             my_config = ConfigParser.ConfigParser()
@@ -1310,6 +1329,11 @@ class Primer3PathDialog(wx.Dialog):
             my_config.set('directory', 'primer3_cfg', self.primer3_config)
             primer.config_options['primer3'] = self.primer3_directory
             primer.config_options['primer3_cfg'] = self.primer3_config
+            # gene_annotation_reader reads primer.my_config, so keep it in sync
+            for cfg in (my_config, primer.my_config):
+                if not cfg.has_section('workers'):
+                    cfg.add_section('workers')
+                cfg.set('workers', 'gtf', str(self.gtf_workers))
         # write new configuration options
         with open('PrimerSeq.cfg', 'w') as write_handle:
             my_config.write(write_handle)
@@ -1321,6 +1345,11 @@ class Primer3PathDialog(wx.Dialog):
         self.Destroy()
         event.Skip()
 
+    def on_gtf_workers(self, event):
+        """Handle changing the number of processes reading a GTF"""
+        self.gtf_workers = self.gtf_workers_spin.GetValue()
+        self.apply_button.Enable()
+
     def on_directory_choice(self, event):
         """Handle selecting the primer3 directory"""
         dlg = wx.DirDialog(self, message='Choose the Primer3 directory')
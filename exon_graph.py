@@ -0,0 +1,363 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: exon_graph.py
+Author: Collin Tokheim
+Description: exon_graph.py holds the ExonGraph class, the directed graph
+behind splice_graph.SpliceGraph. The splice graph of a gene is a small DAG
+whose exons are already ordered by position, so instead of a networkx
+dict-of-dicts the exons are numbered in (start, end) order and the
+successors/predecessors of every exon are kept in CSR form (an offset
+list per exon into one list of neighbor ids) with a parallel list of edge
+weights. It offers the graph operations PrimerSeq needs (biconnected and
+weakly connected components, subgraphs and all paths of a component) with
+(start, end) exon tuples as nodes, like the networkx graph it replaces.
+ExonGraph.to_networkx/from_networkx convert to networkx for debugging.
+
+Running this script benchmarks ExonGraph against networkx on genes with
+many isoforms.
+'''
+import argparse
+import itertools as it
+import random
+import time
+
+
+class ExonGraph(object):
+    '''
+    Splice graph with exons numbered in position order. Edge e goes from
+    exon u to exon self.succ[e] where succ_offsets[u] <= e <
+    succ_offsets[u + 1] and has weight self.weights[e]. Predecessors are
+    kept the same way in pred_offsets/pred with pred_edges pointing back to
+    the edge ids. The structure is fixed once built, only weights change.
+    '''
+
+    def __init__(self, exons=(), edges=()):
+        '''
+        exons are (start, end) tuples. edges is either a dict mapping
+        (exon, exon) pairs to weights or a list of pairs (weight 0). Exons
+        only found in edges are added too. Self loops are dropped.
+        '''
+        weights = edges if isinstance(edges, dict) else dict.fromkeys(edges, 0)
+        exons = sorted(set(exons).union(*weights) if weights else set(exons))
+        ids = dict((exon, i) for i, exon in enumerate(exons))
+        pairs = sorted((ids[u], ids[v]) for u, v in weights if u != v)
+        self._build(exons, ids, pairs, [weights[(exons[u], exons[v])] for u, v in pairs])
+
+    def _build(self, exons, ids, pairs, weights):
+        """Set up the CSR lists from (u, v) id pairs sorted by u then v"""
+        num_exons = len(exons)
+        self.exons, self.ids, self.weights = exons, ids, weights
+
+        # successors in CSR form, edge ids follow this order
+        self.succ = [v for u, v in pairs]
+        self.succ_offsets = offsets([u for u, v in pairs], num_exons)
+        self.edge_ids = dict(((exons[u], exons[v]), e) for e, (u, v) in enumerate(pairs))
+
+        # predecessors in CSR form, bucketing the edges by head keeps them in tail order
+        buckets = [[] for i in xrange(num_exons)]
+        for e, (u, v) in enumerate(pairs):
+            buckets[v].append(e)
+        self.pred_edges = [e for bucket in buckets for e in bucket]
+        self.pred = [pairs[e][0] for e in self.pred_edges]
+        self.pred_offsets = [0] * (num_exons + 1)
+        for i in xrange(num_exons):
+            self.pred_offsets[i + 1] = self.pred_offsets[i] + len(buckets[i])
+
+    def __len__(self):
+        return len(self.exons)
+
+    def __contains__(self, exon):
+        return exon in self.ids
+
+    def __iter__(self):
+        return iter(self.exons)
+
+    def nodes(self):
+        """Exons in position order"""
+        return list(self.exons)
+
+    def edges(self):
+        """(exon, exon) pairs in edge id order"""
+        exons, succ = self.exons, self.succ
+        return [(exons[u], exons[succ[e]])
+                for u in xrange(len(exons))
+                for e in xrange(self.succ_offsets[u], self.succ_offsets[u + 1])]
+
+    def number_of_edges(self):
+        return len(self.succ)
+
+    def edge_weights(self):
+        """Dict mapping (exon, exon) pairs to weights"""
+        return dict(it.izip(self.edges(), self.weights))
+
+    def successor_ids(self, i):
+        return self.succ[self.succ_offsets[i]:self.succ_offsets[i + 1]]
+
+    def predecessor_ids(self, i):
+        return self.pred[self.pred_offsets[i]:self.pred_offsets[i + 1]]
+
+    def successors(self, exon):
+        """Exons with an edge from exon, nearest first (i.e. position order)"""
+        return [self.exons[j] for j in self.successor_ids(self.ids[exon])]
+
+    def predecessors(self, exon):
+        """Exons with an edge to exon, nearest first (i.e. reverse position order)"""
+        return [self.exons[j] for j in reversed(self.predecessor_ids(self.ids[exon]))]
+
+    def has_edge(self, u, v):
+        return (u, v) in self.edge_ids
+
+    def weight(self, u, v):
+        """Weight of the edge from exon u to exon v (KeyError if missing)"""
+        return self.weights[self.edge_ids[(u, v)]]
+
+    def set_weight(self, u, v, weight):
+        self.weights[self.edge_ids[(u, v)]] = weight
+
+    def add_edges(self, edges):
+        '''
+        New ExonGraph with extra edges, given like in __init__. Weights of
+        edges already in the graph are replaced.
+        '''
+        weights = self.edge_weights()
+        weights.update(edges if isinstance(edges, dict) else dict.fromkeys(edges, 0))
+        return ExonGraph(self.exons, weights)
+
+    def subgraph(self, exons):
+        """ExonGraph of the given exons (unknown exons are ignored) and the edges between them"""
+        old_ids = sorted(set(self.ids[exon] for exon in exons if exon in self.ids))
+        new_ids = dict((old, new) for new, old in enumerate(old_ids))
+        pairs, weights = [], []
+        for u in old_ids:
+            for e in xrange(self.succ_offsets[u], self.succ_offsets[u + 1]):
+                if self.succ[e] in new_ids:
+                    pairs.append((new_ids[u], new_ids[self.succ[e]]))
+                    weights.append(self.weights[e])
+        sub_exons = [self.exons[i] for i in old_ids]
+        graph = ExonGraph.__new__(ExonGraph)
+        graph._build(sub_exons, dict((exon, i) for i, exon in enumerate(sub_exons)), pairs, weights)
+        return graph
+
+    def copy(self):
+        return self.subgraph(self.exons)
+
+    def neighbor_ids(self):
+        """Neighbors of every exon ignoring edge direction"""
+        return [self.predecessor_ids(i) + self.successor_ids(i) for i in xrange(len(self.exons))]
+
+    def biconnected_components(self):
+        '''
+        Biconnected components of the graph ignoring edge direction, as
+        lists of exons in position order. Like networkx, exons without edges
+        are not in any component and a single edge is a component of two
+        exons. Uses the Hopcroft-Tarjan algorithm without recursion.
+        '''
+        neighbors = self.neighbor_ids()
+        depth, low = [-1] * len(self.exons), [0] * len(self.exons)
+        components = []
+        for root in xrange(len(self.exons)):
+            if depth[root] >= 0: continue
+            depth[root] = 0
+            stack = [(root, -1, iter(neighbors[root]))]
+            edge_stack = []
+            while stack:
+                node, parent, children = stack[-1]
+                for child in children:
+                    if child == parent: continue
+                    if depth[child] < 0:
+                        # tree edge
+                        depth[child] = low[child] = depth[node] + 1
+                        edge_stack.append((node, child))
+                        stack.append((child, node, iter(neighbors[child])))
+                        break
+                    elif depth[child] < depth[node]:
+                        # back edge
+                        low[node] = min(low[node], depth[child])
+                        edge_stack.append((node, child))
+                else:
+                    stack.pop()
+                    if not stack: continue
+                    parent = stack[-1][0]
+                    low[parent] = min(low[parent], low[node])
+                    if low[node] >= depth[parent]:
+                        # parent separates the edges above (parent, node)
+                        component = set()
+                        while True:
+                            edge = edge_stack.pop()
+                            component.update(edge)
+                            if edge == (parent, node): break
+                        components.append([self.exons[i] for i in sorted(component)])
+        return components
+
+    def weakly_connected_components(self):
+        """Weakly connected components as lists of exons in position order"""
+        neighbors = self.neighbor_ids()
+        component_of = [-1] * len(self.exons)
+        components = []
+        for root in xrange(len(self.exons)):
+            if component_of[root] >= 0: continue
+            component_of[root] = len(components)
+            component, stack = [root], [root]
+            while stack:
+                for child in neighbors[stack.pop()]:
+                    if component_of[child] < 0:
+                        component_of[child] = len(components)
+                        component.append(child)
+                        stack.append(child)
+            components.append([self.exons[i] for i in sorted(component)])
+        return components
+
+    def iter_paths(self, source=None, sink=None):
+        '''
+        Yield every path (list of exons) from source to sink. Without a
+        source the paths start at every exon without predecessors, and
+        without a sink they end at every exon without successors. Edges must
+        go forward in position order, which is always true for a splice
+        graph, so exons after sink are never visited.
+        '''
+        exons = self.exons
+        last = len(exons) - 1 if sink is None else self.ids[sink]
+        successors = [[j for j in self.successor_ids(i) if j <= last] for i in xrange(last + 1)]
+        if source is None:
+            sources = [i for i in xrange(last + 1) if self.pred_offsets[i] == self.pred_offsets[i + 1]]
+        else:
+            sources = [self.ids[source]] if self.ids[source] <= last else []
+        if sink is None:
+            is_end = lambda i: not successors[i]
+        else:
+            is_end = lambda i: i == last
+        for first in sources:
+            if is_end(first):
+                yield [exons[first]]
+                continue
+            path, children = [exons[first]], [iter(successors[first])]
+            while children:
+                for child in children[-1]:
+                    if is_end(child):
+                        yield path + [exons[child]]
+                    elif successors[child]:
+                        path.append(exons[child])
+                        children.append(iter(successors[child]))
+                        break
+                else:
+                    children.pop()
+                    path.pop()
+
+    def to_networkx(self):
+        """networkx.DiGraph copy with a 'weight' attribute on every edge, for debugging"""
+        import networkx as nx  # only needed for debugging
+        graph = nx.DiGraph()
+        graph.add_nodes_from(self.exons)
+        for (u, v), weight in it.izip(self.edges(), self.weights):
+            graph.add_edge(u, v, weight=weight)
+        return graph
+
+    @staticmethod
+    def from_networkx(graph):
+        """ExonGraph of a networkx graph (edges without a 'weight' get 0)"""
+        return ExonGraph(graph.nodes(), dict(((u, v), data.get('weight', 0)) for u, v, data in graph.edges(data=True)))
+
+
+def offsets(sorted_ids, num_ids):
+    """CSR offsets of a sorted list of ids in range(num_ids)"""
+    counts = [0] * (num_ids + 1)
+    for i in sorted_ids:
+        counts[i + 1] += 1
+    for i in xrange(num_ids):
+        counts[i + 1] += counts[i]
+    return counts
+
+
+def synthetic_gene(num_exons, num_isoforms, seed=0):
+    '''
+    Transcripts (lists of exons) of a made up gene for benchmarking. Each
+    isoform skips random cassette exons and some exons have an alternative
+    end, giving many isoforms over few exons like real complex genes.
+    '''
+    rand = random.Random(seed)
+    exons = [(1000 * i, 1000 * i + 100) for i in xrange(num_exons)]
+    alt_ends = dict((i, (exons[i][0], exons[i][1] + 50)) for i in xrange(1, num_exons - 1) if rand.random() < .2)
+    isoforms = set()
+    while len(isoforms) < num_isoforms:
+        tx = [exons[0]]
+        for i in xrange(1, num_exons - 1):
+            if rand.random() < .3: continue  # skipped
+            tx.append(alt_ends[i] if i in alt_ends and rand.random() < .5 else exons[i])
+        isoforms.add(tuple(tx + [exons[-1]]))
+    return map(list, sorted(isoforms))
+
+
+def benchmark(transcripts, repeat=5, path_limit=10000):
+    """Seconds networkx and ExonGraph take for the graph operations of a gene"""
+    import networkx as nx
+    edges = set((tx[i], tx[i + 1]) for tx in transcripts for i in xrange(len(tx) - 1))
+
+    def with_networkx():
+        graph = nx.DiGraph()
+        for tx in transcripts:
+            graph.add_edges_from(zip(tx[:-1], tx[1:]))  # add_path is not a DiGraph method in networkx 2
+        for u, v in graph.edges():
+            graph[u][v]['weight'] = 1
+        for component in nx.biconnected_components(graph.to_undirected()):
+            sub_graph = nx.DiGraph(nx.subgraph(graph, component))  # networkx 2 subgraphs are read-only views
+            sources = [exon for exon in sub_graph.nodes() if not list(sub_graph.predecessors(exon))]
+            sinks = [exon for exon in sub_graph.nodes() if not list(sub_graph.successors(exon))]
+            sub_graph.add_edges_from([('src', exon) for exon in sources] + [(exon, 'sink') for exon in sinks])
+            list(it.islice(nx.all_simple_paths(sub_graph, 'src', 'sink'), path_limit))
+            [sub_graph[u][v] for u, v in sub_graph.edges()]
+
+    def with_exon_graph():
+        graph = ExonGraph([exon for tx in transcripts for exon in tx], dict.fromkeys(edges, 1))
+        for component in graph.biconnected_components():
+            sub_graph = graph.subgraph(component)
+            list(it.islice(sub_graph.iter_paths(), path_limit))
+            [sub_graph.weight(u, v) for u, v in sub_graph.edges()]
+
+    times = []
+    for func in (with_networkx, with_exon_graph):
+        begin_time = time.time()
+        for i in xrange(repeat):
+            func()
+        times.append((time.time() - begin_time) / repeat)
+    return times
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark ExonGraph against networkx on genes with many isoforms.')
+    parser.add_argument('-i', '--isoforms', default='100,200,400', action='store', dest='isoforms',
+                        help='comma separated numbers of isoforms of synthetic genes (Default=100,200,400)')
+    parser.add_argument('-e', '--exons', default=40, type=int, action='store', dest='exons',
+                        help='number of exons of the synthetic genes (Default=40)')
+    parser.add_argument('-g', '--gtf', action='store', dest='gtf', default=None,
+                        help='also benchmark the genes of a GTF with at least the smallest number of isoforms')
+    options = vars(parser.parse_args())
+
+    genes = [('synthetic_%s' % num, synthetic_gene(options['exons'], int(num))) for num in options['isoforms'].split(',')]
+    if options['gtf']:
+        import primer
+        gene_dict = primer.gene_annotation_reader(options['gtf'], use_cache=False)
+        min_isoforms = min(len(tx) for name, tx in genes)
+        genes += [(gene, gene_dict[chr][gene]['graph']) for chr in gene_dict for gene in gene_dict[chr]
+                  if len(gene_dict[chr][gene]['graph']) >= min_isoforms]
+
+    print '\t'.join(['gene', 'isoforms', 'exons', 'networkx (ms)', 'ExonGraph (ms)', 'speedup'])
+    for name, transcripts in genes:
+        nx_time, exon_graph_time = benchmark(transcripts)
+        num_exons = len(set(exon for tx in transcripts for exon in tx))
+        print '%s\t%d\t%d\t%.2f\t%.2f\t%.1fx' % (name, len(transcripts), num_exons, 1000 * nx_time,
+                                                 1000 * exon_graph_time, nx_time / exon_graph_time)
@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: gene_index.py
+Author: Collin Tokheim
+Description: Positional indexes over the gene_dict created by
+primer.gene_annotation_reader. The :class:`~gene_index.IntervalIndex` class is
+an implicit augmented interval tree stored in plain sorted lists (the same
+layout used by cgranges) so overlap queries cost O(log n + hits).
+:class:`~gene_index.GeneAnnotation` is the gene_dict itself with one
+IntervalIndex per (chr, strand) and a hash index from exon coordinates to
+genes.
+'''
+
+
+def copy_gene(gene):
+    """
+    Copy of a gene dictionary (graph, exons, strand, chr, start, end) that
+    can be changed without changing the annotation it came from.
+    """
+    gene = dict(gene)
+    gene['graph'] = [list(tx) for tx in gene['graph']]
+    gene['exons'] = set(gene['exons'])
+    return gene
+
+
+class IntervalIndex(object):
+    """
+    Static interval tree over half-open [start, end) intervals. Intervals are
+    sorted by start and the tree is implicit in the list positions, i.e.
+    the node at index i on level k has children at i -/+ 2**(k-1). Each node
+    keeps the max end of its subtree.
+    """
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda x: (x[0], x[1]))
+        self.starts = [i[0] for i in intervals]
+        self.ends = [i[1] for i in intervals]
+        self.values = [i[2] for i in intervals]
+        self.max_ends = list(self.ends)
+        self.max_level = self.__index()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __index(self):
+        """Fill in self.max_ends and return the level of the root node."""
+        n = len(self.starts)
+        if n == 0:
+            return -1
+        a = self.max_ends
+        last_i, last = 0, 0
+        for i in range(0, n, 2):
+            last_i, last = i, a[i]
+        k = 1
+        while (1 << k) <= n:
+            x = 1 << (k - 1)
+            for i in range((x << 1) - 1, n, x << 2):
+                el = a[i - x]
+                er = a[i + x] if i + x < n else last
+                a[i] = max(self.ends[i], el, er)
+            last_i = last_i - x if (last_i >> k) & 1 else last_i + x
+            if last_i < n and a[last_i] > last:
+                last = a[last_i]
+            k += 1
+        return k - 1
+
+    def overlap(self, start, end):
+        """
+        Return the values of every interval overlapping [start, end) ordered
+        by interval start.
+        """
+        return [self.values[i] for i in self.__overlap_positions(start, end)]
+
+    def contain(self, start, end):
+        """Return the values of every interval that fully contains [start, end)."""
+        return [self.values[i] for i in self.__overlap_positions(start, end)
+                if self.starts[i] <= start and self.ends[i] >= end]
+
+    def __overlap_positions(self, start, end):
+        """Sorted list positions of the intervals overlapping [start, end)."""
+        n = len(self.starts)
+        starts, ends, max_ends = self.starts, self.ends, self.max_ends
+        hits = []
+        if n == 0:
+            return hits
+        stack = [(self.max_level, (1 << self.max_level) - 1, 0)]  # (level, node, left child done)
+        while stack:
+            k, x, w = stack.pop()
+            if k <= 3:
+                # small subtree so just do a linear scan
+                i = x >> k << k
+                i1 = min(i + (1 << (k + 1)) - 1, n)
+                while i < i1 and starts[i] < end:
+                    if start < ends[i]:
+                        hits.append(i)
+                    i += 1
+            elif w == 0:
+                y = x - (1 << (k - 1))  # left child
+                stack.append((k, x, 1))
+                if y >= n or max_ends[y] > start:
+                    stack.append((k - 1, y, 0))
+            elif x < n and starts[x] < end:
+                if start < ends[x]:
+                    hits.append(x)
+                stack.append((k - 1, x + (1 << (k - 1)), 0))  # right child
+        hits.sort()
+        return hits
+
+
+class GeneAnnotation(dict):
+    """
+    The gene_dict created by primer.gene_annotation_reader along with an
+    IntervalIndex of gene spans for each (chr, strand) and a dictionary
+    mapping (chr, strand, start, end) of every annotated exon to the genes
+    that have that exon. Indexing is done once by build_index after all genes
+    are added, or by the first query if build_index was not called. A
+    GeneAnnotation only used to collect genes (e.g. by
+    annotation_index.IndexedAnnotation.cached_gene) never builds the indexes.
+    """
+    def __init__(self, *args, **kwargs):
+        super(GeneAnnotation, self).__init__(*args, **kwargs)
+        self.gene_index = None  # set by build_index
+        self.exon_index = None
+
+    def add_transcript(self, tx):
+        """
+        Add the exons (gtf.GtfExon) of a single transcript to the gene_dict.
+        """
+        if len(tx) == 0: return  # no 'exon' feature case
+
+        gene_id = tx[0].gene_id
+        strand = tx[0].strand
+
+        # sort exons
+        tx_path = sorted([(exon.start, exon.end) for exon in tx],
+                         key=lambda x: (x[0], x[1]))  # needs to be sorted because gtf files might not have them in proper order
+
+        # add info to gene_dict
+        self.setdefault(tx[0].seqname, {})
+        self[tx[0].seqname].setdefault(gene_id, {})  # add the gene key if it doesn't exist
+        self[tx[0].seqname][gene_id].setdefault('chr', tx[0].seqname)  # add chr if doesn't exist
+        self[tx[0].seqname][gene_id].setdefault('strand', strand)  # add strand if doesn't exist
+        self[tx[0].seqname][gene_id].setdefault('graph', []).append(tx_path)  # append the tx path
+        self[tx[0].seqname][gene_id].setdefault('start', float('inf'))
+        self[tx[0].seqname][gene_id]['start'] = min(self[tx[0].seqname][gene_id]['start'], tx_path[0][0])  # change start if this tx has lower start position
+        self[tx[0].seqname][gene_id].setdefault('end', 0)
+        self[tx[0].seqname][gene_id]['end'] = max(self[tx[0].seqname][gene_id]['end'], tx_path[-1][1])
+        self[tx[0].seqname][gene_id].setdefault('exons', set())
+        for ex in tx_path:
+            self[tx[0].seqname][gene_id]['exons'].add(ex)  # hold a set of non-redundant exons
+
+    def build_index(self):
+        """Create the gene span and exon coordinate indexes."""
+        spans = {}
+        for chr in self:
+            for gene_key in self[chr]:
+                gene = self[chr][gene_key]
+                spans.setdefault((chr, gene['strand']), []).append((gene['start'], gene['end'], gene_key))
+        self.gene_index = dict((key, IntervalIndex(spans[key])) for key in spans)
+
+        # genes are added in order of position so exon_index lists are sorted
+        self.exon_index = {}
+        for chr, strand in self.gene_index:
+            for gene_key in self.gene_index[(chr, strand)].values:
+                for start, end in self[chr][gene_key]['exons']:
+                    self.exon_index.setdefault((chr, strand, start, end), []).append(gene_key)
+
+    def overlapping_genes(self, chr, strand, start, end):
+        """
+        Gene keys of genes on strand overlapping or touching [start, end],
+        i.e. genes with start <= end and end >= start like the scan of
+        genes that the interval index replaced.
+        """
+        if self.gene_index is None: self.build_index()
+        if (chr, strand) not in self.gene_index:
+            return []
+        return self.gene_index[(chr, strand)].overlap(start - 1, end + 1)
+
+    def containing_genes(self, chr, strand, start, end):
+        """Gene keys of genes on strand that completely contain [start, end)."""
+        if self.gene_index is None: self.build_index()
+        if (chr, strand) not in self.gene_index:
+            return []
+        return self.gene_index[(chr, strand)].contain(start, end)
+
+    def exon_genes(self, chr, strand, start, end):
+        """Gene keys of genes with an annotated exon at exactly [start, end)."""
+        if self.exon_index is None: self.build_index()
+        return self.exon_index.get((chr, strand, start, end), [])
@@ -17,8 +17,31 @@
 import csv
 import re
 import argparse
+import os
+import shutil
+import tempfile
+import heapq
+import multiprocessing
+from collections import deque
+from operator import itemgetter
 from itertools import tee, imap
 
+# for logging purposes
+import logging
+import time
+
+
+# column indexes defined by the GTF spec
+SEQNAME, SOURCE, FEATURE, START, END, SCORE, STRAND, FRAME, ATTRIBUTE = range(9)
+
+# compiled regexes to pull a single attribute out of the raw attribute column
+attribute_patterns = {}
+
+# sort_gtf assumes python needs about this many bytes of memory per byte of
+# GTF text held in a chunk (raw line, joined line, sort key and list overhead)
+SORT_MEMORY_FACTOR = 4
+MAX_MERGE_RUNS = 128  # max number of sorted runs merged at once by sort_gtf
+
 
 class Gtf(object):
     """
@@ -37,6 +60,87 @@ class Gtf(object):
         return '\t'.join(self.gtf_list) + '\n'
 
 
+class GtfExon(object):
+    """
+    Compact record for an exon line of a GTF. Unlike Gtf only the columns
+    used to build the gene_dict are kept and only the gene_id and
+    transcript_id attributes are decoded.
+    """
+    __slots__ = ('seqname', 'start', 'end', 'strand', 'gene_id', 'transcript_id')
+
+    def __init__(self, seqname, start, end, strand, gene_id, transcript_id):
+        self.seqname = seqname
+        self.start = start
+        self.end = end
+        self.strand = strand
+        self.gene_id = gene_id
+        self.transcript_id = transcript_id
+
+
+def get_attribute(attribute, key):
+    """
+    Decode a single attribute (e.g. gene_id) from the raw attribute column
+    without converting the whole column to a dict. Quotes are ignored the
+    same way as in Gtf. Raises a KeyError if the attribute is missing.
+    """
+    if key not in attribute_patterns:
+        attribute_patterns[key] = re.compile('(?:^|;)[\\s"]*%s[\\s"]+([^;"]*)' % re.escape(key))
+    match = attribute_patterns[key].search(attribute)
+    if match is None:
+        raise KeyError(key)
+    return match.group(1).strip()
+
+
+def exon_reader(fileObject):
+    """
+    Iterate over a GTF yielding a GtfExon for each 'exon' feature. Lines are
+    only split on tabs and the feature column is checked before any work is
+    done on the attributes.
+    """
+    for line in fileObject:
+        gtf_line = line.rstrip('\r\n').split('\t', ATTRIBUTE)
+        if len(gtf_line) <= ATTRIBUTE: continue  # skip comments/blank lines
+
+        # only use exon features
+        feature = gtf_line[FEATURE]
+        if feature != 'exon' and feature.lower() != 'exon': continue
+
+        attribute = gtf_line[ATTRIBUTE]
+        yield GtfExon(gtf_line[SEQNAME],
+                      int(gtf_line[START]) - 1, int(gtf_line[END]),  # convert to 0-based start
+                      gtf_line[STRAND],
+                      get_attribute(attribute, 'gene_id'),
+                      get_attribute(attribute, 'transcript_id'))
+
+
+class GtfSortError(Exception):
+    """
+    Raised by sorted_exon_reader when exons are not in the order created by
+    sort_gtf.
+    """
+    pass
+
+
+def exon_sort_key(exon):
+    """Sort key of a GtfExon. This is the same order used by sort_gtf."""
+    return (exon.seqname, exon.gene_id, exon.transcript_id, exon.start, exon.end)
+
+
+def sorted_exon_reader(fileObject):
+    """
+    Same as exon_reader but checks that each exon comes after the previous
+    one (see exon_sort_key). Raises GtfSortError at the first exon out of
+    order.
+    """
+    last_key = None
+    for exon in exon_reader(fileObject):
+        key = exon_sort_key(exon)
+        if last_key is not None and key < last_key:
+            raise GtfSortError('%s:%d-%d (%s) is out of order' % (exon.seqname, exon.start, exon.end, exon.transcript_id))
+        last_key = key
+        yield exon
+
+
 def gtf_reader(fileObject, delim):
     """
     Iterate over a file to extract 'exon' features of tx
@@ -46,22 +150,225 @@ def gtf_reader(fileObject, delim):
 
         # only use exon features
         if gtf.feature.lower() == 'exon':
-            yield Gtf(gtf_line)
+            yield gtf
 
 
-def sort_gtf(file_name, output):
-    gtf_list = []
-    with open(file_name) as handle:
-        for gtf_line in csv.reader(handle, delimiter='\t'):
-            gtf = Gtf(gtf_line)
-            if gtf.feature.lower() == 'exon':
-                gtf_list.append(gtf)
-    gtf_list.sort(key=lambda x: (x.seqname, x.attribute['gene_id'], x.attribute['transcript_id'], x.start, x.end))
+def gtf_sort_key(gtf_line):
+    """Sort key of a GTF line split into columns (same order as exon_sort_key)."""
+    attribute = gtf_line[ATTRIBUTE]
+    return (gtf_line[SEQNAME],
+            get_attribute(attribute, 'gene_id'),
+            get_attribute(attribute, 'transcript_id'),
+            int(gtf_line[START]) - 1, int(gtf_line[END]))
+
+
+def sort_gtf_run(lines, run_path):
+    """
+    Sort the exon lines from one chunk of a GTF and write them to run_path.
+    Lines are written the same way as str(Gtf).
+    """
+    exons = []
+    for gtf_line in csv.reader(lines, delimiter='\t'):
+        if len(gtf_line) <= ATTRIBUTE: continue  # skip comments/blank lines
+        if gtf_line[FEATURE].lower() == 'exon':
+            exons.append((gtf_sort_key(gtf_line), '\t'.join(gtf_line) + '\n'))
+    exons.sort(key=itemgetter(0))  # stable sort keeps file order for ties
+    with open(run_path, 'wb') as write_handle:
+        write_handle.writelines(exon[1] for exon in exons)
+    return run_path
 
-    # write the contents back to a file
+
+def read_gtf_run(run_path, run_index):
+    """Iterate over (sort key, run index, line) of a run made by sort_gtf_run."""
+    with open(run_path, 'rb') as handle:
+        for line in handle:
+            yield (gtf_sort_key(line.rstrip('\n').split('\t', ATTRIBUTE)), run_index, line)
+
+
+def merge_gtf_runs(run_paths, output):
+    """
+    k-way merge of sorted runs into output. Ties are broken by the order of
+    run_paths so the merge is stable.
+    """
+    runs = [read_gtf_run(run_path, i) for i, run_path in enumerate(run_paths)]
     with open(output, 'wb') as write_handle:
-        for gtf_obj in gtf_list:
-            write_handle.write(str(gtf_obj))
+        for key, run_index, line in heapq.merge(*runs):
+            write_handle.write(line)
+
+
+def read_chunks(handle, max_bytes):
+    """Yield lists of lines from handle holding roughly max_bytes of text."""
+    chunk, size = [], 0
+    for line in handle:
+        chunk.append(line)
+        size += len(line)
+        if size >= max_bytes:
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+
+def sort_gtf(file_name, output, memory=1536, workers=1, tmp_dir=None):
+    """
+    Sort the exons of a GTF by (seqname, gene_id, transcript_id, start, end).
+    This is an external merge sort so at most about memory MB is used no
+    matter how large the GTF is. Chunks of the GTF are sorted into runs in a
+    temporary directory (optionally by several worker processes) and the
+    runs are then merged.
+
+    :param str file_name: path to GTF to sort
+    :param str output: path to write the sorted GTF
+    :param int memory: memory budget in MB
+    :param int workers: number of processes used to sort chunks
+    :param str tmp_dir: where to make the temporary directory for runs
+    """
+    logging.debug('Sorting %s with %d MB of memory and %d worker(s) . . .' % (file_name, memory, workers))
+    begin_time = time.time()
+    workers = max(1, int(workers))
+    chunk_bytes = max(1, int(memory) * 2**20 / SORT_MEMORY_FACTOR / (workers + 1 if workers > 1 else 1))
+    run_dir = tempfile.mkdtemp(prefix='sort_gtf.', dir=tmp_dir)
+    try:
+        # create sorted runs
+        run_paths = []
+        with open(file_name, 'rb') as handle:
+            if workers == 1:
+                for i, chunk in enumerate(read_chunks(handle, chunk_bytes)):
+                    run_paths.append(sort_gtf_run(chunk, os.path.join(run_dir, 'run.%d' % i)))
+            else:
+                pool = multiprocessing.Pool(workers)
+                pending = deque()  # never hold more than one chunk per worker
+                try:
+                    for i, chunk in enumerate(read_chunks(handle, chunk_bytes)):
+                        if len(pending) >= workers:
+                            run_paths.append(pending.popleft().get())
+                        pending.append(pool.apply_async(sort_gtf_run, (chunk, os.path.join(run_dir, 'run.%d' % i))))
+                        del chunk
+                    while pending:
+                        run_paths.append(pending.popleft().get())
+                    pool.close()
+                except:
+                    pool.terminate()
+                    raise
+                finally:
+                    pool.join()
+        logging.debug('Sorted %s into %d run(s)' % (file_name, len(run_paths)))
+
+        # merge runs a group at a time if there are too many to open at once
+        merge_round = 0
+        while len(run_paths) > MAX_MERGE_RUNS:
+            merged_paths = []
+            for i in range(0, len(run_paths), MAX_MERGE_RUNS):
+                merged_path = os.path.join(run_dir, 'merge.%d.%d' % (merge_round, i))
+                merge_gtf_runs(run_paths[i:i + MAX_MERGE_RUNS], merged_path)
+                merged_paths.append(merged_path)
+            for run_path in run_paths: os.remove(run_path)
+            run_paths = merged_paths
+            merge_round += 1
+
+        # write the contents back to a file
+        if len(run_paths) == 1:
+            shutil.move(run_paths[0], output)
+        else:
+            merge_gtf_runs(run_paths, output)
+    finally:
+        shutil.rmtree(run_dir, ignore_errors=True)
+    logging.debug('Finished sorting %s in %.2f seconds' % (file_name, time.time() - begin_time))
+
+
+def seqname_at(handle, offset):
+    """
+    Return (seqname, line offset) of the first GTF record starting at or
+    after offset. Comment and blank lines are skipped. (None, end of file)
+    is returned if there is no such record.
+    """
+    if offset > 0:
+        handle.seek(offset - 1)
+        handle.readline()  # skip the rest of a partial line
+    else:
+        handle.seek(0)
+    while True:
+        line_offset = handle.tell()
+        line = handle.readline()
+        if not line:
+            return None, line_offset
+        if line.startswith('#') or '\t' not in line: continue
+        return line.split('\t', 1)[0], line_offset
+
+
+def chromosome_offsets(file_name, min_step=2**16):
+    """
+    Find the byte range [start, end) of each seqname in a GTF where all lines
+    of a seqname are next to each other (e.g. sorted by sort_gtf). Rather
+    than reading the whole file the end of each seqname is found with an
+    exponential search followed by a binary search over byte offsets.
+
+    Nothing here checks that the GTF really is grouped by seqname. Callers
+    should check that each range only holds its own seqname.
+
+    :returns: list of (seqname, start, end)
+    """
+    ranges = []
+    with open(file_name, 'rb') as handle:
+        size = os.fstat(handle.fileno()).st_size
+        seqname, ignore = seqname_at(handle, 0)
+        start = 0  # leading comments go with the first seqname
+        while seqname is not None:
+            # exponential search for an offset past the end of seqname
+            low, step = start, min_step
+            high = low + step
+            while high < size and seqname_at(handle, high)[0] == seqname:
+                low, step = high, step * 2
+                high = low + step
+            high = min(high, size)
+
+            # binary search for the first record of the next seqname
+            while high - low > 1:
+                mid = (low + high) // 2
+                if seqname_at(handle, mid)[0] == seqname:
+                    low = mid
+                else:
+                    high = mid
+            next_seqname, end = seqname_at(handle, high)
+            ranges.append((seqname, start, end))
+            seqname, start = next_seqname, end
+    return ranges
+
+
+def seqname_blocks(file_name):
+    """
+    Read a GTF once, only looking at the seqname of each line, and find the
+    byte ranges [start, end) of each run of lines with the same seqname.
+    Unlike chromosome_offsets the GTF does not need to be grouped by seqname.
+
+    :returns: dict mapping seqname to a list of (start, end)
+    """
+    blocks = {}
+    seqname, start, offset = None, 0, 0
+    with open(file_name, 'rb') as handle:
+        for line in handle:
+            tab = line.find('\t')
+            if tab > 0 and not line.startswith('#'):
+                if line[:tab] != seqname:
+                    if seqname is not None:
+                        blocks[seqname].append((start, offset))
+                    seqname, start = line[:tab], offset
+                    blocks.setdefault(seqname, [])
+            offset += len(line)
+    if seqname is not None:
+        blocks[seqname].append((start, offset))
+    return blocks
+
+
+def read_range(handle, start, end):
+    """Iterate over the lines of a file in the byte range [start, end)."""
+    handle.seek(start)
+    offset = start
+    while offset < end:
+        line = handle.readline()
+        if not line: break
+        offset += len(line)
+        yield line
 
 
 def is_sorted(iterable, compare):
@@ -75,15 +382,8 @@ def is_sorted(iterable, compare):
 def gtf_compare(a, b):
     """compare two lines of a GTF file to see if they are
     correctly sorted as "a" before "b"."""
-    tmp_list = [a, b]  # proposed sorted order
-    srt_list = sorted(tmp_list, key=lambda x: (x.seqname,
-                                               x.attribute['gene_id'],
-                                               x.attribute['transcript_id'],
-                                               x.start, x.end))  # actual sorted order
-
-    # return flag for whether the two entries were in sorted order
-    flag = (tmp_list == srt_list)
-    return flag
+    return (a.seqname, a.attribute['gene_id'], a.attribute['transcript_id'], a.start, a.end) <= \
+        (b.seqname, b.attribute['gene_id'], b.attribute['transcript_id'], b.start, b.end)
 
 
 def gtf_iter_reader(handle):
@@ -93,16 +393,45 @@ def gtf_iter_reader(handle):
 
 
 def is_gtf_sorted(file_name):
-    """Returns Boolean for if gtf is sorted."""
+    """Returns Boolean for if the exons in a gtf are sorted."""
     with open(file_name) as handle:
-        mygtf_reader = gtf_iter_reader(handle)
-        return is_sorted(mygtf_reader, gtf_compare)
+        try:
+            for exon in sorted_exon_reader(handle):
+                pass
+        except GtfSortError:
+            return False
+    return True
+
+
+def benchmark_readers(file_name):
+    """
+    Seconds gtf_reader (the Gtf class) and exon_reader take to read the
+    exons of a GTF. Both readers are checked to find the same exons.
+    """
+    def read_gtf():
+        with open(file_name) as handle:
+            return [(g.seqname, g.start, g.end, g.strand, g.attribute['gene_id'], g.attribute['transcript_id'])
+                    for g in gtf_reader((line for line in handle if not line.startswith('#')), '\t')]
+
+    def read_exons():
+        with open(file_name) as handle:
+            return [(e.seqname, e.start, e.end, e.strand, e.gene_id, e.transcript_id) for e in exon_reader(handle)]
+
+    times, results = [], []
+    for func in (read_gtf, read_exons):
+        begin_time = time.time()
+        results.append(func())
+        times.append(time.time() - begin_time)
+    if results[0] != results[1]:
+        raise ValueError('gtf_reader and exon_reader read different exons from %s' % file_name)
+    return times, len(results[1])
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="""Either performs proper sorting of GTF for PrimerSeq or checks if GTF is sorted.
                                      For Sorting GTF:\npython gtf.py -i unsorted.gtf -o sorted.gtf,
-                                     For checking if GTF is sorted:\npython gtf.py -c not_sure_if_sorted.gtf""")
+                                     For checking if GTF is sorted:\npython gtf.py -c not_sure_if_sorted.gtf,
+                                     For timing the GTF readers:\npython gtf.py -b annotation.gtf""")
     parser.add_argument('-i',
                         type=str,
                         default='',
@@ -115,20 +444,42 @@ if __name__ == '__main__':
                         dest='output',
                         action='store',
                         help='path name of properly sorted gtf')
+    parser.add_argument('-m', '--memory',
+                        type=int,
+                        default=1536,
+                        dest='memory',
+                        action='store',
+                        help='memory budget in MB for sorting (Default: 1536)')
+    parser.add_argument('-w', '--workers',
+                        type=int,
+                        default=1,
+                        dest='workers',
+                        action='store',
+                        help='number of processes used to sort chunks of the gtf (Default: 1)')
     parser.add_argument('-c',
                         type=str,
                         default='',
                         dest='is_sorted',
                         action='store',
                         help='path to gtf file to check if sorted correctly')
+    parser.add_argument('-b', '--benchmark',
+                        type=str,
+                        default='',
+                        dest='benchmark',
+                        action='store',
+                        help='path to gtf file to read with both the Gtf class and exon_reader, e.g. a full human GTF')
     args = parser.parse_args()
 
     if args.gtf and args.output:
-        sort_gtf(args.gtf, args.output)  # do the work of sorting
+        sort_gtf(args.gtf, args.output, args.memory, args.workers)  # do the work of sorting
     elif args.is_sorted:
         if is_gtf_sorted(args.is_sorted):
             print '%s is correctly sorted' % (args.is_sorted)
         else:
             print '%s is not correctly sorted. please sort before use.' % (args.is_sorted)
+    elif args.benchmark:
+        (gtf_time, exon_time), num_exons = benchmark_readers(args.benchmark)
+        print '\t'.join(['gtf', 'exons', 'gtf_reader (s)', 'exon_reader (s)', 'speedup'])
+        print '%s\t%d\t%.2f\t%.2f\t%.1fx' % (args.benchmark, num_exons, gtf_time, exon_time, gtf_time / exon_time)
     else:
-        print 'You must enter either both the -i and -o options or just the -c option.'
+        print 'You must enter either both the -i and -o options, just the -c option or just the -b option.'
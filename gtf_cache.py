@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: gtf_cache.py
+Author: Collin Tokheim
+Description: Keeps a binary copy of the gene_dict built by
+primer.gene_annotation_reader so later runs do not have to re-parse the
+GTF. A cache file holds two pickles. The first is a small header describing
+the GTF it was built from (size, mtime, md5 and FILTER_FACTOR) and the second
+is the gene_dict itself. Only the header is read to decide if the cache is
+still valid.
+'''
+import cPickle as pickle
+import hashlib
+import os
+import ConfigParser
+
+# for logging purposes
+import logging
+import time
+
+# bump this whenever the layout of gene_dict changes
+CACHE_VERSION = 4
+
+# define directories
+cfg = ConfigParser.ConfigParser()
+cfg.read('PrimerSeq.cfg')
+cfg_options = dict(cfg.items('directory'))
+CACHE_DIR = cfg_options.get('cache', 'cache')  # directory to store cached gene models
+
+
+def md5sum(file_path, block_size=2**20):
+    """Content hash of a file read in 1MB blocks."""
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(block_size), ''):
+            md5.update(block)
+    return md5.hexdigest()
+
+
+def cache_path(file_path, filter_factor):
+    """Cache file name for a GTF (one cache file per GTF/FILTER_FACTOR)."""
+    key = '%s|%s' % (os.path.abspath(file_path), str(filter_factor))
+    basename = os.path.basename(file_path)
+    return os.path.join(CACHE_DIR, '%s.%s.cache' % (basename, hashlib.md5(key).hexdigest()))
+
+
+def make_header(file_path, filter_factor, md5=None):
+    """Describe the GTF that a gene_dict was built from."""
+    stat = os.stat(file_path)
+    return {'version': CACHE_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'md5': md5 if md5 else md5sum(file_path),
+            'filter_factor': filter_factor}
+
+
+def is_valid(header, file_path, filter_factor):
+    """
+    Check a cache header against the current GTF. A matching size and mtime
+    is trusted as is. If only the mtime changed (e.g. the file was copied or
+    touched) then the md5 decides.
+    """
+    if header.get('version') != CACHE_VERSION or header.get('filter_factor') != filter_factor:
+        return False
+    stat = os.stat(file_path)
+    if header['size'] != stat.st_size:
+        return False
+    if header['mtime'] == stat.st_mtime:
+        return True
+    return header['md5'] == md5sum(file_path)
+
+
+def load(file_path, filter_factor):
+    """
+    Return the cached gene_dict for the GTF or None if there is no valid cache.
+    """
+    begin_time = time.time()
+    my_cache = cache_path(file_path, filter_factor)
+    if not os.path.exists(my_cache):
+        logging.debug('GTF cache miss for %s (no cache file)' % file_path)
+        return None
+    try:
+        with open(my_cache, 'rb') as handle:
+            header = pickle.load(handle)
+            if not is_valid(header, file_path, filter_factor):
+                logging.debug('GTF cache miss for %s (GTF or FILTER_FACTOR changed)' % file_path)
+                return None
+            gene_dict = pickle.load(handle)
+    except (EOFError, IOError, pickle.UnpicklingError, AttributeError, ImportError, KeyError):
+        logging.debug('GTF cache miss for %s (could not read %s)' % (file_path, my_cache))
+        return None
+    logging.debug('GTF cache hit for %s. Loaded %s in %.2f seconds' % (file_path, my_cache, time.time() - begin_time))
+    return gene_dict
+
+
+def save(file_path, filter_factor, gene_dict):
+    """
+    Write gene_dict to the cache. The cache is first written to a temporary
+    file so an interrupted run never leaves a half written cache behind.
+    """
+    begin_time = time.time()
+    if not os.path.isdir(CACHE_DIR): os.mkdir(CACHE_DIR)
+    my_cache = cache_path(file_path, filter_factor)
+    tmp_cache = my_cache + '.tmp'
+    try:
+        with open(tmp_cache, 'wb') as handle:
+            pickle.dump(make_header(file_path, filter_factor), handle, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(gene_dict, handle, pickle.HIGHEST_PROTOCOL)
+        if os.path.exists(my_cache): os.remove(my_cache)  # windows does not overwrite on rename
+        os.rename(tmp_cache, my_cache)
+    except (IOError, OSError, pickle.PicklingError):
+        # a failed cache write should never stop primer design
+        logging.debug('Could not write GTF cache %s' % my_cache)
+        if os.path.exists(tmp_cache): os.remove(tmp_cache)
+        return
+    logging.debug('Wrote GTF cache %s in %.2f seconds' % (my_cache, time.time() - begin_time))
@@ -0,0 +1,180 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: java_daemon.py
+Author: Collin Tokheim
+Description: Keeps one ExtractDaemon.jar process running for each BAM,
+BigWig or BigBed file so extracting a region does not start a new JVM and
+re-read the file index every time. Requests and answers go over the stdin
+and stdout pipes of the java process (see java_src/ExtractDaemon.java).
+A daemon that dies is restarted and all daemons are stopped by shutdown_all
+at the end of primer.main.
+'''
+import subprocess
+import os
+import atexit
+import threading
+
+# for logging purposes
+import logging
+import time
+
+BIN_DIR = 'bin'  # directory of jar files
+DAEMON_JAR = 'ExtractDaemon.jar'
+# the daemon only holds its own class so the libraries come from the other jars
+CLASS_PATH = [DAEMON_JAR, 'ExtractSamRegion.jar', 'ExtractBigRegion.jar']
+END_OF_ANSWER = '//'
+ERROR_PREFIX = '!error\t'
+MAX_RESTARTS = 3  # give up on a file after the daemon died this many times
+MAX_BATCH = 128  # requests written before reading answers (keeps the pipes from filling up)
+
+daemons = {}  # file path -> JavaDaemon
+daemons_lock = threading.Lock()
+warned_missing = False  # is_available logs a missing jar only once
+
+
+class DaemonError(Exception):
+    """
+    Raised when a region could not be extracted by the daemon. Callers
+    (sam.Sam, base_bed_wig.BaseBedWig) catch it and extract the region with
+    a jar instead, so it never stops the primer design of other targets.
+    """
+    pass
+
+
+def is_available():
+    """
+    Check that the daemon jar was built. Only called when the daemon backend
+    is configured, so a missing jar is logged (once) as a warning before the
+    caller falls back to starting a jar per region.
+    """
+    global warned_missing
+    jar_path = os.path.join(BIN_DIR, DAEMON_JAR)
+    if os.path.exists(jar_path):
+        return True
+    if not warned_missing:
+        logging.warning('The daemon backend is configured but %s is missing, '
+                        'so one java process is started per region instead' % jar_path)
+        warned_missing = True
+    return False
+
+
+class JavaDaemon(object):
+    """
+    A single ExtractDaemon.jar process serving regions of one file.
+    """
+    def __init__(self, path, memory):
+        self.path = path
+        self.memory = memory
+        self.process = None
+        self.restarts = 0
+        self.lock = threading.Lock()  # one conversation with the process at a time
+
+    def start(self):
+        logging.debug('Starting extraction daemon for %s' % self.path)
+        class_path = os.pathsep.join(os.path.join(BIN_DIR, jar) for jar in CLASS_PATH)
+        cmd = ['java', '-Xmx%sm' % self.memory, '-cp', class_path, 'ExtractDaemon', self.path]
+        self.process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, bufsize=-1)
+
+    def stop(self, kill=False):
+        """Stop the daemon by closing its stdin (or kill it)."""
+        if self.process is None:
+            return
+        try:
+            if kill:
+                self.process.kill()
+            else:
+                self.process.stdin.close()
+            self.process.wait()
+        except (IOError, OSError):
+            pass
+        logging.debug('Stopped extraction daemon for %s' % self.path)
+        self.process = None
+
+    def __ask(self, requests):
+        """Send a batch of requests and read the answer lines of each one."""
+        for request in requests:
+            self.process.stdin.write('\t'.join(map(str, request)) + '\n')
+        self.process.stdin.flush()
+        answers = []
+        for request in requests:
+            lines = []
+            while True:
+                line = self.process.stdout.readline()
+                if not line:
+                    raise IOError('extraction daemon for %s exited' % self.path)
+                line = line.rstrip('\r\n')
+                if line == END_OF_ANSWER:
+                    break
+                lines.append(line)
+            answers.append(lines)
+        return answers
+
+    def query(self, requests):
+        """
+        Answer a list of requests, each a tuple of (chr, start, end) or
+        (chr, start, end, contained) in 1-based coordinates. Returns a list
+        holding the answer lines for each request.
+        """
+        answers = []
+        with self.lock:
+            for i in range(0, len(requests), MAX_BATCH):
+                batch = requests[i:i + MAX_BATCH]
+                while True:
+                    if self.process is None or self.process.poll() is not None:
+                        self.start()
+                    try:
+                        batch_answers = self.__ask(batch)
+                        break
+                    except (IOError, OSError):
+                        # the daemon crashed, so restart it and ask again
+                        logging.debug('Extraction daemon for %s died' % self.path)
+                        self.stop(kill=True)
+                        self.restarts += 1
+                        if self.restarts > MAX_RESTARTS:
+                            raise DaemonError('Extraction daemon for %s died %d times' % (self.path, self.restarts))
+                for request, lines in zip(batch, batch_answers):
+                    # the daemon only sends the error line, but never hand
+                    # a partial answer to the caller if one slips through
+                    for line in lines:
+                        if line.startswith(ERROR_PREFIX):
+                            raise DaemonError('Could not extract %s:%s-%s from %s (%s)' % (
+                                request[0], request[1], request[2], self.path, line[len(ERROR_PREFIX):]))
+                answers.extend(batch_answers)
+        return answers
+
+
+def get_daemon(path, memory):
+    """Return the daemon for a file, creating it the first time."""
+    with daemons_lock:
+        if path not in daemons:
+            daemons[path] = JavaDaemon(path, memory)
+        return daemons[path]
+
+
+def shutdown_all():
+    """Stop every running daemon."""
+    with daemons_lock:
+        begin_time = time.time()
+        for path in daemons:
+            daemons[path].stop()
+        if daemons:
+            logging.debug('Stopped %d extraction daemon(s) in %.2f seconds' % (len(daemons), time.time() - begin_time))
+        daemons.clear()
+
+
+atexit.register(shutdown_all)  # never leave java processes behind
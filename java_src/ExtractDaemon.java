@@ -0,0 +1,169 @@
+import net.sf.samtools.*;
+import org.broad.igv.bbfile.BBFileReader;
+import org.broad.igv.bbfile.BBFileHeader;
+import org.broad.igv.bbfile.BedFeature;
+import org.broad.igv.bbfile.BigBedIterator;
+import org.broad.igv.bbfile.BigWigIterator;
+import org.broad.igv.bbfile.WigItem;
+import java.io.*;
+
+/*
+ * Long running version of ExtractSamRegion and ExtractBigRegion. The BAM,
+ * BigWig or BigBed file (and its index) is opened once and regions are then
+ * read from stdin, one request per line:
+ *
+ *     <chr>\t<start>\t<end>[\t<contained>]   (BigWig/BigBed)
+ *     <chr>\t<start>\t<end>[\t<anchor>]      (BAM)
+ *
+ * using the same 1-based coordinates as the other jar files. The answer to
+ * each request is written to stdout followed by a line holding only "//".
+ * Requests may be sent in batches since answers are written in order.
+ *
+ * BAM answers have one line per read overlapping the region:
+ *     <chr>\t<1-based start>\t<cigar>
+ * If an anchor is given only junction reads with that anchor length are
+ * written (same check as ExtractSamRegion) followed by the line
+ *     #scanned\t<number of reads overlapping the region>
+ * BigWig/BigBed answers have the same lines ExtractBigRegion writes to file.
+ * A request that fails is answered only by "!error\t<message>" (lines
+ * written before the failure are dropped).
+ *
+ * The daemon exits when stdin is closed.
+ */
+public class ExtractDaemon {
+
+	public static String join(String[] fields, String separator){
+	    StringBuilder stringBuilder = new StringBuilder();
+	    for(int i = 0; i < fields.length; i++){
+            stringBuilder.append(fields[i]);
+            if(i < fields.length - 1){
+            	stringBuilder.append(separator);
+            }
+	    }
+	    return stringBuilder.toString();
+	}
+
+	public static void indexBam(File inputBam, String bamPath){
+        SAMFileReader tmpBam = new SAMFileReader(inputBam);
+    	File indexFile = new File(bamPath + ".bai");
+    	BAMIndexer index = new BAMIndexer(indexFile, tmpBam.getFileHeader());
+    	tmpBam.enableFileSource(true);
+    	SAMRecordIterator myIterator = tmpBam.iterator();
+    	while(myIterator.hasNext()){
+    		index.processAlignment(myIterator.next());
+    	}
+    	index.finish();
+    	tmpBam.close();
+	}
+
+	public static void writeBamRegion(SAMFileReader bam, PrintStream output, String chr, int start, int end, int anchor){
+        SAMRecordIterator regionIterator = bam.queryOverlapping(chr, start, end);
+        int totalReads = 0;
+        try{
+	        while(regionIterator.hasNext()){
+	        	SAMRecord read = regionIterator.next();
+	        	totalReads++;
+	        	if(anchor >= 0 && !JunctionFilter.isJunctionRead(read, anchor)){
+	        		continue;  // not a junction read so skip
+	        	}
+	        	output.print(read.getReferenceName() + "\t" + Integer.toString(read.getAlignmentStart()) + "\t" + read.getCigarString() + "\n");
+	        }
+        }catch (java.nio.BufferUnderflowException e){
+        	// same as ExtractSamRegion, treat as no reads in the region
+        }finally{
+        	regionIterator.close();
+        }
+        if(anchor >= 0){
+        	output.print("#scanned\t" + Integer.toString(totalReads) + "\n");
+        }
+	}
+
+	public static void writeBigRegion(BBFileReader reader, PrintStream output, String chr, int start, int end, boolean contained){
+		if(reader.isBigBedFile()){
+			BigBedIterator iter = reader.getBigBedIterator(chr, start, chr, end, contained);
+			while(iter.hasNext()){
+				BedFeature bedFeature = iter.next();
+				output.format("%s\t%d\t%d\t%s\n", bedFeature.getChromosome(), bedFeature.getStartBase(), bedFeature.getEndBase(),
+							  ExtractDaemon.join(bedFeature.getRestOfFields(), "\t"));
+			}
+		}else{
+			BigWigIterator iter = reader.getBigWigIterator(chr, start, chr, end, contained);
+			while(iter.hasNext()){
+				WigItem wigItem = iter.next();
+				output.format("%s\t%d\t%d\t%d\n", wigItem.getChromosome(), wigItem.getStartBase(), wigItem.getEndBase(), (int) wigItem.getWigValue());
+			}
+		}
+	}
+
+	public static void main(String[] args) throws IOException{
+		if(args.length != 1){
+			System.out.println("This utility keeps a BAM, BigWig or BigBed file open and extracts regions requested on stdin.\n");
+			System.out.println("Usage:\njava -jar ExtractDaemon.jar <input.(bam|bigWig|bigBed)>\n");
+			System.out.println("Then write lines of <chr>\\t<start>\\t<end>[\\t<contained>] to stdin.");
+			System.exit(0);
+		}
+
+		// open the file once
+		SAMFileReader bam = null;
+		BBFileReader big = null;
+		if(args[0].endsWith(".bam")){
+			File inputBam = new File(args[0]);
+	        SAMFileReader checkBam = new SAMFileReader(inputBam);
+	        if (!checkBam.isBinary()) {
+	        	System.err.println("The input file must be bam, not sam. The input file was not binary as expected.");
+	        	System.exit(1);
+	        }
+	        if(!checkBam.hasIndex()){
+	        	indexBam(inputBam, args[0]);
+	        }
+	        checkBam.close();
+	        bam = new SAMFileReader(inputBam);
+		}else{
+			big = new BBFileReader(args[0]);
+			BBFileHeader header = big.getBBFileHeader();
+			if(!header.isHeaderOK()){
+				System.err.println("The header is not OK!");
+				System.exit(1);
+			}
+		}
+
+		// answer requests until stdin is closed
+		BufferedReader input = new BufferedReader(new InputStreamReader(System.in));
+		PrintStream output = new PrintStream(new BufferedOutputStream(System.out, 1 << 16), false);
+		String request;
+		ByteArrayOutputStream answer = new ByteArrayOutputStream(1 << 16);
+		PrintStream answerOutput = new PrintStream(answer, false);
+		while((request = input.readLine()) != null){
+			// buffer the answer so a request that fails part way only sends the error line
+			answer.reset();
+			try{
+				String[] fields = request.split("\t");
+				String chr = fields[0];
+				int start = Integer.parseInt(fields[1]);
+				int end = Integer.parseInt(fields[2]);
+				if(bam != null){
+					int anchor = fields.length > 3 ? Integer.parseInt(fields[3]) : -1;  // -1 keeps every read
+					writeBamRegion(bam, answerOutput, chr, start, end, anchor);
+				}else{
+					if(end < start){
+						int tmp = start;
+						start = end;
+						end = tmp;
+					}
+					boolean contained = fields.length > 3 && fields[3].equals("true");
+					writeBigRegion(big, answerOutput, chr, start, end, contained);
+				}
+				answerOutput.flush();
+				answer.writeTo(output);
+			}catch (Exception e){
+				output.print("!error\t" + e.toString().replace('\n', ' ') + "\n");
+			}
+			output.print("//\n");
+			output.flush();
+		}
+
+		if(bam != null){
+			bam.close();
+		}
+	}
+}
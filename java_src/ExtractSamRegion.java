@@ -1,13 +1,16 @@
 import net.sf.samtools.*; 
 import java.io.File;
+import java.io.PrintStream;
 
 public class ExtractSamRegion {
 	public static void main(String[] args){
 		// explain command line args if they don't enter the correct number
-		if(args.length != 5){
+		if(args.length != 5 && args.length != 6){
 			System.out.println("This utility gets the reads in a bam file that overlap with the 1-based coordinates specified by the user.\n");
 			System.out.println("Usage:\njava -jar ExtractSamRegion.jar <input.bam> <output.sam> <chr> <start> <end>\n");
-			System.out.println("Example:\njava -jar ExtractSamRegion.jar example.bam out.sam chr1 2000 30000");
+			System.out.println("Example:\njava -jar ExtractSamRegion.jar example.bam out.sam chr1 2000 30000\n");
+			System.out.println("Use - as <output.sam> to write the reads to stdout. If [anchor] is given after <end>");
+			System.out.println("only junction reads with an anchor length of at least [anchor] are written.");
 			System.exit(0);
 		}
 		 
@@ -17,7 +20,9 @@ public class ExtractSamRegion {
 			System.exit(0);
 		}
 		File inputBam = new File(args[0]);
-		if(!args[1].endsWith(".sam")){
+		boolean toStdout = args[1].equals("-");  // stream reads to stdout and messages to stderr
+		PrintStream log = toStdout ? System.err : System.out;
+		if(!toStdout && !args[1].endsWith(".sam")){
 			System.out.println("ExtractSamRegion outputs the region as a .sam file");
 			System.exit(0);
 		}
@@ -26,7 +31,7 @@ public class ExtractSamRegion {
 		
         // Make sure bam is actually binary and thus not sam
         if (!checkBam.isBinary()) {
-        	System.out.println("The input file must be bam, not sam. The input file was not binary as expected.");
+        	log.println("The input file must be bam, not sam. The input file was not binary as expected.");
         	System.exit(1);
         }
         
@@ -52,29 +57,43 @@ public class ExtractSamRegion {
         // parse the start, end argument inputs
         int start = Integer.parseInt(args[3]);
         int end = Integer.parseInt(args[4]);
+        int anchor = args.length == 6 ? Integer.parseInt(args[5]) : -1;  // -1 keeps every read
         if(start > end){
-        	System.out.println("Yikes your start is greater than your end!");
+        	log.println("Yikes your start is greater than your end!");
         	System.exit(1);
         }
         
+        SAMFileWriter outputSam = null;
         try{ 
-	        final SAMFileWriter outputSam = new SAMFileWriterFactory().makeSAMOrBAMWriter(bam.getFileHeader(),
-	                true, outputSamFile); // output
+	        if(toStdout){
+	        	outputSam = new SAMFileWriterFactory().makeSAMWriter(bam.getFileHeader(), true, System.out);
+	        }else{
+	        	outputSam = new SAMFileWriterFactory().makeSAMOrBAMWriter(bam.getFileHeader(),
+	        			true, outputSamFile); // output
+	        }
 	        
 	        // iterate over reads in the specified region
-	        int totalReads = 0;
+	        int totalReads = 0, keptReads = 0;
 	        SAMRecordIterator regionIterator = bam.queryOverlapping(args[2], start, end);
 	        SAMRecord tmp;
 	        while(regionIterator.hasNext()){
 	        	tmp = regionIterator.next();
-	        	outputSam.addAlignment(tmp);
 	        	totalReads++;
+	        	if(anchor >= 0 && !JunctionFilter.isJunctionRead(tmp, anchor)){
+	        		continue;  // not a junction read so skip
+	        	}
+	        	outputSam.addAlignment(tmp);
+	        	keptReads++;
 	        }
 	
-	        System.out.println("A total of " + Integer.toString(totalReads) + " reads were found overlapping " + args[2] + ":" + args[3] + "-" + args[4]);
+	        log.println("A total of " + Integer.toString(totalReads) + " reads were found overlapping " + args[2] + ":" + args[3] + "-" + args[4] +
+	        		" (" + Integer.toString(keptReads) + " written)");
 	        outputSam.close();  // close files
         }catch (java.nio.BufferUnderflowException e){
-        	System.out.println("A total of 0 reads were found overlapping " + args[2] + ":" + args[3] + "-" + args[4]);
+        	if(outputSam != null){
+        		outputSam.close();  // flush what was already written
+        	}
+        	log.println("A total of 0 reads were found overlapping " + args[2] + ":" + args[3] + "-" + args[4]);
         }
         
         bam.close();
@@ -0,0 +1,33 @@
+import net.sf.samtools.*;
+
+/*
+ * Junction read check shared by ExtractSamRegion and ExtractDaemon. It is
+ * built into ExtractSamRegion.jar, which is also on the class path of
+ * ExtractDaemon.
+ */
+public class JunctionFilter {
+	/*
+	 * Check that a read only has M/N cigar operations and at least one
+	 * junction with M blocks of at least anchor bases on both sides, i.e. a
+	 * read that jct_counts.py would count.
+	 */
+	public static boolean isJunctionRead(SAMRecord read, int anchor){
+		java.util.ArrayList<Integer> incs = new java.util.ArrayList<Integer>();
+		int skips = 0;
+		for(CigarElement element : read.getCigar().getCigarElements()){
+			if(element.getOperator() == CigarOperator.M){
+				incs.add(element.getLength());
+			}else if(element.getOperator() == CigarOperator.N){
+				skips++;
+			}else{
+				return false;
+			}
+		}
+		for(int i = 0; i < incs.size() - 1; i++){
+			if(i < skips && incs.get(i) >= anchor && incs.get(i + 1) >= anchor){
+				return true;
+			}
+		}
+		return false;
+	}
+}
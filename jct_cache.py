@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: jct_cache.py
+Author: Collin Tokheim
+Description: Keeps the junction counts extracted for a region so that
+targets in the same gene, and the isoform counts saved after primer design,
+do not extract the same region of a BAM file again. The junctions of a
+region are kept as a junction_index.JunctionIndex, which holds the counts
+for every anchor length, in memory in least recently used order up to a
+size limit. Optionally every region is also written to the cache directory,
+like gtf_cache.py, so later runs on the same BAM files can read it from disk.
+
+Keys are (BAM path, BAM mtime, chr, start, end) so a changed BAM file never
+returns old counts.
+'''
+from collections import OrderedDict
+import cPickle as pickle
+import hashlib
+import threading
+import os
+import gtf_cache
+
+# for logging purposes
+import logging
+
+REGION_BYTES = 2048  # rough memory used by a cached region besides the arrays of its table
+JCT_CACHE_DIR = os.path.join(gtf_cache.CACHE_DIR, 'jct')  # directory of the on disk tier
+
+
+def region_key(bam_path, chr, start, end):
+    """Cache key of a region extracted from a BAM file."""
+    return (os.path.abspath(bam_path), os.path.getmtime(bam_path), chr, start, end)
+
+
+def disk_path(key):
+    """File holding a region of the on disk tier."""
+    return os.path.join(JCT_CACHE_DIR, '%s.jct.cache' % hashlib.md5(repr(key)).hexdigest())
+
+
+def region_size(junctions):
+    """Bytes used by the junction table of a cached region."""
+    return junctions.nbytes + REGION_BYTES
+
+
+class JunctionCache(object):
+    """
+    Least recently used cache of junction tables. The memory tier holds at
+    most max_size bytes of tables (see region_size) and the disk tier is only
+    used if use_disk is True. Safe to use from the threads of
+    sam.extract_regions.
+    """
+    def __init__(self, max_size, use_disk=False):
+        self.max_size = max_size
+        self.use_disk = use_disk
+        self.regions = OrderedDict()  # key -> junction dict, least recently used first
+        self.size = 0  # bytes used by self.regions
+        self.lock = threading.Lock()
+        self.hits, self.disk_hits, self.misses, self.evictions = 0, 0, 0, 0
+
+    def get(self, key):
+        """Return the junction table of a region or None if it is not cached."""
+        with self.lock:
+            if key in self.regions:
+                self.hits += 1
+                junctions = self.regions.pop(key)
+                self.regions[key] = junctions  # now the most recently used
+                return junctions
+        junctions = self.__load(key) if self.use_disk else None
+        with self.lock:
+            if junctions is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self.__add(key, junctions)
+        return junctions
+
+    def put(self, key, junctions):
+        """Cache the junction table of a region."""
+        with self.lock:
+            self.__add(key, junctions)
+        if self.use_disk: self.__save(key, junctions)
+
+    def __add(self, key, junctions):
+        if region_size(junctions) > self.max_size: return  # would evict everything else
+        if key in self.regions:
+            self.size -= region_size(self.regions.pop(key))
+        self.regions[key] = junctions
+        self.size += region_size(junctions)
+        while self.size > self.max_size:
+            old_key, old_junctions = self.regions.popitem(last=False)
+            self.size -= region_size(old_junctions)
+            self.evictions += 1
+
+    def __load(self, key):
+        path = disk_path(key)
+        if not os.path.exists(path): return None
+        try:
+            with open(path, 'rb') as handle:
+                if pickle.load(handle) != key: return None  # md5 collision
+                return pickle.load(handle)
+        except (EOFError, IOError, pickle.UnpicklingError, AttributeError, ImportError, KeyError):
+            logging.debug('Could not read junction cache %s' % path)
+            return None
+
+    def __save(self, key, junctions):
+        path = disk_path(key)
+        tmp_path = '%s.%d.tmp' % (path, threading.current_thread().ident)
+        try:
+            if not os.path.isdir(JCT_CACHE_DIR): os.makedirs(JCT_CACHE_DIR)
+            with open(tmp_path, 'wb') as handle:
+                pickle.dump(key, handle, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(junctions, handle, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path): os.remove(path)  # windows does not overwrite on rename
+            os.rename(tmp_path, path)
+        except (IOError, OSError, pickle.PicklingError):
+            # a failed cache write should never stop primer design
+            logging.debug('Could not write junction cache %s' % path)
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+
+    def clear(self):
+        """Empty the memory tier (the disk tier is kept)."""
+        with self.lock:
+            self.regions.clear()
+            self.size = 0
+
+    def stats(self):
+        """Hit/miss counts and the current size of the memory tier."""
+        with self.lock:
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'regions': len(self.regions),
+                    'bytes': self.size}
@@ -18,14 +18,358 @@
 File: jct_counts.py
 Author: Collin Tokheim
 Description: This file reads a sam file and outputs junction read
-counts to file. Since this is a python script, it is only advisable
-to use this on a sam file that only contains reads in your region of
-interest.
+counts to file. SAM text is read in large batches. Reads with a single
+junction (e.g. 30M500N46M) are counted with NumPy array operations on the
+raw bytes of each batch and only the remaining lines that may hold a
+junction are split and parsed in python (see count_lines). Large SAM files
+can be split into newline aligned byte ranges that are counted by a pool of
+processes (see count_sam_parallel).
+
+Every counting function takes an anchor length. If it is None, the counts
+are not filtered but keyed by (chr, start, stop, min anchor) instead, where
+the min anchor of a read is the shorter of the two M blocks around the
+junction. Such a table answers the counts for any anchor length (see
+filter_anchor and junction_index.JunctionIndex).
 '''
 import csv
 import argparse
+import multiprocessing
+import os
 import sys
-import re
+import numpy as np
+
+DIGITS = '0123456789'
+BATCH_SIZE = 2 ** 24  # bytes of SAM text read at a time
+CIGAR_WIDTH = 16  # longest CIGAR counted by count_sam_block, longer ones go to count_lines
+POS_WIDTH = 10  # digits of the largest POS (2^31 - 1)
+RNAME_WIDTH = 32  # longest RNAME counted by count_sam_block
+FLAG_WIDTH = 5  # digits of the largest FLAG (65535)
+FLAG_UNMAPPED = 4
+CHUNK_SIZE = 2 ** 26  # bytes of SAM text counted by each task of count_sam_parallel
+POW10 = 10 ** np.arange(CIGAR_WIDTH, dtype=np.int64)
+
+
+def add_junctions(weights, chr, start_pos, incs, skips, anchor):
+    '''
+    Add one to the count in weights of each junction of a read. The read
+    starts at the 0-based start_pos and has M blocks of length incs separated
+    by N gaps of length skips. A junction is only counted if the M blocks on
+    both sides are at least anchor long. If anchor is None every junction is
+    counted with the shorter M block as the fourth part of its key.
+    '''
+    for i in range(len(incs) - 1):
+        jct_start = start_pos + incs[i]
+        jct_stop = jct_start + skips[i]
+        if anchor is None:
+            key = (chr, jct_start, jct_stop, min(incs[i], incs[i+1]))
+            weights[key] = weights.get(key, 0) + 1
+        elif incs[i] >= anchor and incs[i+1] >= anchor:
+            key = (chr, jct_start, jct_stop)
+            weights[key] = weights.get(key, 0) + 1
+        start_pos = jct_stop
+
+
+def add_cigar_junctions(weights, chr, start_pos, cigar, anchor):
+    '''
+    Same as add_junctions but for a read given by its CIGAR string. Reads
+    with cigar operations other than M/N or without a junction are ignored.
+    The CIGAR is only split once into its operations and lengths.
+    '''
+    ops = cigar.translate(None, DIGITS)
+    lengths = cigar.replace('N', 'M').split('M')
+    if ops == 'MNM':
+        # a single junction, by far the most common junction read
+        inc, skip, inc2 = int(lengths[0]), int(lengths[1]), int(lengths[2])
+        if anchor is None:
+            key = (chr, start_pos + inc, start_pos + inc + skip, min(inc, inc2))
+            weights[key] = weights.get(key, 0) + 1
+        elif inc >= anchor and inc2 >= anchor:
+            key = (chr, start_pos + inc, start_pos + inc + skip)
+            weights[key] = weights.get(key, 0) + 1
+        return
+    if 'N' not in ops or ops.strip('MN'): return  # not a junction or other cigar characters found
+    incs = [int(length) for length, op in zip(lengths, ops) if op == 'M']
+    skips = [int(length) for length, op in zip(lengths, ops) if op == 'N']
+    add_junctions(weights, chr, start_pos, incs, skips, anchor)
+
+
+def cigar_blocks(cigar):
+    '''
+    Lengths of the M blocks and N gaps of a CIGAR string like
+    bam.junction_blocks. Returns None if the CIGAR has no junction or
+    operations other than M/N.
+    '''
+    ops = cigar.translate(None, DIGITS)
+    if 'N' not in ops or ops.strip('MN'): return None
+    lengths = cigar.replace('N', 'M').split('M')
+    incs = [int(length) for length, op in zip(lengths, ops) if op == 'M']
+    skips = [int(length) for length, op in zip(lengths, ops) if op == 'N']
+    return incs, skips
+
+
+def count_lines(lines, anchor, weights, skip_unmapped=False):
+    '''
+    Count the junctions of a list of SAM lines into weights. Header lines
+    are skipped and only lines with an N in their CIGAR are parsed further.
+    Reads flagged as unmapped are ignored if skip_unmapped is True.
+    '''
+    for line in lines:
+        if line[0] == '@': continue  # skip line if head character
+        fields = line.split('\t', 6)
+        if 'N' not in fields[5]: continue  # skip if not junction
+        if skip_unmapped and int(fields[1]) & FLAG_UNMAPPED: continue
+        add_cigar_junctions(weights, fields[2], int(fields[3]) - 1, fields[5], anchor)
+
+
+def field_window(buf, field_start, width):
+    '''Bytes of buf in a fixed width window starting at each field_start'''
+    return buf[np.minimum(field_start[:, None] + np.arange(width), len(buf) - 1)]
+
+
+def decimal_value(window, length):
+    '''Integer value of the digits in the first length bytes of each window row'''
+    cols = np.arange(window.shape[1])
+    digits = np.where(cols < length[:, None], window.astype(np.int64) - 48, 0)
+    return (digits * POW10[np.clip(length[:, None] - cols - 1, 0, CIGAR_WIDTH - 1)]).sum(axis=1)
+
+
+def count_sam_block(data, lo, hi, anchor, weights, skip_unmapped=False):
+    '''
+    NumPy version of count_lines for the complete SAM lines in data[lo:hi].
+    The tabs and newlines of the batch are found once and every field is
+    located from them. Reads with a single junction are parsed, filtered by
+    anchor length and counted as arrays. Other lines that may hold a
+    junction (more than one junction, long CIGAR or RNAME fields, lines
+    with less than six fields) are passed on to count_lines.
+    '''
+    buf = np.frombuffer(data, dtype=np.uint8, count=hi - lo, offset=lo)
+    seps = np.flatnonzero(buf < 11)  # tabs and newlines
+    kinds = buf[seps]
+    ends = seps[kinds == 10]
+    tabs = seps[kinds == 9]
+    if len(tabs) < 6:
+        count_lines(data[lo:hi].split('\n')[:-1], anchor, weights, skip_unmapped)
+        return
+    starts = np.empty_like(ends)
+    starts[0], starts[1:] = 0, ends[:-1] + 1
+
+    # the MAPQ and CIGAR fields of each line end at its 5th and 6th tab
+    first = np.searchsorted(tabs, starts)
+    has_fields = first + 5 < len(tabs)
+    first = np.minimum(first, len(tabs) - 6)
+    mapq_end, cigar_end = tabs[first + 4], tabs[first + 5]
+    has_fields &= cigar_end < ends
+    header = buf[starts] == 64
+
+    # lines with an N in their CIGAR (a countable junction needs at least 6
+    # characters, e.g. 1M1N1M, so the CIGAR of most other reads is never read)
+    cigar_len = cigar_end - mapq_end - 1
+    rows = np.flatnonzero(~header & (~has_fields | (cigar_len >= 6)))
+    if not len(rows): return
+    tab_k = [tabs[first[rows] + k] for k in range(6)]  # tab ending field k (QNAME=0, ..., CIGAR=5)
+    cigar_len = cigar_len[rows]
+    cigar = field_window(buf, tab_k[4] + 1, CIGAR_WIDTH)
+    in_cigar = np.arange(CIGAR_WIDTH) < cigar_len[:, None]
+    maybe = ~has_fields[rows] | ((cigar == 78) & in_cigar).any(axis=1) | (cigar_len > CIGAR_WIDTH)
+    rows, cigar, in_cigar, cigar_len = rows[maybe], cigar[maybe], in_cigar[maybe], cigar_len[maybe]
+    tab_k = [tab[maybe] for tab in tab_k]
+    if not len(rows): return
+
+    # find the xMyNzM reads
+    is_digit = (cigar >= 48) & (cigar <= 57) & in_cigar
+    n_ops = np.cumsum(in_cigar & ~is_digit, axis=1)
+    op_pos = np.column_stack([np.argmax(n_ops == k, axis=1) for k in (1, 2, 3)])
+    r = np.arange(len(rows))
+    pos_len = tab_k[3] - tab_k[2] - 1
+    rname_len = tab_k[2] - tab_k[1] - 1
+    simple = has_fields[rows] & (cigar_len <= CIGAR_WIDTH) & (n_ops[:, -1] == 3) & \
+        (cigar[r, op_pos[:, 0]] == 77) & (cigar[r, op_pos[:, 1]] == 78) & (cigar[r, op_pos[:, 2]] == 77) & \
+        (op_pos[:, 2] == cigar_len - 1) & (op_pos[:, 0] > 0) & (op_pos[:, 1] > op_pos[:, 0] + 1) & \
+        (op_pos[:, 2] > op_pos[:, 1] + 1) & (pos_len > 0) & (pos_len <= POS_WIDTH) & \
+        (rname_len > 0) & (rname_len <= RNAME_WIDTH)
+    pos_window = field_window(buf, tab_k[2] + 1, POS_WIDTH)
+    simple &= ((pos_window >= 48) & (pos_window <= 57) | (np.arange(POS_WIDTH) >= pos_len[:, None])).all(axis=1)
+    if skip_unmapped:
+        flag_len = tab_k[1] - tab_k[0] - 1
+        flag_window = field_window(buf, tab_k[0] + 1, FLAG_WIDTH)
+        simple &= (flag_len > 0) & (flag_len <= FLAG_WIDTH) & \
+            ((flag_window >= 48) & (flag_window <= 57) | (np.arange(FLAG_WIDTH) >= flag_len[:, None])).all(axis=1)
+
+    # everything else is counted in python
+    other = np.flatnonzero(~simple)
+    if len(other):
+        count_lines([data[lo + s:lo + e] for s, e in zip(starts[rows[other]].tolist(), ends[rows[other]].tolist())],
+                    anchor, weights, skip_unmapped)
+    keep = np.flatnonzero(simple)
+    if not len(keep): return
+
+    # lengths of the M, N and M blocks
+    cigar, op_pos, n_ops, is_digit = cigar[keep], op_pos[keep], n_ops[keep], is_digit[keep]
+    segment = np.minimum(n_ops, 2)  # digits before the first, second and third operation
+    segment_end = op_pos[np.arange(len(keep))[:, None], segment]
+    exponent = np.clip(segment_end - np.arange(CIGAR_WIDTH) - 1, 0, CIGAR_WIDTH - 1)
+    values = np.where(is_digit, (cigar.astype(np.int64) - 48) * POW10[exponent], 0)
+    inc, skip, inc2 = [(values * (segment == k)).sum(axis=1) for k in (0, 1, 2)]
+    pos = decimal_value(pos_window[keep], pos_len[keep])
+    min_anchor = np.minimum(inc, inc2)
+    valid = min_anchor >= (0 if anchor is None else anchor)
+    if skip_unmapped:
+        valid &= (decimal_value(flag_window[keep], flag_len[keep]) & FLAG_UNMAPPED) == 0
+    if not valid.any(): return
+    keep, jct_start = keep[valid], (pos + inc - 1)[valid]
+    jct_stop = jct_start + skip[valid]
+    min_anchor = min_anchor[valid]
+
+    # count identical junctions
+    names = field_window(buf, tab_k[1][keep] + 1, RNAME_WIDTH)
+    names[np.arange(RNAME_WIDTH) >= rname_len[keep][:, None]] = 0
+    names, name_ids = np.unique(np.ascontiguousarray(names).view('S%d' % RNAME_WIDTH).ravel(), return_inverse=True)
+    sort_keys = (jct_stop, jct_start, name_ids) if anchor is not None else (min_anchor, jct_stop, jct_start, name_ids)
+    order = np.lexsort(sort_keys)
+    name_ids, jct_start, jct_stop, min_anchor = name_ids[order], jct_start[order], jct_stop[order], min_anchor[order]
+    change = np.ones(len(order), dtype=bool)
+    change[1:] = (name_ids[1:] != name_ids[:-1]) | (jct_start[1:] != jct_start[:-1]) | (jct_stop[1:] != jct_stop[:-1])
+    if anchor is None: change[1:] |= min_anchor[1:] != min_anchor[:-1]
+    first_of_key = np.flatnonzero(change)
+    counts = np.diff(np.append(first_of_key, len(order)))
+    names = np.array(names.tolist(), dtype=object)[name_ids[first_of_key]].tolist()
+    columns = [names, jct_start[first_of_key].tolist(), jct_stop[first_of_key].tolist()]
+    if anchor is None: columns.append(min_anchor[first_of_key].tolist())
+    get = weights.get
+    for key, count in zip(zip(*columns), counts.tolist()):
+        weights[key] = get(key, 0) + count
+
+
+def filter_anchor(weights, anchor):
+    '''
+    Junction counts with an anchor length of at least anchor from counts
+    keyed by (chr, start, stop, min anchor), i.e. counted with anchor None.
+    '''
+    junctions = {}
+    get = junctions.get
+    for (chr, start, stop, min_anchor), count in weights.iteritems():
+        if min_anchor >= anchor:
+            junctions[(chr, start, stop)] = get((chr, start, stop), 0) + count
+    return junctions
+
+
+def count_batches(batches, anchor, weights, use_numpy=True, skip_unmapped=False):
+    '''
+    Count the junctions of SAM text given as an iterable of strings into
+    weights. Each batch is counted by count_sam_block, or by count_lines if
+    use_numpy is False, and lines split between batches are joined.
+    '''
+    rest = ''  # start of a line that continues in the next batch
+    for data in batches:
+        first = data.find('\n') + 1
+        if not first:
+            rest += data
+            continue
+        last = data.rfind('\n') + 1
+        if use_numpy:
+            count_lines([rest + data[:first]], anchor, weights, skip_unmapped)
+            if last > first: count_sam_block(data, first, last, anchor, weights, skip_unmapped)
+        else:
+            lines = (rest + data[:last]).split('\n')
+            lines.pop()  # empty string after the last newline
+            count_lines(lines, anchor, weights, skip_unmapped)
+        rest = data[last:]
+    if rest: count_lines([rest], anchor, weights, skip_unmapped)
+    return weights
+
+
+def read_batches(handle, size=None):
+    '''
+    Read an open file in BATCH_SIZE pieces until EOF or, if size is given,
+    until size bytes were read. If the last piece ends within a line, the
+    rest of that line is read as well.
+    '''
+    data = ''
+    while size is None or size > 0:
+        data = handle.read(BATCH_SIZE if size is None else min(BATCH_SIZE, size))
+        if not data: break
+        if size is not None: size -= len(data)
+        yield data
+    if size is not None and data and not data.endswith('\n'):
+        yield handle.readline()
+
+
+def count_sam_file(handle, anchor, weights=None, use_numpy=True, skip_unmapped=False):
+    '''
+    Count the junctions of all reads in an open SAM file (or pipe) into
+    weights (a new dict by default). The file is read in BATCH_SIZE pieces
+    that are counted by count_sam_block, or by count_lines if use_numpy is
+    False.
+    '''
+    weights = {} if weights is None else weights
+    return count_batches(read_batches(handle), anchor, weights, use_numpy, skip_unmapped)
+
+
+def count_sam_range(args):
+    '''
+    Count the junctions of the SAM lines that start within the byte range
+    [start, end) of a file. A line that starts before start belongs to the
+    previous range and a line that starts before end is read to its end, so
+    adjacent ranges count every line exactly once. Takes a single tuple of
+    (sam path, start, end, anchor, use_numpy, skip_unmapped) so it can be
+    mapped by a multiprocessing pool.
+    '''
+    sam_path, start, end, anchor, use_numpy, skip_unmapped = args
+    weights = {}
+    with open(sam_path, 'rb') as handle:
+        if start > 0:
+            handle.seek(start - 1)
+            handle.readline()  # skip the end of a line owned by the previous range
+        count_batches(read_batches(handle, end - handle.tell()), anchor, weights, use_numpy, skip_unmapped)
+    return weights
+
+
+def sam_ranges(sam_path, chunk_size=CHUNK_SIZE):
+    '''Split a file into byte ranges of chunk_size bytes.'''
+    size = os.path.getsize(sam_path)
+    return [(start, min(start + chunk_size, size)) for start in range(0, size, chunk_size)]
+
+
+def merge_counts(partial_weights, weights=None):
+    '''Sum junction count dicts into weights (a new dict by default).'''
+    weights = {} if weights is None else weights
+    get = weights.get
+    for partial in partial_weights:
+        for key, count in partial.iteritems():
+            weights[key] = get(key, 0) + count
+    return weights
+
+
+def count_sam_parallel(sam_path, anchor, workers, use_numpy=True, skip_unmapped=False, chunk_size=CHUNK_SIZE):
+    '''
+    Count the junctions of a SAM file with a pool of workers processes. The
+    file is split into byte ranges (see count_sam_range) and the partial
+    counts of the ranges are summed, so the result equals count_sam_file.
+    '''
+    tasks = [(sam_path, start, end, anchor, use_numpy, skip_unmapped)
+             for start, end in sam_ranges(sam_path, chunk_size)]
+    if workers <= 1 or len(tasks) <= 1:
+        return merge_counts(count_sam_range(task) for task in tasks)
+    pool = multiprocessing.Pool(processes=min(workers, len(tasks)))
+    try:
+        return merge_counts(pool.imap_unordered(count_sam_range, tasks))
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.close()
+        pool.join()
+
+
+def write_counts(weights, file_output):
+    '''
+    Write junction counts keyed by (chr, start, stop) as tab delimited
+    chr/start/stop/count lines sorted by position (the .jct format).
+    '''
+    # convert dict to list so it can written in tabular form
+    output = [[chr, start, stop, weights[(chr, start, stop)]] for chr, start, stop in weights]
+    output.sort(key=lambda x: (x[0], x[1], x[2]))
+    csv.writer(file_output, delimiter='\t').writerows(output)
 
 
 def main(options):
@@ -36,37 +380,16 @@ def main(options):
     if options['sam'] == 'stdin':
         file_input = sys.stdin
     else:
-        file_input = open(options['sam'])
-
-    # iterate through each read
-    inc_search, skip_search, error_search = re.compile('\d+(?=M)'), re.compile('\d+(?=N)'), re.compile('[^MN0-9]')
-    QNAME, FLAG, RNAME, POS, MAPQ, CIGAR = range(6)  # define some SAM columns
-    weights = {}  # hold edge count information
-    for line in csv.reader(file_input, delimiter='\t'):
-        if line[0][0] == '@': continue  # skip line if head character
-        if error_search.search(line[CIGAR]): continue  # other cigar characters found
-
-        # get M/N cigar info
-        skips = map(int, skip_search.findall(line[CIGAR]))
-        if not len(skips): continue  # skip if not junction
-        incs = map(int, inc_search.findall(line[CIGAR]))
-        valid_anchor_lengths = map(lambda x: x >= options['anchor'], incs)
-        # if not reduce(lambda x, y: x and x >= options['anchor'], incs): continue  # small anchor length
-
-        # add 1 to weights
-        start_pos = int(line[POS]) - 1  # init to start pos of mapped read
-        for i in range(len(incs) - 1):
-            jct_start = start_pos + incs[i]
-            jct_stop = jct_start + skips[i]
-            if valid_anchor_lengths[i] and valid_anchor_lengths[i+1]:
-                weights.setdefault((line[RNAME], jct_start, jct_stop), 0)
-                weights[(line[RNAME], jct_start, jct_stop)] += 1
-            start_pos = jct_stop
-    file_input.close()  # close input
+        file_input = open(options['sam'], 'rb')
 
-    # convert dict to list so it can written in tabular form
-    output = [[chr, start, stop, weights[(chr, start, stop)]] for chr, start, stop in weights]
-    output.sort(key=lambda x: (x[0], x[1], x[2]))
+    # count junctions of each read
+    if options.get('workers', 1) > 1 and file_input is not sys.stdin:
+        file_input.close()
+        weights = count_sam_parallel(options['sam'], options['anchor'], options['workers'],
+                                     use_numpy=options.get('numpy', True))
+    else:
+        weights = count_sam_file(file_input, options['anchor'], use_numpy=options.get('numpy', True))
+        file_input.close()  # close input
 
     # define output as either a file or stdout
     if options['output'] == 'stdout':
@@ -74,7 +397,7 @@ def main(options):
     else:
         file_output = open(options['output'], 'wb')
 
-    csv.writer(file_output, delimiter='\t').writerows(output)
+    write_counts(weights, file_output)
     file_output.close()  # close output
 
 
@@ -84,6 +407,8 @@ if __name__ == '__main__':
     parser.add_argument('-s', '--sam', default='stdin', action='store', dest='sam', help='sam file name or `stdin` (default)')
     parser.add_argument('-o', '--output', default='stdout', action='store', dest='output', help='output file name or `stdout` (default)')
     parser.add_argument('-a', '--anchor', default=1, type=int, action='store', dest='anchor', help='only count junction reads with an anchor length GTEQ this value (Default=1)')
+    parser.add_argument('-w', '--workers', default=1, type=int, action='store', dest='workers', help='number of processes counting parts of a SAM file (Default=1, not used for stdin)')
+    parser.add_argument('--no-numpy', action='store_false', dest='numpy', help='parse every line in python instead of counting single junction reads with NumPy')
     options = vars(parser.parse_args())
 
     main(options)  # run script
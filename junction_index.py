@@ -0,0 +1,357 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: junction_index.py
+Author: Collin Tokheim
+Description: Counts every junction of a SAM/BAM file in one pass and stores
+the counts as sorted, per chromosome tables in a binary file next to the
+SAM/BAM (or in the cache directory if that is not writable). The file does
+not have to be sorted or indexed. Junction counts of a region are then
+found by binary search so no reads, tmp SAM files or .jct files are needed.
+
+Reads are counted by junction and min anchor (the shorter M block next to
+the junction, see jct_counts.py) so one index answers the counts for any
+anchor length. The tables are also used by sam.Sam to cache the junctions
+of extracted regions.
+
+Large files can be counted by a pool of processes that each count one part
+of the file (see count_junctions_parallel). The partial counts are summed so
+the index is the same as when the file is counted in a single pass.
+
+An index file holds two pickles. The first is a header describing the
+SAM/BAM it was built from (size and mtime) and the second maps each
+chromosome to the NumPy arrays of a JunctionIndex (see make_tables).
+'''
+import cPickle as pickle
+import argparse
+import csv
+import multiprocessing
+import os
+import numpy as np
+import bam
+import jct_counts
+import gtf_cache
+
+# for logging purposes
+import logging
+import time
+
+# bump this whenever the layout of the index changes
+INDEX_VERSION = 2
+BAM_CHUNK_SIZE = 2 ** 24  # compressed bytes of BAM counted by each task of count_junctions_parallel
+
+
+def index_path(sam_path):
+    """Path of the junction index stored next to a SAM/BAM file."""
+    return '%s.jidx' % sam_path
+
+
+def cache_index_path(sam_path):
+    """Path of the junction index when the SAM/BAM directory is not writable."""
+    return os.path.join(gtf_cache.CACHE_DIR, os.path.basename(index_path(sam_path)))
+
+
+def make_header(sam_path):
+    """Describe the SAM/BAM file that an index was built from."""
+    stat = os.stat(sam_path)
+    return {'version': INDEX_VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime}
+
+
+def count_junctions(sam_path):
+    """
+    Count the junctions of every read in a SAM or BAM file. Returns a dict
+    with (chr, start, stop, min anchor) keys (see jct_counts.py).
+    """
+    weights, stats = {}, {'scanned': 0, 'kept': 0}
+    if sam_path.endswith('.bam'):
+        for chr, pos, cigar in bam.iter_alignments(sam_path, anchor=1, stats=stats):
+            incs, skips = bam.junction_blocks(cigar)
+            jct_counts.add_junctions(weights, chr, pos, incs, skips, None)
+    else:
+        QNAME, FLAG, RNAME, POS, MAPQ, CIGAR = range(6)  # define some SAM columns
+        with open(sam_path) as handle:
+            for line in csv.reader(handle, delimiter='\t'):
+                if line[0][0] == '@': continue  # skip line if head character
+                stats['scanned'] += 1
+                if 'N' not in line[CIGAR]: continue  # skip if not junction
+                if int(line[FLAG]) & bam.FLAG_UNMAPPED: continue  # same reads as bam.iter_alignments
+                stats['kept'] += 1
+                jct_counts.add_cigar_junctions(weights, line[RNAME], int(line[POS]) - 1, line[CIGAR], None)
+    logging.debug('Kept %d of %d reads in %s as junction reads' % (stats['kept'], stats['scanned'], sam_path))
+    return weights
+
+
+def count_bam_range(args):
+    """
+    Count the junctions of the alignments of a BAM file that start within
+    the BGZF blocks from block_start up to block_stop. Takes a single tuple
+    of (bam path, block_start, block_stop, start) so it can be mapped
+    by a multiprocessing pool. start is the virtual offset of the first
+    alignment, which is guessed by bam.guess_record_start if it is None.
+    Returns the virtual offsets of the first alignment and of the end of the
+    last alignment with the junction counts and read stats.
+    """
+    bam_path, block_start, block_stop, start = args
+    weights, stats = {}, {'scanned': 0, 'kept': 0, 'offset': None}
+    if start is None:
+        start = bam.guess_record_start(bam_path, block_start)
+        if start is None: return None, None, weights, stats
+    for chr, pos, cigar in bam.iter_alignments(bam_path, 1, stats, start, block_stop << 16):
+        incs, skips = bam.junction_blocks(cigar)
+        jct_counts.add_junctions(weights, chr, pos, incs, skips, None)
+    return start, stats['offset'], weights, stats
+
+
+def count_junctions_parallel(sam_path, workers, chunk_size=None):
+    """
+    Same as count_junctions but with a pool of workers processes. A SAM file
+    is split into byte ranges (see jct_counts.count_sam_parallel). A BAM
+    file is split into ranges of BGZF blocks and each worker guesses where
+    the first alignment of its range starts (see count_bam_range). The
+    ranges are merged in file order and a range whose guessed start is not
+    where the previous range ended is counted again from there, so every
+    alignment is counted exactly once.
+    """
+    if not sam_path.endswith('.bam'):
+        weights = jct_counts.count_sam_parallel(sam_path, None, workers, skip_unmapped=True,
+                                                chunk_size=chunk_size or jct_counts.CHUNK_SIZE)
+        logging.debug('Counted junctions of %s with %d worker(s)' % (sam_path, workers))
+        return weights
+
+    tasks = [(sam_path, block_start, block_stop, None)
+             for block_start, block_stop in bam.block_ranges(sam_path, chunk_size or BAM_CHUNK_SIZE)]
+    weights, stats = {}, {'scanned': 0, 'kept': 0}
+    offset = bam.guess_record_start(sam_path, 0)  # exact for the first block
+    pool = multiprocessing.Pool(max(1, min(workers, len(tasks))))
+    try:
+        for task, (start, stop, partial, partial_stats) in zip(tasks, pool.imap(count_bam_range, tasks)):
+            if start != offset:
+                logging.debug('Recounting blocks %d to %d of %s' % (task[1], task[2], sam_path))
+                start, stop, partial, partial_stats = count_bam_range(task[:-1] + (offset,))
+            jct_counts.merge_counts([partial], weights)
+            stats['scanned'] += partial_stats['scanned']
+            stats['kept'] += partial_stats['kept']
+            offset = stop
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    logging.debug('Kept %d of %d reads in %s as junction reads (%d parts, %d worker(s))' %
+                  (stats['kept'], stats['scanned'], sam_path, len(tasks), workers))
+    return weights
+
+
+def make_tables(weights):
+    """
+    Sort junction counts with (chr, start, stop, min anchor) keys into per
+    chromosome arrays. The junctions are ordered by start then stop and the
+    counts of junction i are held by counts[offsets[i]:offsets[i+1]] for the
+    min anchors in anchors[offsets[i]:offsets[i+1]].
+    """
+    by_chr = {}
+    for (chr, start, stop, min_anchor), count in weights.iteritems():
+        by_chr.setdefault(chr, []).append((start, stop, min_anchor, count))
+    tables = {}
+    for chr in by_chr:
+        rows = np.array(by_chr[chr], dtype=np.int64)
+        tables[chr] = make_table(rows[:, 0], rows[:, 1], rows[:, 2], rows[:, 3])
+    return tables
+
+
+def make_table(starts, stops, anchors, counts):
+    """
+    Table of one chromosome (see make_tables) from arrays with the start,
+    stop, min anchor and count of junctions. Rows with the same junction and
+    min anchor are summed.
+    """
+    order = np.lexsort((anchors, stops, starts))
+    starts, stops, anchors, counts = starts[order], stops[order], anchors[order], counts[order]
+    new_row = np.ones(len(order), dtype=bool)
+    new_row[1:] = (starts[1:] != starts[:-1]) | (stops[1:] != stops[:-1]) | (anchors[1:] != anchors[:-1])
+    rows = np.flatnonzero(new_row)
+    counts = np.add.reduceat(counts, rows) if len(rows) else counts
+    starts, stops, anchors = starts[rows], stops[rows], anchors[rows]
+    new_jct = np.ones(len(rows), dtype=bool)
+    new_jct[1:] = (starts[1:] != starts[:-1]) | (stops[1:] != stops[:-1])
+    first = np.flatnonzero(new_jct)
+    return (starts[first].astype(np.int64), stops[first].astype(np.int64), np.append(first, len(rows)),
+            anchors.astype(np.int32), counts.astype(np.int32))
+
+
+class JunctionIndex(object):
+    """
+    Junction counts of a SAM/BAM file (or of one region of it) that answers
+    region queries by binary search. Besides the starts, a running maximum of
+    the stops is kept for each chromosome so the first junction that may
+    reach into a region is also found by binary search. The counts of each
+    junction are kept by min anchor so any anchor length can be queried.
+    """
+    def __init__(self, tables):
+        self.tables = {}
+        for chr, (starts, stops, offsets, anchors, counts) in tables.iteritems():
+            self.tables[chr] = (starts, stops, offsets, anchors, counts, np.maximum.accumulate(stops))
+
+    def __junction_counts(self, chr, lo, hi, anchor):
+        """Indices and counts of the junctions lo to hi with reads of at least anchor"""
+        starts, stops, offsets, anchors, counts, max_stops = self.tables[chr]
+        first, last = offsets[lo], offsets[hi]
+        keep = anchors[first:last] >= anchor
+        jcts = np.repeat(np.arange(lo, hi), np.diff(offsets[lo:hi + 1]))[keep]
+        if not len(jcts):
+            return jcts, jcts
+        new_jct = np.ones(len(jcts), dtype=bool)
+        new_jct[1:] = jcts[1:] != jcts[:-1]
+        group_start = np.flatnonzero(new_jct)
+        return jcts[group_start], np.add.reduceat(counts[first:last][keep], group_start)
+
+    def query(self, chr, start, end, anchor):
+        """
+        Junction counts with a (chr, start, stop) key like jct_counts.py for
+        the junctions touching the 0-based region [start, end], i.e. the
+        junctions that can connect exons of a gene spanning the region, of
+        reads with an anchor length of at least anchor.
+        """
+        if chr not in self.tables:
+            return {}
+        starts, stops, offsets, anchors, counts, max_stops = self.tables[chr]
+        lo = np.searchsorted(max_stops, start, side='left')  # first junction with stop >= start
+        hi = np.searchsorted(starts, end, side='right')  # junctions with start <= end
+        if lo >= hi:
+            return {}
+        jcts, sums = self.__junction_counts(chr, lo, hi, anchor)
+        touching = stops[jcts] >= start
+        jcts, sums = jcts[touching], sums[touching]
+        return dict(zip(zip([chr] * len(jcts), starts[jcts].tolist(), stops[jcts].tolist()), sums.tolist()))
+
+    def region(self, chr, start, end):
+        """
+        JunctionIndex of the junctions touching the 0-based region [start,
+        end] (see query) for any anchor length.
+        """
+        if chr not in self.tables:
+            return JunctionIndex({})
+        starts, stops, offsets, anchors, counts, max_stops = self.tables[chr]
+        lo = np.searchsorted(max_stops, start, side='left')
+        hi = max(lo, np.searchsorted(starts, end, side='right'))
+        jcts = np.arange(lo, hi)[stops[lo:hi] >= start]
+        if not len(jcts):
+            return JunctionIndex({})
+        sizes = np.diff(offsets)[jcts]
+        rows = np.repeat(offsets[jcts] - np.cumsum(sizes) + sizes, sizes) + np.arange(sizes.sum())
+        return JunctionIndex({chr: (starts[jcts], stops[jcts], np.append(0, np.cumsum(sizes)), anchors[rows], counts[rows])})
+
+    def counts(self, anchor):
+        """All junction counts of reads with an anchor length of at least anchor"""
+        junctionDict = {}
+        for chr, table in self.tables.iteritems():
+            starts, stops = table[:2]
+            jcts, sums = self.__junction_counts(chr, 0, len(starts), anchor)
+            junctionDict.update(zip(zip([chr] * len(jcts), starts[jcts].tolist(), stops[jcts].tolist()), sums.tolist()))
+        return junctionDict
+
+    def __len__(self):
+        return sum(len(table[0]) for table in self.tables.itervalues())
+
+    @property
+    def nbytes(self):
+        """Memory used by the arrays of the index"""
+        return sum(array.nbytes for table in self.tables.itervalues() for array in table)
+
+
+def load(sam_path):
+    """
+    Return the JunctionIndex of a SAM/BAM file or None if there is no index
+    built from the current file.
+    """
+    stat = os.stat(sam_path)
+    for path in (index_path(sam_path), cache_index_path(sam_path)):
+        if not os.path.exists(path): continue
+        try:
+            with open(path, 'rb') as handle:
+                header = pickle.load(handle)
+                if header.get('version') != INDEX_VERSION or \
+                   header['size'] != stat.st_size or header['mtime'] != stat.st_mtime:
+                    logging.debug('Junction index %s is out of date' % path)
+                    continue
+                return JunctionIndex(pickle.load(handle))
+        except (EOFError, IOError, pickle.UnpicklingError, AttributeError, ImportError, KeyError):
+            logging.debug('Could not read junction index %s' % path)
+    return None
+
+
+def save(sam_path, tables):
+    """
+    Write the junction tables next to the SAM/BAM file or, if that fails, to
+    the cache directory. Like gtf_cache.save a temporary file is renamed so
+    an interrupted run never leaves a half written index behind.
+    """
+    for path in (index_path(sam_path), cache_index_path(sam_path)):
+        tmp_path = path + '.tmp'
+        try:
+            directory = os.path.dirname(path)
+            if directory and not os.path.isdir(directory): os.mkdir(directory)
+            with open(tmp_path, 'wb') as handle:
+                pickle.dump(make_header(sam_path), handle, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(tables, handle, pickle.HIGHEST_PROTOCOL)
+            if os.path.exists(path): os.remove(path)  # windows does not overwrite on rename
+            os.rename(tmp_path, path)
+            logging.debug('Wrote junction index %s' % path)
+            return path
+        except (IOError, OSError, pickle.PicklingError):
+            logging.debug('Could not write junction index %s' % path)
+            if os.path.exists(tmp_path): os.remove(tmp_path)
+    return None
+
+
+def build(sam_path, workers=1):
+    """
+    Count the junctions of a SAM/BAM file and save them as an index. The
+    file is counted by workers processes if workers is more than one.
+    """
+    logging.debug('Indexing junctions of %s . . .' % sam_path)
+    begin_time = time.time()
+    if workers > 1:
+        weights = count_junctions_parallel(sam_path, workers)
+    else:
+        weights = count_junctions(sam_path)
+    tables = make_tables(weights)
+    save(sam_path, tables)
+    junctions = JunctionIndex(tables)
+    logging.debug('Indexed %d junctions of %s in %.2f seconds' % (len(junctions), sam_path, time.time() - begin_time))
+    return junctions
+
+
+def open_index(sam_path, workers=1):
+    """Load the junction index of a SAM/BAM file, building it if needed."""
+    junctions = load(sam_path)
+    if junctions is None:
+        junctions = build(sam_path, workers)
+    return junctions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Build the junction index of a SAM/BAM file used by PrimerSeq when [backend] sam = index.')
+    parser.add_argument('-s', '--sam', required=True, action='store', dest='sam', help='SAM or BAM file (does not need to be sorted)')
+    parser.add_argument('-w', '--workers', default=1, type=int, action='store', dest='workers', help='number of processes counting parts of the SAM/BAM file (Default=1)')
+    options = vars(parser.parse_args())
+
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
+    build(options['sam'], options['workers'])
@@ -20,11 +20,9 @@ import itertools as it
 
 
 def debug_graph(G):
-    """Simply prints/logs info about a networkx graph"""
+    """Simply prints/logs info about an ExonGraph"""
     logging.debug("*" * 20)
-    logging.debug(G)
-    logging.debug(G[u][v])
-    utils.print_graph(G)
+    logging.debug(G.edge_weights())
     logging.debug("*" * 20)
 
 
@@ -49,7 +47,7 @@ def construct_read_count_vector(graph, index_to_edge):
     for i in xrange(num_jcts):
         u, v = index_to_edge[i]
         try:
-            counts_vector[i] = graph[u][v]['weight']
+            counts_vector[i] = graph.weight(u, v)
         except KeyError:
             debug_graph(graph)
             raise
@@ -25,13 +25,17 @@ import subprocess
 import os
 import glob
 import gtf
+import gtf_cache
+import compact_annotation
+import annotation_index
 import splice_graph
 import csv
 import argparse  # command line parsing
-import itertools as it
+import multiprocessing
 from pygr.seqdb import SequenceFileDB
 from pygr.sequence import Sequence
 import sam
+import java_daemon
 import utils
 import shutil
 import ConfigParser
@@ -50,7 +54,45 @@ my_config.read('PrimerSeq.cfg')
 config_options = dict(my_config.items('directory'))
 
 
-def gene_annotation_reader(file_path, FILTER_FACTOR=2):
+def read_gtf_parallel(file_path, workers):
+    """
+    Read a GTF that is grouped by seqname (e.g. sorted by gtf.sort_gtf) with
+    one task per seqname run by a pool of worker processes (see
+    :func:`~compact_annotation.read_gtf_chromosome`). The byte range
+    of each seqname is found without reading the whole GTF (see
+    gtf.chromosome_offsets). Returns None if the GTF turns out not to be
+    grouped by seqname.
+    """
+    ranges = gtf.chromosome_offsets(file_path)
+    if len(set(r[0] for r in ranges)) != len(ranges):
+        logging.debug('%s is not grouped by seqname so it can not be read in parallel' % file_path)
+        return None
+    ranges.sort(key=lambda r: r[2] - r[1], reverse=True)  # largest first for better load balance
+    logging.debug('Reading %d seqname(s) of %s with %d worker(s)' % (len(ranges), file_path, workers))
+
+    gene_dict = compact_annotation.CompactAnnotation()
+    if not ranges:
+        return gene_dict
+    pool = multiprocessing.Pool(min(workers, len(ranges)))
+    try:
+        for chrom in pool.imap_unordered(compact_annotation.read_gtf_chromosome, [(file_path,) + r for r in ranges]):
+            if chrom is not None:
+                gene_dict.add_chromosome(chrom)
+        pool.close()
+    except gtf.GtfSortError:
+        pool.terminate()
+        t, v, trace = sys.exc_info()
+        logging.debug('Could not read GTF in parallel (%s)' % str(v))
+        return None
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    return gene_dict
+
+
+def gene_annotation_reader(file_path, FILTER_FACTOR=2, use_cache=True, workers=None):
     """
     *creates two data structures from gtf:*
 
@@ -61,45 +103,41 @@ def gene_annotation_reader(file_path, FILTER_FACTOR=2):
             * gene_dict['chr']['My_favorite_gene']['start'] = start of gene
             * gene_dict['chr']['My_favorite_gene']['end'] = end of gene
             * gene_dict['chr']['My_favorite_gene']['exons'] = the set of exons (nodes)
+
+    gene_dict is a :class:`~compact_annotation.CompactAnnotation` so the
+    exons are stored in per chromosome arrays and the dictionary of a gene is
+    only built when it is asked for. It also holds an interval index of gene
+    spans for each (chr, strand).
+
+    If use_cache is True then a previously built gene_dict is loaded from the
+    gtf_cache directory when the GTF and FILTER_FACTOR have not changed.
+
+    The GTF does not need to be sorted. Sorted GTFs are read in one streaming
+    pass while unsorted GTFs have their exons sorted in memory. If workers is
+    more than one and the GTF is grouped by seqname then each seqname is read
+    by a separate process. workers defaults to the [workers] gtf option in
+    PrimerSeq.cfg.
     """
     # logging.debug('Started reading %s' % file_path)
-
-    # check if GTF file is sorted before reading data
-    logging.debug('Checking if GTF file is sorted  . . .')
-    if not gtf.is_gtf_sorted(file_path):
-        logging.debug('GTF file is not sorted.')
-        return None
-    logging.debug('GTF is sorted.')
-
-    # iterate through each gtf feature
-    file_input = open(file_path)
-    gene_dict = {}
-    for tx_id, tx in it.groupby(gtf.gtf_reader(file_input, delim='\t'), lambda x: x.attribute['transcript_id']):
-        tx = list(tx)
-        if len(tx) == 0: continue  # no 'exon' feature case
-
-        gene_id = tx[0].attribute['gene_id']
-        strand = tx[0].strand
-
-        # sort exons
-        tx_path = sorted([(exon.start, exon.end) for exon in tx],
-                         key=lambda x: (x[0], x[1]))  # needs to be sorted because gtf files might not have them in proper order
-
-        # add info to gene_dict
-        gene_dict.setdefault(tx[0].seqname, {})
-        gene_dict[tx[0].seqname].setdefault(gene_id, {})  # add the gene key if it doesn't exist
-        gene_dict[tx[0].seqname][gene_id].setdefault('chr', tx[0].seqname)  # add chr if doesn't exist
-        gene_dict[tx[0].seqname][gene_id].setdefault('strand', strand)  # add strand if doesn't exist
-        gene_dict[tx[0].seqname][gene_id].setdefault('graph', []).append(tx_path)  # append the tx path
-        gene_dict[tx[0].seqname][gene_id].setdefault('start', float('inf'))
-        gene_dict[tx[0].seqname][gene_id]['start'] = min(gene_dict[tx[0].seqname][gene_id]['start'], tx_path[0][0])  # change start if this tx has lower start position
-        gene_dict[tx[0].seqname][gene_id].setdefault('end', 0)
-        gene_dict[tx[0].seqname][gene_id]['end'] = max(gene_dict[tx[0].seqname][gene_id]['end'], tx_path[-1][1])
-        gene_dict[tx[0].seqname][gene_id].setdefault('exons', set())
-        for ex in tx_path:
-            gene_dict[tx[0].seqname][gene_id]['exons'].add(ex)  # hold a set of non-redundant exons
-    file_input.close()  # close gtf file
-    # logging.debug('Finished reading %s' % file_path)
+    if use_cache:
+        gene_dict = gtf_cache.load(file_path, FILTER_FACTOR)
+        if gene_dict is not None:
+            return gene_dict
+    begin_time = time.time()
+    if workers is None:
+        workers = int(my_config.get('workers', 'gtf')) if my_config.has_option('workers', 'gtf') else 1
+
+    gene_dict = read_gtf_parallel(file_path, workers) if workers > 1 else None
+    if gene_dict is None:
+        with open(file_path) as file_input:
+            def read_lines():
+                file_input.seek(0)
+                return file_input
+            gene_dict = compact_annotation.read_gtf_lines(read_lines)
+    gene_dict.build_index()  # pack exons into arrays and index gene spans
+    logging.debug('Finished reading %s in %.2f seconds' % (file_path, time.time() - begin_time))
+    if use_cache:
+        gtf_cache.save(file_path, FILTER_FACTOR, gene_dict)
     return gene_dict
 
 
@@ -356,6 +394,9 @@ def main(options):
                 primer3_options.append(line)
     logging.debug('Finished reading primer3 config file.')
 
+    # only write the intermediate SAM/.jct files of each region if asked to
+    sam.KEEP_TMP_FILES = options['keep_temp']
+
     # the primer3 function runs the primer3_core executable
     try:
         primer3(options, primer3_options)
@@ -366,6 +407,11 @@ def main(options):
         logging.debug('Value: ' + str(v))
         logging.debug('Traceback:\n' + traceback.format_exc())
         raise
+    finally:
+        java_daemon.shutdown_all()  # stop extraction daemons (see java_daemon.py)
+        sam.shutdown_extract_pool()  # stop the threads of sam.extract_regions
+        logging.debug('Junction cache: %(hits)d hits, %(disk_hits)d disk hits, %(misses)d misses, '
+                      '%(evictions)d evictions, %(regions)d regions held' % sam.Sam.cache.stats())
 
     # delete temporary sam files (may eventually delete more tmp files)
     logging.debug('Deleting tmp files')
@@ -457,6 +503,11 @@ if __name__ == '__main__':
     parser.add_argument('--keep-temp', dest='keep_temp', action='store_true', help='Keep temporary files in your tmp directory')
     parser.add_argument('-m', '--min-jct-count', dest='min_jct_count', action='store', type=int, default=1, help='Assign junctions that are known from annotation at least MIN_JCT_COUNT number of reads')
     parser.add_argument('-a', '--anchor-length', dest='anchor_length', action='store', type=int, default=8, help='Set the minimum number of bases a junction read must span on both sides of the junction')
+    parser.add_argument('--indexed-gtf', dest='indexed_gtf', action='store_true', help='Read genes from a block compressed, indexed copy of the GTF (built next to the GTF if needed) instead of loading the whole GTF')
+    parser.add_argument('--no-gtf-cache', dest='no_gtf_cache', action='store_true', help='Do not load or save a cached copy of the parsed GTF')
+    parser.add_argument('--lazy-gtf', dest='lazy_gtf', action='store_true', help='Only read the chromosomes of the GTF that targets are on, the first time each one is needed')
+    parser.add_argument('--evict-gtf', dest='evict_gtf', action='store_true', help='With --lazy-gtf, release each chromosome of the GTF after its last target')
+    parser.add_argument('-w', '--workers', dest='workers', action='store', type=int, default=None, help='Number of processes used to read a GTF grouped by chromosome (Default: [workers] gtf in PrimerSeq.cfg)')
     parser.add_argument('-o', required=True, dest='output', action='store', help='Output directory')
     options = vars(parser.parse_args())  # make it a dictionary
 
@@ -474,18 +525,30 @@ if __name__ == '__main__':
                         filemode='w')
 
     ### Start loading the user's files ###
-    # gtf file must be pre-loaded since there is no random access
-    if options['gtf']:
-        print 'Loading GTF . . .'
-        print 'May take ~1 min.'
-        options['gtf'] = gene_annotation_reader(options['gtf'])
+    # gtf file must be pre-loaded unless using the indexed gtf for random access
+    # or reading chromosomes lazily
+    if options['gtf'] and options['indexed_gtf']:
+        print 'Opening indexed GTF . . .'
+        options['gtf'] = annotation_index.open_annotation(options['gtf'],
+                                                          memory=int(my_config.get('memory', 'sort')),
+                                                          workers=int(my_config.get('workers', 'sort')),
+                                                          tmp_dir=config_options['tmp'])
+    elif options['gtf']:
+        gtf_path = options['gtf']
+        if options['lazy_gtf']:
+            print 'Scanning GTF . . .'
+            options['gtf'] = compact_annotation.open_lazy_annotation(gtf_path, evict=options['evict_gtf'])
+        if not options['lazy_gtf'] or options['gtf'] is None:
+            print 'Loading GTF . . .'
+            print 'May take ~1 min.'
+            options['gtf'] = gene_annotation_reader(gtf_path, use_cache=not options['no_gtf_cache'], workers=options['workers'])
 
     print 'Loading fasta . . .'
     options['fasta'] = SequenceFileDB(options['fasta'])  # get fasta object using pygr right away
 
     # the sam object interfaces with the user specified BAM/SAM file!!!
     print 'Loading Bam Files . . .'
-    options['rnaseq'] = [sam.Sam(data, options['anchor_length']) for data in options['rnaseq'].split(',')]
+    options['rnaseq'] = sam.open_sams(options['rnaseq'].split(','), options['anchor_length'])
     print 'Done loading all files.'
     ### END loading files ###
 
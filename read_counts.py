@@ -2,6 +2,7 @@ import splice_graph as sg
 from exon_seek import ExonSeek
 import algorithms as algs
 import utils
+import sam
 import logging
 
 
@@ -17,9 +18,15 @@ def save_isforms_and_counts(line, options):
     gene_dict, gene_name = retrieve_gene_information(options,
                                                      strand, chr, tmp_start, tmp_end)
 
-    # get edge weights
-    edge_weights_list = [sam_obj.extractSamRegion(chr, gene_dict['start'], gene_dict['end'])
-                         for sam_obj in options['rnaseq']]
+    # get edge weights around the event (see splice_graph.annotation_region)
+    if line[utils.PSI_UP] == '-1' and line[utils.PSI_DOWN] == '-1':
+        up_exon, down_exon = utils.get_pos(line[utils.UPSTREAM_EXON]), utils.get_pos(line[utils.DOWNSTREAM_EXON])
+    else:
+        up_exon, down_exon = None, None
+    region = sg.annotation_region(gene_dict, chr, strand, up_exon, down_exon)
+    edge_weights_list = sam.extract_regions(options['rnaseq'], *region)
+    edge_weights_list = sg.complete_edge_weights(options['rnaseq'], edge_weights_list, region, gene_dict,
+                                                 chr, strand, options, up_exon, down_exon, output_type='list')
 
     # construct splice graph for each BAM file
     bam_splice_graphs = sg.construct_splice_graph(edge_weights_list,
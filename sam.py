@@ -17,11 +17,34 @@
 '''
 File: sam.py
 Author: Collin Tokheim
-Description: Python wrapper around ExtractSamRegion.jar and Convert2SortedBam.jar
+Description: Python wrapper around ExtractSamRegion.jar and
+Convert2SortedBam.jar. Junctions in a region are read directly from the
+sorted BAM by bam.py unless PrimerSeq.cfg sets [backend] sam = java (one
+ExtractSamRegion.jar call per region), daemon (a long running
+ExtractDaemon.jar, see java_daemon.py) or index (junction counts of the
+whole file, see junction_index.py). The same region of several SAM/BAM
+files can be extracted concurrently with extract_regions. Extracted regions
+are kept in a junction cache shared by all Sam objects (see jct_cache.py).
+SAM/BAM files are converted to sorted BAM files concurrently by open_sams,
+and a sorted BAM is only reused if the .src file written next to it matches
+its source, or if it has no .src file and is at least as new as its source
+(see is_converted). Every backend counts the junctions of a region by min
+anchor (see jct_counts.py) so the anchor length is only applied when the
+counts are read and changing it does not extract again.
 '''
 
 import subprocess
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+import cPickle as pickle
+from collections import OrderedDict
 import jct_counts
+import bam
+import java_daemon
+import junction_index
+import jct_cache
+import gtf_cache
 import os
 import ConfigParser
 
@@ -30,6 +53,7 @@ import logging
 import traceback
 import sys
 import time
+import numpy as np
 
 # define directories
 cfg = ConfigParser.ConfigParser()
@@ -41,6 +65,19 @@ JCT_DIR = cfg_options['tmp'] + '/jct/'  # directory for .jct files
 cfg_options = dict(cfg.items('memory'))
 SAM_MEM = cfg_options['sam']
 BAM_MEM = cfg_options['bam']
+# python reads regions with bam.py, java calls ExtractSamRegion.jar,
+# daemon asks a long running ExtractDaemon.jar and index looks up junctions
+# counted once for the whole file (no sorted BAM needed)
+SAM_BACKEND = cfg.get('backend', 'sam') if cfg.has_option('backend', 'sam') else 'python'
+JCT_WORKERS = int(cfg.get('workers', 'jct')) if cfg.has_option('workers', 'jct') else 1  # processes building a junction index
+EXTRACT_WORKERS = int(cfg.get('workers', 'extract')) if cfg.has_option('workers', 'extract') else 1  # threads used by extract_regions
+CONVERT_WORKERS = int(cfg.get('workers', 'convert')) if cfg.has_option('workers', 'convert') else 0  # 0 sizes open_sams by cores and memory
+JCT_CACHE_MEM = int(cfg.get('memory', 'jct_cache')) if cfg.has_option('memory', 'jct_cache') else 64  # MB of cached junction tables
+JCT_CACHE_DISK = cfg.getboolean('cache', 'jct_disk') if cfg.has_option('cache', 'jct_disk') else False  # also cache regions on disk
+KEEP_TMP_FILES = False  # write tmp SAM/.jct files for debugging (primer.main sets it from --keep-temp)
+SOURCE_VERSION = 1  # bump whenever the .src header changes
+extract_pool = None  # ThreadPool of extract_regions, created on first use
+extract_pool_lock = threading.Lock()
 
 
 class Sam(object):
@@ -49,22 +86,37 @@ class Sam(object):
     to sorted bam and allows for region extraction.
 
     NOTE: This class is a wrapper arround Convert2SortedBam.jar and ExtractSamRegion.jar
-    thus it requires the JRE.
+    thus it requires the JRE. Regions are read with bam.BamReader instead of
+    ExtractSamRegion.jar when SAM_BACKEND is 'python' and the sorted BAM is
+    indexed.
+
+    Junction counts of a region are cached by (path, mtime, chr, start, end)
+    in Sam.cache as a junction_index.JunctionIndex, so repeated extractions
+    of a gene, also with another anchor length, are lookups. Sam.cache.stats()
+    reports hits and misses.
     """
+    cache = jct_cache.JunctionCache(JCT_CACHE_MEM * 2 ** 20, JCT_CACHE_DISK)
+
     def __init__(self, sam_path, anchor_length=8):
+        self.reader = None  # bam.BamReader opened on first use
+        self.junctions = None  # junction_index.JunctionIndex when SAM_BACKEND is 'index'
         # complain about not ending with .sam/.bam
         if not sam_path.endswith('.sam') and not sam_path.endswith('.bam'):
             raise ValueError('RNA-Seq input should be in SAM or BAM format')
 
         self.anchor_length = int(anchor_length)  # jct read anchor length (read tophat man for details)
 
+        # junctions are counted from the file as is
+        if SAM_BACKEND == 'index':
+            self.path = sam_path[:-4] + '.sorted.bam' if is_converted(sam_path, sam_path[:-4] + '.sorted.bam') else sam_path
+            self.junctions = junction_index.open_index(self.path, JCT_WORKERS)
         # skip if named .sorted.bam
-        if sam_path.endswith('.sorted.bam'):
+        elif sam_path.endswith('.sorted.bam'):
             self.path = sam_path
-        # skip if created .sorted.bam before
-        elif os.path.exists(sam_path[:-4] + '.sorted.bam'):
+        # skip if created .sorted.bam before from the same file
+        elif is_converted(sam_path, sam_path[:-4] + '.sorted.bam'):
             self.path = sam_path[:-4] + '.sorted.bam'
-        # call Convert2SortedBam.jar if no .sorted.bam
+        # call Convert2SortedBam.jar if no (valid) .sorted.bam
         else:
             self.path = self.convert2SortedBam(sam_path)
 
@@ -77,8 +129,11 @@ class Sam(object):
             logging.debug('Converting %s to a sorted BAM file . . .' % myPath)
             beginTime = time.time()
             sorted_bam_path = myPath[:-4] + '.sorted.bam'
+            # a stale .src must not vouch for a half written BAM
+            if os.path.exists(source_path(sorted_bam_path)): os.remove(source_path(sorted_bam_path))
             cmd = 'java -jar -Xmx%sm "%sConvert2SortedBam.jar" "%s" "%s"' % (BAM_MEM, BIN_DIR, myPath, sorted_bam_path)
             subprocess.check_call(cmd, shell=True)
+            write_source(myPath, sorted_bam_path)
             endTime = time.time()
             runTime = endTime - beginTime
             logging.debug('Finished converting %s to %s in %.2d:%.2d:%.2d' % (
@@ -96,58 +151,177 @@ class Sam(object):
         '''
         Set the Anchor Length for jct reads. Anchor length is the
         minimum number of nucleotides that a jct read should be on both
-        sides of a jct.
+        sides of a jct. Junctions are counted by min anchor (see
+        extractSamRegion) so nothing has to be extracted again.
         '''
         self.anchor_length = int(anchor)
 
-    def __jct_to_dict(self, file_name, jct_dict={}):
-        """Reads jct counts created from jctCounts.py"""
-        jct_dict = {}
-        with open(file_name, 'r') as handle:
-            for line in handle:
-                lineSplit = line.split('\t')
-                chr, start, stop, count = lineSplit  # rename line columns something meaningful
-                start, stop, count = int(start), int(stop), int(count)  # convert to int
-
-                # add counts to jct_dict
-                jct_dict[(chr, start, stop)] = count  # this simplifies the key comparted to a multi-level dict
+    def extractSamRegion(self, chr, start, end):
+        """
+        Retrieve jct counts from a specified region in the BAM file (self.path).
+        The junctions of all reads are counted by min anchor and kept in the
+        junction cache. Only reads with at least self.anchor_length are
+        counted in the returned dict.
+        """
+        if self.junctions is not None:
+            logging.debug('Looking up jcts for %s:%d-%d' % (chr, start + 1, end))
+            return self.junctions.query(chr, start, end, self.anchor_length)
+        key = jct_cache.region_key(self.path, chr, start, end)
+        region = self.cache.get(key)
+        if region is not None:
+            logging.debug('Using cached jcts for %s:%d-%d' % (chr, start + 1, end))
+        else:
+            region = junction_index.JunctionIndex(junction_index.make_tables(self.__extract_region(chr, start, end)))
+            self.cache.put(key, region)
+        return region.counts(self.anchor_length)
 
-        return jct_dict
+    def extract_batch(self, regions):
+        """
+        Junction tables (junction_index.JunctionIndex) of many (chr, start,
+        end) regions, like extractSamRegion, returned as a dict keyed by
+        region. Regions already in the junction cache are looked up. The
+        others are sorted and overlapping regions merged (see merge_regions)
+        so the BAM file is read once, front to back, and the junction reads
+        of a merged region are handed to every region they overlap. The new
+        tables are added to the junction cache.
+        """
+        tables = {}
+        if self.junctions is not None:
+            for region in regions:
+                tables[region] = self.junctions.region(*region)
+            return tables
+        pending = []
+        for region in sorted(set(regions)):
+            table = self.cache.get(jct_cache.region_key(self.path, *region))
+            if table is None:
+                pending.append(region)
+            else:
+                tables[region] = table
+        if not pending: return tables
+        backend = self.__backend()
+        if backend == 'daemon':
+            # the daemon answers a list of regions at once and only reports
+            # pos/cigar of a read, so regions are not merged
+            clusters = [region + ([region],) for region in pending]
+        else:
+            clusters = merge_regions(pending)
+        if backend == 'reader':
+            # visit chromosomes in the order of the BAM file
+            clusters.sort(key=lambda cluster: self.reader.tids.get(cluster[0], len(self.reader.tids)))
+        logging.debug('Extracting %d regions of %s as %d merged regions' % (len(pending), self.path, len(clusters)))
+        for (chr, start, end, members), reads in zip(clusters, self.__batch_reads(backend, clusters)):
+            spans = {}
+            for pos, read_end, incs, skips in reads:
+                # the read span takes the place of chr in the keys
+                jct_counts.add_junctions(spans, (pos, read_end), pos, incs, skips, None)
+            for region, table in region_tables(chr, spans, members):
+                self.cache.put(jct_cache.region_key(self.path, *region), table)
+                tables[region] = table
+        return tables
 
-    def __get_sam_jct(self, samFile):
+    def __batch_reads(self, backend, clusters):
         """
-        Read in SAM junctions
+        Yield the junction reads of each (chr, start, end, members) cluster
+        in turn, as (0-based pos, end, M lengths, N lengths).
         """
-        logging.debug('Reading junctions from %s' % samFile)
-        jctOutputFile = JCT_DIR + samFile.split('/')[-1][:-4] + '.jct'  # use .jct file for jct count files
-        if os.path.exists(jctOutputFile): os.remove(jctOutputFile)
+        if backend == 'daemon':
+            # all clusters are sent to the daemon as a single batch
+            daemon = java_daemon.get_daemon(self.path, SAM_MEM)
+            try:
+                answers = daemon.query([(chr, start + 1, end, 1) for chr, start, end, members in clusters])
+            except java_daemon.DaemonError:
+                logging.debug('%s. Extracting with ExtractSamRegion.jar instead' % sys.exc_info()[1])
+                for chr, start, end, members in clusters:
+                    yield self.__jar_reads(chr, start + 1, end)
+                return
+            for lines in answers:
+                reads = []
+                for line in lines:
+                    if line.startswith('#scanned\t'): continue
+                    rname, pos, cigar = line.split('\t')
+                    blocks = jct_counts.cigar_blocks(cigar)
+                    if blocks: reads.append(read_span(int(pos) - 1, blocks))
+                yield reads
+        elif backend == 'reader':
+            for chr, start, end, members in clusters:
+                yield (read_span(pos, bam.junction_blocks(cigar)) for pos, cigar in self.reader.fetch(chr, start, end, anchor=1))
+        else:
+            for chr, start, end, members in clusters:
+                yield self.__jar_reads(chr, start + 1, end)
 
-        # specify options for jct_counts.py main function
-        options = {}
-        options['sam'] = samFile
-        options['output'] = jctOutputFile
-        options['anchor'] = self.anchor_length
+    def __backend(self):
+        """Name of the backend used to extract regions of a sorted BAM file"""
+        if SAM_BACKEND == 'daemon' and java_daemon.is_available():
+            return 'daemon'
+        if SAM_BACKEND == 'python' and self.reader is None and bam.index_path(self.path):
+            self.reader = bam.BamReader(self.path)
+        # ExtractSamRegion.jar also creates the BAM index if it is missing
+        return 'jar' if self.reader is None else 'reader'
 
-        # get reads
-        jct_counts.main(options)  # note, it creates a file at jctOuputFile
-        jctDict = self.__jct_to_dict(jctOutputFile)  # creates a dictionary object for jcts
-        return jctDict
+    def __extract_region(self, chr, start, end):
+        """Count the jcts of a region by min anchor with the configured backend"""
+        backend = self.__backend()
+        if backend == 'daemon':
+            try:
+                return self.__extract_with_daemon(chr, start, end)
+            except java_daemon.DaemonError:
+                # only this region falls back, the daemon is tried again for the next one
+                logging.debug('%s. Extracting with ExtractSamRegion.jar instead' % sys.exc_info()[1])
+                backend = 'jar'
+        if backend == 'jar':
+            return self.__extract_with_jar(chr, start, end)
+        return self.__extract_with_reader(chr, start, end)
 
-    def extractSamRegion(self, chr, start, end):
+    def __extract_with_reader(self, chr, start, end):
+        """
+        Count junctions of the reads overlapping a region with bam.BamReader.
+        The counts are the same as __extract_with_jar but no JVM is started
+        and no intermediate SAM/jct files are written.
+        """
+        logging.debug('Extracting reads for %s:%d-%d' % (chr, start + 1, end))
+        junctionDict, stats = {}, {}
+        # only junction reads are decoded (see bam.junction_blocks)
+        for pos, cigar in self.reader.fetch(chr, start, end, anchor=1, stats=stats):
+            incs, skips = bam.junction_blocks(cigar)
+            jct_counts.add_junctions(junctionDict, chr, pos, incs, skips, None)
+        logging.debug('Finished reading jcts (kept %d of %d reads)' % (stats['kept'], stats['scanned']))
+        return junctionDict
+
+    def __extract_with_daemon(self, chr, start, end):
+        """
+        Count junctions of the reads overlapping a region as reported by the
+        ExtractDaemon.jar process kept open for this BAM.
         """
-        Retrieve jct counts from a specified region in the BAM file (self.path)
+        logging.debug('Extracting reads for %s:%d-%d' % (chr, start + 1, end))
+        daemon = java_daemon.get_daemon(self.path, SAM_MEM)
+        junctionDict, scanned, kept = {}, 0, 0
+        # the daemon only sends junction reads (anchor length 1)
+        for line in daemon.query([(chr, start + 1, end, 1)])[0]:
+            if line.startswith('#scanned\t'):
+                scanned = int(line.split('\t')[1])
+                continue
+            rname, pos, cigar = line.split('\t')
+            jct_counts.add_cigar_junctions(junctionDict, rname, int(pos) - 1, cigar, None)
+            kept += 1
+        logging.debug('Finished reading jcts (kept %d of %d reads)' % (kept, scanned))
+        return junctionDict
+
+    def __extract_with_jar(self, chr, start, end):
+        """
+        Retrieve jct counts from a region with ExtractSamRegion.jar. The reads
+        are streamed from the jar's stdout into jct_counts.count_sam_file so no
+        SAM or .jct files are written unless KEEP_TMP_FILES is set.
         """
         try:
             start += 1  # extraction is done in 1-based coordinates
             logging.debug('Extracting reads for %s:%d-%d' % (chr, start, end))
-            tmp_sam_path = '%s%s_%d_%d.sam' % (TMP_DIR, chr, start, end)  # path to tmp sam file with region specific reads
-            if os.path.exists(tmp_sam_path): os.remove(tmp_sam_path)
-            cmd = 'java -jar -Xmx%sm "%sExtractSamRegion.jar" "%s" "%s" %s %d %d' % (
-                SAM_MEM, BIN_DIR, self.path, tmp_sam_path, chr, start, end)
-            subprocess.check_call(cmd, shell=True)
-            logging.debug('Finished getting sam reads. Parsing jcts . . .')
-            junctionDict = self.__get_sam_jct(tmp_sam_path)
-            logging.debug('Finished reading jcts')
+            if KEEP_TMP_FILES:
+                return self.__extract_to_file(chr, start, end)
+            process, cmd = self.__open_jar_stream(chr, start, end)
+            junctionDict = {}
+            jct_counts.count_sam_file(process.stdout, None, junctionDict)
+            message = self.__close_jar_stream(process, cmd)
+            logging.debug('Finished reading jcts. ExtractSamRegion.jar: %s' % message)
             return junctionDict
         except subprocess.CalledProcessError:
             t, v, trace = sys.exc_info()  # exception information
@@ -156,3 +330,272 @@ class Sam(object):
             logging.debug('Value: ' + str(v))
             logging.debug('Traceback:\n' + traceback.format_exc())
             raise
+
+    def __open_jar_stream(self, chr, start, end):
+        """
+        Start ExtractSamRegion.jar writing the junction reads (anchor length
+        1) of a 1-based region to stdout. Returns the process and its command.
+        """
+        cmd = 'java -jar -Xmx%sm "%sExtractSamRegion.jar" "%s" - %s %d %d 1' % (
+            SAM_MEM, BIN_DIR, self.path, chr, start, end)
+        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        return process, cmd
+
+    def __close_jar_stream(self, process, cmd):
+        """Wait for a process of __open_jar_stream and return its message"""
+        message = process.stderr.read().strip()  # number of reads scanned/written
+        if process.wait():
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+        return message
+
+    def __jar_reads(self, chr, start, end):
+        """
+        Junction reads of a 1-based region extracted by ExtractSamRegion.jar,
+        as (0-based pos, end, M lengths, N lengths).
+        """
+        process, cmd = self.__open_jar_stream(chr, start, end)
+        lines = process.stdout.readlines()
+        self.__close_jar_stream(process, cmd)
+        reads = []
+        for line in lines:
+            if line.startswith('@') or not line.strip(): continue
+            fields = line.split('\t', 6)
+            blocks = jct_counts.cigar_blocks(fields[5])
+            if blocks: reads.append(read_span(int(fields[3]) - 1, blocks, int(fields[1]) & jct_counts.FLAG_UNMAPPED))
+        return reads
+
+    def __write_tmp_sam(self, chr, start, end):
+        """Extract the 1-based region with ExtractSamRegion.jar into a tmp SAM file and return its path"""
+        # path to tmp sam file with region specific reads (named after the BAM so
+        # that concurrent extractions of one region from several BAMs do not collide)
+        tmp_sam_path = '%s%s_%s_%d_%d.sam' % (TMP_DIR, os.path.basename(self.path)[:-4], chr, start, end)
+        if os.path.exists(tmp_sam_path): os.remove(tmp_sam_path)
+        cmd = 'java -jar -Xmx%sm "%sExtractSamRegion.jar" "%s" "%s" %s %d %d' % (
+            SAM_MEM, BIN_DIR, self.path, tmp_sam_path, chr, start, end)
+        subprocess.check_call(cmd, shell=True)
+        return tmp_sam_path
+
+    def __extract_to_file(self, chr, start, end):
+        """
+        Extract the 1-based region into a tmp SAM file and count its jcts by
+        min anchor. The SAM file (and a .jct file with the counts for
+        self.anchor_length) is only kept if KEEP_TMP_FILES is set.
+        """
+        tmp_sam_path = self.__write_tmp_sam(chr, start, end)
+        logging.debug('Finished getting sam reads. Parsing jcts . . .')
+        with open(tmp_sam_path, 'rb') as handle:
+            junctionDict = jct_counts.count_sam_file(handle, None)
+        if KEEP_TMP_FILES:
+            self.__write_jct(tmp_sam_path, junctionDict)
+        else:
+            os.remove(tmp_sam_path)
+        logging.debug('Finished reading jcts')
+        return junctionDict
+
+    def __write_jct(self, sam_path, junctionDict):
+        """
+        Write the jcts of a tmp SAM file counted by min anchor (junctionDict)
+        to its .jct file, keeping reads with at least self.anchor_length like
+        jct_counts.py would, without reading the SAM file again.
+        """
+        jctOutputFile = JCT_DIR + os.path.basename(sam_path)[:-4] + '.jct'  # use .jct file for jct count files
+        logging.debug('Writing junctions to %s' % jctOutputFile)
+        with open(jctOutputFile, 'wb') as handle:
+            jct_counts.write_counts(jct_counts.filter_anchor(junctionDict, self.anchor_length), handle)
+
+
+def source_path(sorted_bam_path):
+    """File describing the SAM/BAM file a sorted BAM was converted from."""
+    return sorted_bam_path + '.src'
+
+
+def write_source(sam_path, sorted_bam_path):
+    """
+    Record the size, mtime and md5 of sam_path next to the sorted BAM made
+    from it, like the header of a GTF cache (see gtf_cache.make_header).
+    """
+    stat = os.stat(sam_path)
+    header = {'version': SOURCE_VERSION,
+              'size': stat.st_size,
+              'mtime': stat.st_mtime,
+              'md5': gtf_cache.md5sum(sam_path)}
+    tmp_path = source_path(sorted_bam_path) + '.tmp'
+    with open(tmp_path, 'wb') as handle:
+        pickle.dump(header, handle, pickle.HIGHEST_PROTOCOL)
+    if os.path.exists(source_path(sorted_bam_path)): os.remove(source_path(sorted_bam_path))  # windows does not overwrite on rename
+    os.rename(tmp_path, source_path(sorted_bam_path))
+
+
+def is_converted(sam_path, sorted_bam_path):
+    """
+    Check that sorted_bam_path was converted from the current sam_path. A
+    matching size and mtime is trusted as is. If only the mtime changed
+    then the md5 decides (see gtf_cache.is_valid). A sorted BAM without a
+    .src file (e.g. converted before .src files were written) is trusted if
+    it is at least as new as sam_path, and its .src file is written now.
+    """
+    if not os.path.exists(sorted_bam_path):
+        return False
+    if not os.path.exists(source_path(sorted_bam_path)):
+        if os.path.getmtime(sorted_bam_path) < os.path.getmtime(sam_path):
+            return False
+        try:
+            write_source(sam_path, sorted_bam_path)
+        except (IOError, OSError):
+            logging.debug('Could not write %s' % source_path(sorted_bam_path))
+        return True
+    try:
+        with open(source_path(sorted_bam_path), 'rb') as handle:
+            header = pickle.load(handle)
+    except (EOFError, IOError, pickle.UnpicklingError, AttributeError, ImportError, KeyError):
+        return False
+    if header.get('version') != SOURCE_VERSION:
+        return False
+    stat = os.stat(sam_path)
+    if header['size'] != stat.st_size:
+        return False
+    if header['mtime'] == stat.st_mtime:
+        return True
+    return header['md5'] == gtf_cache.md5sum(sam_path)
+
+
+def physical_memory():
+    """Bytes of physical memory or None if it can not be found."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (AttributeError, ValueError, OSError):
+        return None  # e.g. windows
+
+
+def convert_workers(num_files):
+    """
+    Number of SAM/BAM files open_sams converts at once. Uses [workers]
+    convert in PrimerSeq.cfg if set, otherwise one per core as long as the
+    heaps of the Convert2SortedBam.jar processes ([memory] bam) fit in half
+    of the physical memory.
+    """
+    if CONVERT_WORKERS > 0:
+        workers = CONVERT_WORKERS
+    else:
+        workers = multiprocessing.cpu_count()
+        memory = physical_memory()
+        if memory: workers = min(workers, memory / 2 / (int(BAM_MEM) * 2 ** 20))
+    return max(1, min(workers, num_files))
+
+
+def open_sams(sam_paths, anchor_length, workers=None, progress=None):
+    """
+    Sam objects for sam_paths, returned in the same order. Files that need
+    to be converted to a sorted BAM are converted concurrently by a pool of
+    workers threads (default convert_workers), so loading many files takes
+    about as long as the slowest conversion. progress, if given, is called
+    with (number of files done, path) as each file finishes.
+    """
+    unique_paths = list(OrderedDict.fromkeys(sam_paths))  # a file listed twice is converted once
+    workers = convert_workers(len(unique_paths)) if workers is None else workers
+    logging.debug('Opening %d SAM/BAM files with %d worker(s)' % (len(unique_paths), workers))
+    sam_objs = {}
+
+    def open_sam(sam_path):
+        return sam_path, Sam(sam_path, anchor_length)
+
+    pool = ThreadPool(max(1, min(workers, len(unique_paths))))
+    try:
+        for sam_path, sam_obj in pool.imap_unordered(open_sam, unique_paths):
+            sam_objs[sam_path] = sam_obj
+            if progress: progress(len(sam_objs), sam_path)
+    finally:
+        pool.close()
+        pool.join()
+    # a file listed again gets its own (already converted) Sam object
+    return [sam_objs.pop(sam_path) if sam_path in sam_objs else Sam(sam_path, anchor_length) for sam_path in sam_paths]
+
+
+def merge_regions(regions):
+    """
+    Merge overlapping (chr, start, end) regions. Returns (chr, start, end,
+    members) clusters sorted by chr and start, where members are the regions
+    covered by the cluster.
+    """
+    clusters = []
+    for region in sorted(regions):
+        chr, start, end = region
+        if clusters and clusters[-1][0] == chr and start <= clusters[-1][2]:
+            clusters[-1][2] = max(clusters[-1][2], end)
+            clusters[-1][3].append(region)
+        else:
+            clusters.append([chr, start, end, [region]])
+    return [tuple(cluster) for cluster in clusters]
+
+
+def read_span(pos, blocks, unmapped=False):
+    """
+    (pos, end, M lengths, N lengths) of a junction read. Like the BAM index
+    queries, an unmapped read placed at pos only covers one base.
+    """
+    incs, skips = blocks
+    end = pos + 1 if unmapped else pos + sum(incs) + sum(skips)
+    return pos, end, incs, skips
+
+
+def region_tables(chr, spans, members):
+    """
+    Yield (region, junction_index.JunctionIndex) for each region in members
+    from the junctions of a merged region counted by read span, i.e. keyed
+    by ((read start, read end), start, stop, min anchor). A region gets the
+    junctions of the reads overlapping it, as if it was extracted alone.
+    """
+    rows = np.array([key[0] + key[1:] + (count,) for key, count in spans.iteritems()], dtype=np.int64).reshape(-1, 6)
+    for region in members:
+        overlap = (rows[:, 0] < region[2]) & (rows[:, 1] > region[1])
+        if not overlap.any():
+            yield region, junction_index.JunctionIndex({})
+            continue
+        table = junction_index.make_table(*rows[overlap, 2:].T)
+        yield region, junction_index.JunctionIndex({chr: table})
+
+
+def get_extract_pool(workers):
+    """Return the thread pool of extract_regions, creating it the first time."""
+    global extract_pool
+    with extract_pool_lock:
+        if extract_pool is None:
+            logging.debug('Starting %d thread(s) for region extraction' % workers)
+            extract_pool = ThreadPool(workers)
+        return extract_pool
+
+
+def shutdown_extract_pool():
+    """Stop the threads of extract_regions."""
+    global extract_pool
+    with extract_pool_lock:
+        if extract_pool is not None:
+            extract_pool.close()
+            extract_pool.join()
+            extract_pool = None
+
+
+def extract_regions(sam_obj_list, chr, start, end, workers=None):
+    """
+    Junction counts of the same region for each Sam object in sam_obj_list,
+    returned in the same order. If workers (default [workers] extract in
+    PrimerSeq.cfg) is more than one the extractions run concurrently in a
+    bounded pool of threads, which mostly wait on java processes or file
+    reads. The first error raised by an extraction is raised again here.
+    """
+    workers = EXTRACT_WORKERS if workers is None else workers
+    if workers <= 1 or len(sam_obj_list) <= 1:
+        return [sam_obj.extractSamRegion(chr, start, end) for sam_obj in sam_obj_list]
+    return get_extract_pool(workers).map(lambda sam_obj: sam_obj.extractSamRegion(chr, start, end), sam_obj_list)
+
+
+def extract_batches(sam_obj_list, regions, workers=None):
+    """
+    Junction tables of many regions for each Sam object in sam_obj_list (see
+    Sam.extract_batch), returned in the same order. Like extract_regions the
+    BAM files are read concurrently if workers is more than one.
+    """
+    workers = EXTRACT_WORKERS if workers is None else workers
+    if workers <= 1 or len(sam_obj_list) <= 1:
+        return [sam_obj.extract_batch(regions) for sam_obj in sam_obj_list]
+    return get_extract_pool(workers).map(lambda sam_obj: sam_obj.extract_batch(regions), sam_obj_list)
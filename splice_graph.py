@@ -42,9 +42,19 @@ If read counts are used (psi < 1) then splice_graph uses the
     with at least a user defined inclusion level. If psi == 1 then flanking
     exons are only determined by the biconnected componenets algorithm using
 :func:`~splice_graph.get_flanking_biconnected_exons`.
+
+Extraction Region
+-----------------
+
+Only the junctions of the exons around the target decide its primer design
+(see :func:`~splice_graph.target_exons`). Unless PrimerSeq.cfg sets
+[extract] region = gene, reads are first extracted around those exons in the
+annotation-only splice graph (:func:`~splice_graph.annotation_region`). With
+RNA-Seq junctions (--both) the region is widened until junctions outside of
+it can not change the result (:func:`~splice_graph.complete_edge_weights`).
 '''
 
-import networkx as nx
+from exon_graph import ExonGraph
 import itertools as it
 import argparse
 import algorithms as algs
@@ -56,10 +66,18 @@ from wig import Wig
 from exon_seek import ExonSeek
 import multinomial_em as mem
 import copy
+import sam
+import ConfigParser
 
 # logging imports
 import logging
 
+# read in configurations
+cfg = ConfigParser.ConfigParser()
+cfg.read('PrimerSeq.cfg')
+REGION_MODE = cfg.get('extract', 'region') if cfg.has_option('extract', 'region') else 'component'  # or 'gene'
+REGION_MARGIN = int(cfg.get('extract', 'margin')) if cfg.has_option('extract', 'margin') else 5000  # bp added for novel junctions
+
 
 class SpliceGraph(object):
     '''
@@ -74,6 +92,7 @@ class SpliceGraph(object):
         self.MIN_COUNT = min_count
         self.FILTER_FACTOR = filter_factor
         self.annotation = []  # set value using set_graph_as_annotation
+        self.sites = None  # splice site index used by add_all_possible_edge_weights
         if annotation is not None:
             self.set_graph_as_annotation(annotation)
         else:
@@ -85,7 +104,7 @@ class SpliceGraph(object):
 
     def set_graph_as_annotation(self, annotation):
         """
-        Create a nx DiGraph from list of tx in gene. FILTER_FACTOR defines a
+        Create an ExonGraph from list of tx in gene. FILTER_FACTOR defines a
         cutoff for using a tx of a gene. A tx must have x num of exon where x
         > MAX tx exon num / FILTER_FACTOR.
         """
@@ -95,10 +114,9 @@ class SpliceGraph(object):
                               filter(lambda x: len(x) > max_exons / self.FILTER_FACTOR, annotation))  # filter based on max num exons criteria
 
         # create graph
-        graph = nx.DiGraph()
-        for tx in self.annotation:
-            graph.add_path(tx)
-        self.graph = graph  # set graph attribute
+        exons = set(exon for tx in self.annotation for exon in tx)
+        edges = set((tx[i], tx[i + 1]) for tx in self.annotation for i in range(len(tx) - 1))
+        self.graph = ExonGraph(exons, edges)  # set graph attribute
 
     def set_annotation_edge_weights(self, weights):
         """
@@ -114,54 +132,74 @@ class SpliceGraph(object):
                 end = v[0]  # get_end_pos(exon_forms[v])
                 #tmpWeight = weights[self.chr][start][end]
                 tmpWeight = weights[(self.chr, start, end)]
-                self.graph[u][v]['weight'] = tmpWeight
             except KeyError:
-                self.graph[u][v]['weight'] = 1  # set dummy value
-            self.graph[u][v]['weight'] = max(self.graph[u][v]['weight'], self.MIN_COUNT)  # set read count to at least a user-defined value
+                tmpWeight = 1  # set dummy value
+            self.graph.set_weight(u, v, max(tmpWeight, self.MIN_COUNT))  # set read count to at least a user-defined value
 
     def set_graph_as_nodes_only(self, exons):
         """
-        Simple function that makes a DAG (nx.DiGraph) with only nodes and no
+        Simple function that makes a DAG (ExonGraph) with only nodes and no
         edges. Meant to be used to before add_all_possible_edge_weights.
         """
-        G = nx.DiGraph()
-        G.add_nodes_from(exons)
-        self.graph = G
+        self.graph = ExonGraph(exons)
 
-    def add_all_possible_edge_weights(self, weights):  # use to have exon_forms rather than chr
+    def splice_sites(self):
+        """
+        Index the exons of the graph by splice site. Returns a dict mapping
+        each exon end (donor) to the exons ending there and a dict mapping
+        each exon start (acceptor) to the exons starting there. Graphs of
+        the same annotation have the same exons, so they can share one index
+        (see construct_splice_graph).
+        """
+        donors, acceptors = {}, {}
+        for exon in self.graph.nodes():
+            donors.setdefault(exon[1], []).append(exon)
+            acceptors.setdefault(exon[0], []).append(exon)
+        return donors, acceptors
+
+    def add_all_possible_edge_weights(self, weights, sites=None):  # use to have exon_forms rather than chr
         """
         Add edge/weights to graph if supported by atleast READ_THRESHOLD
-        number of reads
+        number of reads. Instead of trying every pair of exons, each
+        junction is matched to the exons ending at its donor and starting at
+        its acceptor (see splice_sites), so the cost is O(exons + junctions).
+        The ExonGraph is rebuilt once with all novel edges.
         """
+        self.sites = sites if sites is not None else self.splice_sites()
+        donors, acceptors = self.sites
+
         # add novel edges if well supported
-        sorted_nodes = sorted(self.graph.nodes())
-        for i in range(len(sorted_nodes) - 1):
-            for j in range(i + 1, len(sorted_nodes)):
-                try:
-                    start = sorted_nodes[i][1]   # get_start_pos(exon_forms[sorted_nodes[i]])
-                    end = sorted_nodes[j][0]    # get_end_pos(exon_forms[sorted_nodes[j]])
-                    if weights[(self.chr, start, end)] >= self.READ_THRESHOLD:
-                        self.graph.add_edge(sorted_nodes[i], sorted_nodes[j])
-                        self.graph[sorted_nodes[i]][sorted_nodes[
-                            j]]['weight'] = weights[(self.chr, start, end)]
-                except KeyError:
-                    pass
+        novel_edges = {}
+        for (chr, start, end), count in weights.iteritems():
+            if chr != self.chr or count < self.READ_THRESHOLD: continue
+            for up_exon in donors.get(start, []):
+                for down_exon in acceptors.get(end, []):
+                    if up_exon < down_exon:
+                        novel_edges[(up_exon, down_exon)] = count
+        if novel_edges: self.graph = self.graph.add_edges(novel_edges)
 
 
 def get_from_gtf_using_gene_name(gtf, strand, chr, start, end):
     '''
-    This function finds the first gene in the gtf that completely contains the
-    target interval. I should really think about checking for multiple genes
-    instead of just returning the first one found.
+    This function finds the genes in the gtf that have the target interval as
+    an annotated exon. Genes are looked up in the exon index of the
+    :class:`~gene_index.GeneAnnotation` so the cost does not depend on the
+    number of genes on the chromosome. If several genes match, the gene
+    with the left most start is used and the other genes are logged. Returns
+    the gene dictionary and the name (gene_id) of that gene. The returned
+    gene dictionary is a copy with the target set, so the annotation itself
+    is never changed.
     '''
-    for gene_key in gtf[chr]:
-        if gtf[chr][gene_key]['strand'] == strand and gtf[chr][gene_key]['start'] <= start and gtf[chr][gene_key]['end'] >= end:
-            for ex in gtf[chr][gene_key]['exons']:
-                # if start >= ex[0] and end <= ex[1]:
-                if start == ex[0] and end == ex[1]:
-                    gtf[chr][gene_key]['target'] = ex  # this line needed for compatability reasons
-                    return gtf[chr][gene_key], gene_key
-    raise utils.PrimerSeqError("Error: Did not find an appropriate gtf annotation")
+    matching_genes = gtf.exon_genes(chr, strand, start, end)
+    if not matching_genes:
+        raise utils.PrimerSeqError("Error: Did not find an appropriate gtf annotation")
+    if len(matching_genes) > 1:
+        logging.debug('Target %s%s:%d-%d is an exon in multiple genes (%s). Using %s.' %
+                      (strand, chr, start, end, ', '.join(matching_genes), matching_genes[0]))
+    gene_key = matching_genes[0]
+    gene_dict = dict(gtf[chr][gene_key])  # the target is kept out of the annotation
+    gene_dict['target'] = (start, end)  # this line needed for compatability reasons
+    return gene_dict, gene_key
 
 
 def get_weakly_connected_tx(gtf, strand, chr, start, end, plus_or_minus=1000000):
@@ -169,32 +207,48 @@ def get_weakly_connected_tx(gtf, strand, chr, start, end, plus_or_minus=1000000)
     This function is meant to handle tx annotations without gene ids.
     Currently this is a function outside of the SpliceGraph class but it may
     be beneficial to later include this as a method.
+
+    Transcripts can only be weakly connected if they overlap, so instead of
+    taking every gene within plus_or_minus of the target the search starts
+    with the genes overlapping the target and grows the region by the genes
+    overlapping it until no new genes are found. plus_or_minus is still the
+    largest region that will be searched.
     '''
-    # compile all tx paths that are reasonably close
+    # compile all tx paths that overlap the target through a chain of genes
+    min_start, max_end = end - plus_or_minus, start + plus_or_minus  # same window as the gene scan it replaced
+    region_start, region_end = start, end
+    gene_keys = set()
+    while True:
+        new_keys = set(gtf.overlapping_genes(chr, strand, region_start, region_end)) - gene_keys
+        if not new_keys: break
+        gene_keys |= new_keys
+        region_start = max(min_start, min([region_start] + [gtf[chr][k]['start'] for k in new_keys]))
+        region_end = min(max_end, max([region_end] + [gtf[chr][k]['end'] for k in new_keys]))
     tmp_tx = []
-    for gene_key in gtf[chr]:
-        if gtf[chr][gene_key]['strand'] == strand and gtf[chr][gene_key]['start'] <= (start + plus_or_minus) and gtf[chr][gene_key]['end'] >= (end - plus_or_minus):
-            tmp_tx += gtf[chr][gene_key]['graph']
+    for gene_key in sorted(gene_keys, key=lambda k: (gtf[chr][k]['start'], gtf[chr][k]['end'], k)):
+        tmp_tx += gtf[chr][gene_key]['graph']
+    if not tmp_tx: raise utils.PrimerSeqError('Error: No annotations were even near your target')
 
     # get the weakly connected subgraph that contains the target exon
     sg = SpliceGraph(tmp_tx, chr, strand, filter_factor=1000)
     G = sg.get_graph()
-    weakly_con_subgraphs = nx.weakly_connected_component_subgraphs(G)
-    if not (len(weakly_con_subgraphs) > 0): raise utils.PrimerSeqError('Error: No annotations were even near your target')
-    target_graph = None
-    for weak_subgraph in weakly_con_subgraphs:
-        for node_start, node_end in weak_subgraph.nodes():
+    weakly_con_components = G.weakly_connected_components()
+    if not (len(weakly_con_components) > 0): raise utils.PrimerSeqError('Error: No annotations were even near your target')
+    target_component = None
+    for weak_component in weakly_con_components:
+        for node_start, node_end in weak_component:
             # if node_start <= start and node_end >= end:
             if node_start == start and node_end == end:
-                target_graph = weak_subgraph
+                target_component = weak_component
                 start, end = node_start, node_end
-    if target_graph is None: raise utils.PrimerSeqError('Error: Target was not contained in a tx')
+    if target_component is None: raise utils.PrimerSeqError('Error: Target was not contained in a tx')
 
     # filter tmp_tx to tx that contain atleast one node in subgraph
+    target_nodes = set(target_component)
     filtered_tmp_tx = []
     for tx in tmp_tx:
         for exon in tx:
-            if exon in target_graph.nodes():
+            if exon in target_nodes:
                 filtered_tmp_tx.append(tx)
                 break
     if not (len(filtered_tmp_tx) > 0): utils.PrimerSeqError('Error: Your target was not contained in a tx.')
@@ -222,7 +276,7 @@ def get_flanking_biconnected_exons(name, target, sGraph, genome):
     the graph structure. Theese exons are 100% included and do not
     need estimation of inclusion level.
     '''
-    graph = sGraph.get_graph()  # nx.DiGraph
+    graph = sGraph.get_graph()  # ExonGraph
     # search through each biconnected component
     for component in algs.get_biconnected(graph):
         component = sorted(component, key=lambda x: (x[0], x[1]))  # ensure first component is first exon, etc
@@ -368,10 +422,173 @@ def calculate_target_psi(target,
     return ';'.join(map(lambda x: '%.4f' % x, psi_list))  # only report to four decimal places
 
 
+def validate_target(gtf, line, no_gene_id=False):
+    """
+    Check a single target (and its flanking exons if given) against the exon
+    index of the gtf. Returns an error msg or None if the target is fine.
+    """
+    try:
+        tgt = line[0]
+        strand = tgt[0]
+        chr = get_chr(tgt[1:])
+        tgt_genes = set(gtf.exon_genes(chr, strand, *get_pos(tgt)))
+        flanking_genes = [set(gtf.exon_genes(chr, strand, *get_pos(ex))) for ex in line[1:3]]
+    except (ValueError, IndexError, TypeError):
+        return 'Error: %s is not a valid target' % str(line)
+
+    if not tgt_genes:
+        return 'Error: Target was not contained in a tx' if no_gene_id else 'Error: Did not find an appropriate gtf annotation'
+    elif len(line) == 3:
+        # without gene ids the flanking exons only need to be annotated
+        up_genes, down_genes = flanking_genes
+        if not (up_genes if no_gene_id else up_genes & tgt_genes):
+            return 'Error: upstream exon not in gtf annotation'
+        elif not (down_genes if no_gene_id else down_genes & tgt_genes):
+            return 'Error: downstream exon not in gtf annotation'
+    return None
+
+
+def validate_targets(gtf, targets, no_gene_id=False):
+    """
+    Check every target against the exon index of the gtf before any reads
+    are extracted. Returns a dictionary mapping the index of each bad target
+    to its error msg so those targets can be skipped right away.
+    """
+    errors = {}
+    for i, (name, line) in enumerate(targets):
+        msg = validate_target(gtf, line, no_gene_id)
+        if msg:
+            errors[i] = msg
+    logging.debug('%d of %d targets were not found in the annotation' % (len(errors), len(targets)))
+    return errors
+
+
+def last_target_by_chr(targets):
+    """Map each chromosome to the index of the last target on it."""
+    last_target = {}
+    for i, (name, line) in enumerate(targets):
+        try:
+            last_target[get_chr(line[0][1:])] = i
+        except (ValueError, IndexError, TypeError):
+            pass  # invalid targets are reported by validate_target
+    return last_target
+
+
+def target_blocks(graph, target):
+    """Biconnected components (see algs.get_biconnected) that hold the target."""
+    return set(frozenset(component) for component in algs.get_biconnected(graph) if target in component)
+
+
+def target_exons(graph, target, up_exon=None, down_exon=None):
+    """
+    Exons of the graph whose junctions decide the primer design of the
+    target. These are the exons of the biconnected components holding the
+    target and its neighbors (see ExonSeek). With user defined flanking exons
+    every exon between them is also used (see predefined_exons_case).
+    """
+    exons = set([target])
+    exons.update(graph.predecessors(target) + graph.successors(target))
+    for component in target_blocks(graph, target):
+        exons.update(component)
+    if up_exon and down_exon:
+        first_exon, last_exon = sorted([up_exon, down_exon])
+        exons.update(exon for exon in graph.nodes() if first_exon <= exon <= last_exon)
+    return exons
+
+
+def widen_region(region, exons, gene_dict, margin=None):
+    """
+    Extend a (chr, start, end) region to hold exons plus a margin on both
+    sides, without leaving the gene.
+    """
+    margin = REGION_MARGIN if margin is None else margin
+    chr, start, end = region
+    start = max(gene_dict['start'], min([start] + [exon[0] - margin for exon in exons]))
+    end = min(gene_dict['end'], max([end] + [exon[1] + margin for exon in exons]))
+    return chr, start, end
+
+
+def annotation_region(gene_dict, chr, strand, up_exon=None, down_exon=None):
+    """
+    Region of reads needed for the target of gene_dict. The first stage of
+    component scoped extraction uses the exons found by target_exons in the
+    annotation-only splice graph, plus REGION_MARGIN for novel junctions, so
+    reads are extracted for the event instead of the whole gene. The whole
+    gene is used if REGION_MODE is 'gene'.
+    """
+    gene_region = (chr, gene_dict['start'], gene_dict['end'])
+    if REGION_MODE == 'gene':
+        return gene_region
+    graph = SpliceGraph(annotation=gene_dict['graph'], chr=chr, strand=strand).get_graph()
+    if gene_dict['target'] not in graph:
+        return gene_region  # reported as an error when designing primers
+    target = gene_dict['target']
+    return widen_region((chr, target[0], target[1]), target_exons(graph, target, up_exon, down_exon), gene_dict)
+
+
+def missing_exons(graph, target, region, up_exon=None, down_exon=None):
+    """
+    Exons outside region that junctions not extracted with region could add
+    to target_exons, or None if none can. A junction is missed only if it
+    lies completely before or after region, i.e. between two exons starting
+    before region or two exons ending after it. Linking all such exons on
+    each side by a cycle joins them like any set of those junctions could.
+    If the biconnected components of the target do not change then, the
+    junctions outside region can not change the primer design.
+    """
+    chr, start, end = region
+    exons = target_exons(graph, target, up_exon, down_exon)
+    if any(exon[0] < start or exon[1] > end for exon in exons):
+        return exons
+    cycle_edges = []
+    for side in (sorted(exon for exon in graph if exon[0] < start), sorted(exon for exon in graph if exon[1] > end)):
+        if len(side) > 1: cycle_edges += zip(side, side[1:]) + [(side[0], side[-1])]
+    worst_graph = graph.add_edges([edge for edge in cycle_edges if not graph.has_edge(*edge)])
+    if target_blocks(worst_graph, target) != target_blocks(graph, target):
+        return target_exons(worst_graph, target, up_exon, down_exon)
+    return None
+
+
+def complete_edge_weights(sam_obj_list, edge_weights_list, region, gene_dict, chr, strand, options,
+                          up_exon=None, down_exon=None, output_types=('single', 'list')):
+    """
+    Second stage of component scoped extraction. RNA-Seq junctions (--both)
+    can connect the target to exons outside of the region extracted by
+    annotation_region, so the region is widened and extracted again until
+    missing_exons finds no such exon in any splice graph that
+    construct_splice_graph makes for output_types. main uses both the pooled
+    ('single') graph and the graph of each BAM file ('list', used by
+    calculate_target_psi), so both are checked by default. Returns the edge
+    weights of the final region.
+    """
+    if not options['both_flag'] or REGION_MODE == 'gene':
+        return edge_weights_list  # annotation junctions are all within region
+    sites = None  # splice site index shared by every splice graph of gene_dict
+    while True:
+        exons = set()
+        for output_type in output_types:
+            splice_graphs = construct_splice_graph(edge_weights_list, gene_dict, chr, strand,
+                                                   options['read_threshold'], options['min_jct_count'],
+                                                   output_type=output_type, both=True, sites=sites)
+            for splice_graph in (splice_graphs if output_type == 'list' else [splice_graphs]):
+                sites = splice_graph.sites
+                if gene_dict['target'] not in splice_graph.get_graph():
+                    return edge_weights_list  # reported as an error when designing primers
+                exons.update(missing_exons(splice_graph.get_graph(), gene_dict['target'], region, up_exon, down_exon) or [])
+        if not exons:
+            return edge_weights_list
+        region = widen_region(region, exons, gene_dict)
+        logging.debug('Novel junctions reach outside the extracted region, extracting %s:%d-%d' % (region[0], region[1] + 1, region[2]))
+        edge_weights_list = sam.extract_regions(sam_obj_list, *region)
+
+
 def construct_splice_graph(edge_weights_list, gene_dict, chr, strand, read_threshold, min_count,
-                           output_type='single', both=False):
+                           output_type='single', both=False, sites=None):
     """
-    Handles construction of SpliceGraph objects
+    Handles construction of SpliceGraph objects. With both=True the splice
+    site index (see SpliceGraph.splice_sites) is only built once for all
+    splice graphs of the annotation. Pass the sites attribute of an already
+    constructed splice graph of gene_dict to reuse its index.
     """
     if output_type == 'single':
         # case where counts are pooled from all BAM files
@@ -382,7 +599,7 @@ def construct_splice_graph(edge_weights_list, gene_dict, chr, strand, read_thres
                                    min_count=min_count)
         edge_weights = merge_list_of_dicts(edge_weights_list)  # merge all SAM/BAM read counts to a single dictionary
         splice_graph.set_annotation_edge_weights(edge_weights)  # set edge weights supported from annotation
-        if both: splice_graph.add_all_possible_edge_weights(edge_weights)  # also use junctions from RNA-Seq
+        if both: splice_graph.add_all_possible_edge_weights(edge_weights, sites)  # also use junctions from RNA-Seq
         return splice_graph
     elif output_type == 'list':
         # returns a list of splice graphs (one for each BAM file)
@@ -394,7 +611,9 @@ def construct_splice_graph(edge_weights_list, gene_dict, chr, strand, read_thres
                                  read_threshold=read_threshold,
                                  min_count=min_count)
             tmp_sg.set_annotation_edge_weights(eweight)
-            if both: tmp_sg.add_all_possible_edge_weights(eweight)
+            if both:
+                tmp_sg.add_all_possible_edge_weights(eweight, sites)
+                sites = tmp_sg.sites  # same exons in every BAM file's splice graph
             single_bam_splice_graphs.append(tmp_sg)
         return single_bam_splice_graphs
 
@@ -410,9 +629,29 @@ def main(options, args_output='tmp/debug.json'):
     # the sam object interfaces with the user specified BAM/SAM file!!!
     sam_obj_list = options['rnaseq']
 
-    # iterate through each target exon
-    output = []  # output from program
-    for line in args_target:  # was line in handle
+    # Check all targets against the annotation before extracting any reads.
+    # A lazily loaded gtf that evicts chromosomes is instead checked one
+    # target at a time so that each chromosome is only loaded once and can
+    # be released after its last target.
+    evict_gtf = getattr(args_gtf, 'evict', False)
+    if evict_gtf:
+        target_errors = {}
+        last_target = last_target_by_chr(args_target)
+    else:
+        target_errors = validate_targets(args_gtf, args_target, options['no_gene_id'])
+
+    # First find the gene of every target so that the junctions of all genes
+    # are extracted in one sorted pass over each BAM file (see
+    # sam.extract_batches) instead of one random access per target.
+    targets = {}  # target_ix -> (name, tgt, strand, chr, up_exon, down_exon, gene_dict, gene_name, region)
+    for target_ix, line in enumerate(args_target):  # was line in handle
+        if evict_gtf:
+            for chr in [c for c in last_target if last_target[c] < target_ix]:
+                args_gtf.release(chr)
+                del last_target[chr]
+            msg = validate_target(args_gtf, line[1], options['no_gene_id'])
+            if msg: target_errors[target_ix] = msg
+        if target_ix in target_errors: continue
         name, line = line  # bad style of reassignment
         tgt = line[0]
         strand = tgt[0]
@@ -426,9 +665,8 @@ def main(options, args_output='tmp/debug.json'):
             up_exon = None  # user did not provide upstream exon
             down_exon = None  # user did not provide downstream exon
 
-        # This try block is to catch assertions made about the graph. If a
-        # PrimerSeqError is raised it only impacts a single target for primer
-        # design so complete exiting of the program is not warranted.
+        # A PrimerSeqError only impacts a single target for primer design
+        # so complete exiting of the program is not warranted.
         try:
             # if the gtf doesn't have a valid gene_id attribute then use
             # the first method otherwise use the second method.
@@ -437,9 +675,45 @@ def main(options, args_output='tmp/debug.json'):
             else:
                 gene_dict, gene_name = get_from_gtf_using_gene_name(args_gtf, strand, chr, tmp_start, tmp_end)
 
-            # extract all edge weights only once
-            edge_weights_list = [sam_obj.extractSamRegion(chr, gene_dict['start'], gene_dict['end'])
-                                 for sam_obj in sam_obj_list]
+            # check user-defined flanking exons before extracting any reads
+            if up_exon and down_exon:
+                if gene_dict['target'] not in gene_dict['exons']:
+                    raise utils.PrimerSeqError('Error: target exon was not found in gtf annotation')
+                elif up_exon not in gene_dict['exons']:
+                    raise utils.PrimerSeqError('Error: upstream exon not in gtf annotation')
+                elif down_exon not in gene_dict['exons']:
+                    raise utils.PrimerSeqError('Error: downstream exon not in gtf annotation')
+
+            targets[target_ix] = (name, tgt, strand, chr, up_exon, down_exon, gene_dict, gene_name,
+                                  annotation_region(gene_dict, chr, strand, up_exon, down_exon))
+        except (utils.PrimerSeqError,):
+            t, v, trace = sys.exc_info()
+            target_errors[target_ix] = str(v)
+    if evict_gtf:
+        for chr in last_target:
+            args_gtf.release(chr)
+
+    # extract all edge weights only once
+    region_tables = sam.extract_batches(sam_obj_list, [t[-1] for t in targets.values()])
+
+    # iterate through each target exon
+    output = []  # output from program
+    for target_ix in range(len(args_target)):
+        if target_ix in target_errors:
+            logging.debug(target_errors[target_ix])
+            output.append([target_errors[target_ix]])
+            continue
+        name, tgt, strand, chr, up_exon, down_exon, gene_dict, gene_name, region = targets[target_ix]
+
+        # This try block is to catch assertions made about the graph. If a
+        # PrimerSeqError is raised it only impacts a single target for primer
+        # design so complete exiting of the program is not warranted.
+        try:
+            edge_weights_list = [tables[region].counts(sam_obj.anchor_length)
+                                 for sam_obj, tables in zip(sam_obj_list, region_tables)]
+            edge_weights_list = complete_edge_weights(sam_obj_list, edge_weights_list, region, gene_dict,
+                                                      chr, strand, options, up_exon, down_exon,
+                                                      output_types=('single', 'list'))
 
             # The following options['both_flag'] determines how the splice graph is constructed.
             # The splice graph can be either constructed from annotation junctions
@@ -463,17 +737,12 @@ def main(options, args_output='tmp/debug.json'):
                                                               options['read_threshold'],
                                                               options['min_jct_count'],
                                                               output_type='list',
-                                                              both=options['both_flag'])
+                                                              both=options['both_flag'],
+                                                              sites=splice_graph.sites)
 
             ### Logic for choosing methodology of primer design ###
             # user-defined flanking exon case
             if up_exon and down_exon:
-                if gene_dict['target'] not in gene_dict['exons']:
-                    raise utils.PrimerSeqError('Error: target exon was not found in gtf annotation')
-                elif up_exon not in gene_dict['exons']:
-                    raise utils.PrimerSeqError('Error: upstream exon not in gtf annotation')
-                elif down_exon not in gene_dict['exons']:
-                    raise utils.PrimerSeqError('Error: downstream exon not in gtf annotation')
                 tmp = predefined_exons_case(name,  # ID for exon (need to save as json)
                                             gene_dict['target'],  # target exon tuple (start, end)
                                             splice_graph,  # SpliceGraph object
@@ -516,7 +785,6 @@ def main(options, args_output='tmp/debug.json'):
         except (utils.PrimerSeqError,):
             t, v, trace = sys.exc_info()
             output.append([str(v)])  # just append assertion msg
-
     return output
 
 
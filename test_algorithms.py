@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_algorithms.py
+Author: Collin Tokheim
+Description: Checks that algorithms.AllPaths finds the same isoforms with
+novel junctions as the networkx code it replaced, on the splice graphs of
+every exon of example/example.gtf with the junctions of
+example/example.sorted.bam. Skipped if networkx is not installed.
+'''
+import unittest
+import algorithms as algs
+import junction_index
+from splice_graph import SpliceGraph
+from test_gene_index import read_gene_annotation
+
+try:
+    import networkx as nx
+except ImportError:
+    nx = None
+
+EXAMPLE_GTF = 'example/example.gtf'
+EXAMPLE_BAM = 'example/example.sorted.bam'
+
+
+def known_edges(tx_paths):
+    return set((tx[i], tx[i + 1]) for tx in tx_paths for i in range(len(tx) - 1))
+
+
+def has_novel_edge(tx, edges):
+    return any((tx[i], tx[i + 1]) not in edges for i in range(len(tx) - 1))
+
+
+def nx_novel_paths(graph, component, tx_paths):
+    """AllPaths.all_paths_with_novel_junctions as it was with networkx"""
+    sub_graph = nx.DiGraph(nx.subgraph(graph.to_networkx(), component))
+    src, sink = (float('-inf'), float('-inf')), (float('inf'), float('inf'))
+    for node in list(sub_graph.nodes()):
+        if not list(sub_graph.predecessors(node)): sub_graph.add_edge(src, node)
+        if not list(sub_graph.successors(node)): sub_graph.add_edge(node, sink)
+    edges = known_edges(tx_paths)
+    return [tx[1:-1] for tx in nx.all_simple_paths(sub_graph, src, sink) if has_novel_edge(tx[1:-1], edges)]
+
+
+def nx_novel_paths_old(graph, component, tx_paths):
+    """AllPaths.set_splice_graph_old as it was with networkx"""
+    sub_graph = nx.subgraph(graph.to_networkx(), component)
+    edges = known_edges(tx_paths)
+    return [tx for tx in nx.all_simple_paths(sub_graph, component[0], component[-1]) if has_novel_edge(tx, edges)]
+
+
+@unittest.skipIf(nx is None, 'networkx is not installed')
+class TestAllPaths(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.gene_dict = read_gene_annotation(EXAMPLE_GTF)
+        cls.junctions = junction_index.JunctionIndex(junction_index.make_tables(junction_index.count_junctions(EXAMPLE_BAM)))
+
+    def splice_graphs(self):
+        """Splice graph with novel junctions of each example gene"""
+        for chr in self.gene_dict:
+            for gene_key, gene in self.gene_dict[chr].items():
+                weights = self.junctions.query(chr, gene['start'], gene['end'], 8)
+                sg = SpliceGraph(gene['graph'], chr, gene['strand'])
+                sg.set_annotation_edge_weights(weights)
+                sg.add_all_possible_edge_weights(weights)
+                yield sg
+
+    def test_novel_paths(self):
+        num_novel = 0
+        for sg in self.splice_graphs():
+            graph, annotation = sg.get_graph(), [list(tx) for tx in sg.annotation]
+            for component in algs.get_biconnected(graph):
+                sg.annotation = [list(tx) for tx in annotation]  # AllPaths appends novel paths to it
+                all_paths = algs.AllPaths(sg, component, component[1])
+                novel = all_paths.tx_paths[len(annotation):]
+                self.assertEqual(sorted(novel), sorted(nx_novel_paths(graph, component, annotation)))
+                num_novel += len(novel)
+
+                sg.annotation = [list(tx) for tx in annotation]
+                all_paths.set_splice_graph_old(sg, component, component[1])
+                self.assertEqual(sorted(all_paths.tx_paths[len(annotation):]),
+                                 sorted(nx_novel_paths_old(graph, component, annotation)))
+        self.assertTrue(num_novel > 0)  # the example has novel junctions
+
+    def test_component_paths(self):
+        for sg in self.splice_graphs():
+            graph = sg.get_graph()
+            for component in graph.biconnected_components() + graph.weakly_connected_components():
+                sub_graph = graph.subgraph(component)
+                nx_graph = sub_graph.to_networkx()
+                self.assertEqual(sorted(sub_graph.iter_paths(component[0], component[-1])),
+                                 sorted(nx.all_simple_paths(nx_graph, component[0], component[-1])))
+            for component in algs.get_biconnected(graph):
+                sub_graph = graph.subgraph(component)
+                nx_graph = sub_graph.to_networkx()
+                for source in component:
+                    for sink in component:
+                        if source >= sink: continue
+                        self.assertEqual(sorted(sub_graph.iter_paths(source, sink)),
+                                         sorted(nx.all_simple_paths(nx_graph, source, sink)))
+
+
+if __name__ == '__main__':
+    unittest.main()
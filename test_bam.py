@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_bam.py
+Author: Collin Tokheim
+Description: Checks the indexed BamReader.fetch of bam.py against a scan of
+every alignment of example/example.sorted.bam, and that reading the BAM in
+ranges split at guessed record starts gives the same alignments as reading
+it whole.
+'''
+import unittest
+import bam
+
+EXAMPLE_BAM = 'example/example.sorted.bam'
+EXAMPLE_REGION = ('chr2', 216235000, 216300000)
+
+
+def reference_end(pos, cigar):
+    return pos + sum(length for op, length in cigar if op in bam.REFERENCE_OPS)
+
+
+class TestBamReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.alignments = list(bam.iter_alignments(EXAMPLE_BAM))
+
+    def setUp(self):
+        self.reader = bam.BamReader(EXAMPLE_BAM)
+
+    def tearDown(self):
+        self.reader.close()
+
+    def scan(self, chr, start, end, anchor=None):
+        return [(pos, cigar) for c, pos, cigar in self.alignments
+                if c == chr and pos < end and reference_end(pos, cigar) > start and
+                (anchor is None or bam.junction_blocks(cigar, anchor) is not None)]
+
+    def test_fetch(self):
+        positions = [pos for chr, pos, cigar in self.alignments]
+        regions = [EXAMPLE_REGION, ('chr2', 0, 1), ('chr2', 0, 2 ** 29), ('chrX', 0, 1000)]
+        for i in range(0, len(positions), 997):
+            # regions starting and ending right at alignment starts
+            regions.append(('chr2', positions[i], positions[i] + 1))
+            regions.append(('chr2', positions[i] - 5000, positions[min(i + 300, len(positions) - 1)]))
+        for chr, start, end in regions:
+            for anchor in (None, 1, 8):
+                self.assertEqual(list(self.reader.fetch(chr, start, end, anchor)), self.scan(chr, start, end, anchor))
+
+    def test_example_region_stats(self):
+        # same counts as the ExtractSamRegion jar on the example region
+        for anchor, kept in ((1, 631), (8, 468)):
+            stats = {}
+            self.assertEqual(len(list(self.reader.fetch(*EXAMPLE_REGION, anchor=anchor, stats=stats))), kept)
+            self.assertEqual(stats, {'scanned': 1611, 'kept': kept})
+
+    def test_split_ranges(self):
+        # tiny chunks so most ranges start in the middle of an alignment
+        for chunk_size in (2 ** 12, 2 ** 14):
+            alignments, offset = [], None
+            ranges = bam.block_ranges(EXAMPLE_BAM, chunk_size)
+            self.assertTrue(len(ranges) > 1)
+            for block_start, block_stop in ranges:
+                start = bam.guess_record_start(EXAMPLE_BAM, block_start)
+                stop = bam.guess_record_start(EXAMPLE_BAM, block_stop) if block_stop in dict(ranges) else None
+                if start is None: continue
+                if offset is not None:
+                    self.assertEqual(start, offset)  # the guess is where the previous range stopped
+                stats = {}
+                alignments.extend(bam.iter_alignments(EXAMPLE_BAM, start=start, stop=stop, stats=stats))
+                offset = stats['offset']
+            self.assertEqual(alignments, self.alignments)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_bgzf.py
+Author: Collin Tokheim
+Description: Checks that files written by bgzf.BgzfWriter read back the
+same with bgzf.BgzfReader and the gzip module, and that virtual offsets and
+find_block point at the right bytes and blocks.
+'''
+import gzip
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import bgzf
+
+
+class TestBgzf(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'test.bgz')
+        rand = random.Random(0)
+        # random pieces of text, some longer than a block
+        self.pieces = [''.join(rand.choice('ACGT\t\n') for i in range(rand.choice([1, 10, 1000, 70000])))
+                       for j in range(40)]
+        writer = bgzf.BgzfWriter(self.path)
+        self.offsets = []
+        for piece in self.pieces:
+            self.offsets.append(writer.tell())
+            writer.write(piece)
+        writer.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_gzip_compatible(self):
+        handle = gzip.open(self.path, 'rb')
+        try:
+            self.assertEqual(handle.read(), ''.join(self.pieces))
+        finally:
+            handle.close()
+
+    def test_virtual_offsets(self):
+        reader = bgzf.BgzfReader(self.path, cache_size=2)
+        try:
+            for offset, piece in reversed(zip(self.offsets, self.pieces)):
+                self.assertEqual(reader.read(offset, len(piece)), piece)
+            reader.seek(self.offsets[0])
+            for offset, piece in zip(self.offsets, self.pieces):
+                self.assertEqual(reader.tell(), offset)
+                self.assertEqual(reader.read_bytes(len(piece)), piece)
+            self.assertEqual(reader.read_bytes(10), '')  # end of file
+        finally:
+            reader.close()
+
+    def test_find_block(self):
+        size = os.path.getsize(self.path)
+        block_starts = sorted(set(offset >> 16 for offset in self.offsets))
+        for start in block_starts:
+            self.assertEqual(bgzf.find_block(self.path, start), start)
+            self.assertTrue(bgzf.find_block(self.path, start + 1) > start)
+        self.assertEqual(bgzf.find_block(self.path, size), size)
+        self.assertEqual(bgzf.find_block(self.path, size - 1), size)
+
+    def test_not_bgzf(self):
+        with open(self.path, 'wb') as handle:
+            handle.write('not a BGZF file')
+        self.assertRaises(bgzf.BgzfError, bgzf.BgzfReader, self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
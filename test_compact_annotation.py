@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_compact_annotation.py
+Author: Collin Tokheim
+Description: Checks that the array backed CompactAnnotation, the lazily
+read LazyAnnotation and the BGZF backed annotation_index.IndexedAnnotation
+give the same gene dictionaries and query answers as the dict based
+gene_index.GeneAnnotation.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import gtf
+import compact_annotation
+import annotation_index
+from test_gene_index import read_gene_annotation
+from test_gtf import write_random_gtf
+
+EXAMPLE_GTF = 'example/example.gtf'
+
+
+def read_compact_annotation(gtf_path):
+    """CompactAnnotation of a GTF read like primer.gene_annotation_reader"""
+    with open(gtf_path) as handle:
+        def read_lines():
+            handle.seek(0)
+            return handle
+        gene_dict = compact_annotation.read_gtf_lines(read_lines)
+    gene_dict.build_index()
+    return gene_dict
+
+
+def read_parallel_annotation(gtf_path):
+    """CompactAnnotation read one seqname at a time like primer.read_gtf_parallel"""
+    gene_dict = compact_annotation.CompactAnnotation()
+    for seqname, start, end in gtf.chromosome_offsets(gtf_path, min_step=64):
+        chrom = compact_annotation.read_gtf_chromosome((gtf_path, seqname, start, end))
+        if chrom is not None: gene_dict.add_chromosome(chrom)
+    gene_dict.build_index()
+    return gene_dict
+
+
+class AnnotationTests(object):
+    """
+    Compare the annotations made by make_annotations with a GeneAnnotation
+    of the same GTF. Mixed into the unittest.TestCase classes below.
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        sorted_path = os.path.join(self.tmp_dir, 'random.sorted.gtf')
+        gtf.sort_gtf(write_random_gtf(os.path.join(self.tmp_dir, 'random.gtf')), sorted_path, tmp_dir=self.tmp_dir)
+        self.gtf_paths = [EXAMPLE_GTF, os.path.join(self.tmp_dir, 'random.gtf'), sorted_path]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_annotation(self, expected, annotation):
+        self.assertEqual(sorted(annotation.keys()), sorted(expected.keys()))
+        for chr in expected:
+            self.check_chromosome(expected, annotation, chr)
+
+    def check_chromosome(self, expected, annotation, chr):
+        self.assertTrue(chr in annotation)
+        self.assertEqual(sorted(annotation[chr]), sorted(expected[chr]))
+        self.assertEqual(len(annotation[chr]), len(expected[chr]))
+        self.assertEqual(dict(annotation[chr].items()), expected[chr])
+        self.assertEqual(dict(annotation[chr].iteritems()), expected[chr])
+        self.assertEqual(sorted(annotation[chr].iterkeys()), sorted(expected[chr].keys()))
+        self.assertEqual(len(annotation[chr].values()), len(expected[chr]))
+        self.assertTrue(annotation[chr].get('no such gene') is None)
+        for gene_key, gene in expected[chr].items():
+            self.assertTrue(gene_key in annotation[chr])
+            self.assertEqual(annotation[chr][gene_key], gene)
+            for start, end in gene['exons']:
+                for query in ('exon_genes', 'containing_genes', 'overlapping_genes'):
+                    self.assertEqual(sorted(getattr(annotation, query)(chr, gene['strand'], start, end)),
+                                     sorted(getattr(expected, query)(chr, gene['strand'], start, end)))
+
+    def test_same_as_gene_annotation(self):
+        for gtf_path in self.gtf_paths:
+            expected = read_gene_annotation(gtf_path)
+            for annotation in self.make_annotations(gtf_path):
+                self.check_annotation(expected, annotation)
+
+    def test_read_only(self):
+        # changing a gene dictionary (e.g. setting the target like
+        # splice_graph.get_from_gtf_using_gene_name used to) never changes
+        # the annotation, whether or not the gene is still cached
+        expected = read_gene_annotation(self.gtf_paths[2])
+        for annotation in self.make_annotations(self.gtf_paths[2]):
+            for chr, gene_key in [(chr, gene_key) for chr in expected for gene_key in expected[chr]]:
+                gene = annotation[chr][gene_key]
+                gene['target'] = gene['graph'][0][0]
+                gene['graph'][0].append((0, 1))
+                gene['exons'].add((0, 1))
+                self.assertEqual(annotation[chr][gene_key], expected[chr][gene_key])
+            self.check_annotation(expected, annotation)
+
+
+class TestCompactAnnotation(AnnotationTests, unittest.TestCase):
+
+    def make_annotations(self, gtf_path):
+        annotations = [read_compact_annotation(gtf_path)]
+        lazy = compact_annotation.open_lazy_annotation(gtf_path)
+        if gtf.is_gtf_sorted(gtf_path):
+            # only sorted GTFs are read lazily or in parallel
+            self.assertTrue(lazy is not None)
+            annotations.extend([lazy, read_parallel_annotation(gtf_path)])
+        return annotations
+
+    def test_small_gene_cache(self):
+        # gene dictionaries dropped from the cache are built again from the arrays
+        gene_dict = read_compact_annotation(self.gtf_paths[1])
+        for chr in gene_dict:
+            gene_dict[chr].max_genes = 2
+        self.check_annotation(read_gene_annotation(self.gtf_paths[1]), gene_dict)
+
+    def test_lazy_release(self):
+        annotation = compact_annotation.open_lazy_annotation(self.gtf_paths[2], evict=True)
+        expected = read_gene_annotation(self.gtf_paths[2])
+        for chr in expected:
+            self.check_chromosome(expected, annotation, chr)
+            annotation.release(chr)
+            self.assertFalse(chr in annotation.loaded)
+            self.check_chromosome(expected, annotation, chr)  # read again after a release
+
+
+class TestIndexedAnnotation(AnnotationTests, unittest.TestCase):
+
+    def make_annotations(self, gtf_path):
+        bgz_path = os.path.join(self.tmp_dir, os.path.basename(gtf_path) + annotation_index.BGZF_EXT)
+        annotation_index.build_index(gtf_path, bgz_path, tmp_dir=self.tmp_dir)
+        self.assertTrue(annotation_index.is_index_valid(gtf_path, bgz_path))
+        return [annotation_index.IndexedAnnotation(bgz_path), annotation_index.IndexedAnnotation(bgz_path, max_genes=2)]
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_exon_graph.py
+Author: Collin Tokheim
+Description: Checks the components and paths of exon_graph.ExonGraph against
+networkx, which it replaced. The networkx tests are skipped if networkx is
+not installed.
+'''
+import itertools as it
+import random
+import unittest
+import exon_graph
+
+try:
+    import networkx as nx
+except ImportError:
+    nx = None
+
+
+def random_graphs(num, seed=0):
+    """ExonGraphs of synthetic genes, some with extra random forward edges and lone exons"""
+    rand = random.Random(seed)
+    graphs = []
+    for i in range(num):
+        num_exons = rand.randint(2, 12)
+        transcripts = exon_graph.synthetic_gene(num_exons, min(rand.randint(1, 20), 2 ** (num_exons - 2)), seed=i)
+        exons = sorted(set(exon for tx in transcripts for exon in tx))
+        edges = dict(((tx[j], tx[j + 1]), rand.randint(0, 9)) for tx in transcripts for j in range(len(tx) - 1))
+        if i % 3 == 0:
+            exons.append((10 ** 6, 10 ** 6 + 10))  # exon without edges
+            for j in range(rand.randint(1, 5)):
+                u, v = sorted(rand.sample(exons, 2))
+                edges[(u, v)] = rand.randint(0, 9)
+        if i % 5 == 0 and len(exons) > 3:
+            for (u, v) in rand.sample(sorted(edges), len(edges) // 3):
+                del edges[(u, v)]  # may split the gene into several components
+        graphs.append(exon_graph.ExonGraph(exons, edges))
+    return graphs
+
+
+def union_find_components(graph):
+    """Weakly connected components by union-find over the edges"""
+    parent = dict((exon, exon) for exon in graph)
+
+    def find(exon):
+        while parent[exon] != exon:
+            exon = parent[exon]
+        return exon
+    for u, v in graph.edges():
+        parent[find(u)] = find(v)
+    components = {}
+    for exon in graph:
+        components.setdefault(find(exon), []).append(exon)
+    return sorted(components.values())
+
+
+class ExonGraphEqual(object):
+    """Compare ExonGraphs by exons and weighted edges"""
+    def __init__(self, graph):
+        self.key = (graph.nodes(), sorted(graph.edge_weights().items()))
+
+    def __eq__(self, other):
+        return self.key == other.key
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(self.key)
+
+
+class TestExonGraph(unittest.TestCase):
+
+    def setUp(self):
+        self.graphs = random_graphs(60)
+
+    def test_neighbors(self):
+        for graph in self.graphs:
+            edges = graph.edge_weights()
+            for exon in graph:
+                self.assertEqual(graph.successors(exon), sorted(v for u, v in edges if u == exon))
+                # nearest first, so [0] is the closest exon on either side
+                self.assertEqual(graph.predecessors(exon), sorted((u for u, v in edges if v == exon), reverse=True))
+            for (u, v), weight in edges.items():
+                self.assertTrue(graph.has_edge(u, v))
+                self.assertEqual(graph.weight(u, v), weight)
+
+    def test_subgraph(self):
+        rand = random.Random(0)
+        for graph in self.graphs:
+            exons = rand.sample(graph.nodes(), len(graph) // 2)
+            sub_graph = graph.subgraph(exons)
+            self.assertEqual(sub_graph.nodes(), sorted(exons))
+            self.assertEqual(sub_graph.edge_weights(), dict((edge, weight) for edge, weight in graph.edge_weights().items()
+                                                            if edge[0] in exons and edge[1] in exons))
+            self.assertEqual(ExonGraphEqual(graph.copy()), ExonGraphEqual(graph))
+
+    def test_weakly_connected_components(self):
+        for graph in self.graphs:
+            self.assertEqual(sorted(graph.weakly_connected_components()), union_find_components(graph))
+
+    @unittest.skipIf(nx is None, 'networkx is not installed')
+    def test_components_networkx(self):
+        for graph in self.graphs:
+            nx_graph = graph.to_networkx()
+            self.assertEqual(sorted(graph.weakly_connected_components()),
+                             sorted(sorted(c) for c in nx.weakly_connected_components(nx_graph)))
+            self.assertEqual(sorted(graph.biconnected_components()),
+                             sorted(sorted(c) for c in nx.biconnected_components(nx_graph.to_undirected())))
+            self.assertEqual(ExonGraphEqual(exon_graph.ExonGraph.from_networkx(nx_graph)), ExonGraphEqual(graph))
+
+    @unittest.skipIf(nx is None, 'networkx is not installed')
+    def test_paths_networkx(self):
+        for graph in self.graphs:
+            nx_graph = graph.to_networkx()
+            sources = [exon for exon in graph if not graph.predecessors(exon)]
+            sinks = [exon for exon in graph if not graph.successors(exon)]
+            expected = [[exon] for exon in sources if exon in sinks]
+            for source, sink in it.product(sources, sinks):
+                if source != sink: expected.extend(nx.all_simple_paths(nx_graph, source, sink))
+            self.assertEqual(sorted(graph.iter_paths()), sorted(expected))
+
+
+if __name__ == '__main__':
+    unittest.main()
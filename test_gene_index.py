@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_gene_index.py
+Author: Collin Tokheim
+Description: Checks the interval tree of gene_index.py against a brute
+force scan of the intervals and the indexes of GeneAnnotation against a
+scan of the genes of example/example.gtf. Run from the PrimerSeq directory
+with python -m unittest discover -p "test_*.py".
+'''
+import itertools as it
+import random
+import unittest
+import gtf
+import gene_index
+
+EXAMPLE_GTF = 'example/example.gtf'
+
+
+def read_gene_annotation(gtf_path):
+    """GeneAnnotation of a GTF read the same way as before compact_annotation.py"""
+    gene_dict = gene_index.GeneAnnotation()
+    with open(gtf_path) as handle:
+        exons = sorted(gtf.exon_reader(handle), key=gtf.exon_sort_key)
+    for tx_id, tx in it.groupby(exons, lambda x: x.transcript_id):
+        gene_dict.add_transcript(list(tx))
+    return gene_dict
+
+
+def random_intervals(rand, num, max_pos=10000, max_length=500):
+    """num random [start, end) intervals with their position in the list as value"""
+    intervals = []
+    for i in range(num):
+        start = rand.randint(0, max_pos)
+        intervals.append((start, start + rand.randint(1, max_length), i))
+    return intervals
+
+
+class TestIntervalIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.rand = random.Random(0)
+
+    def check(self, intervals, queries):
+        index = gene_index.IntervalIndex(intervals)
+        ordered = sorted(intervals, key=lambda x: (x[0], x[1]))
+        for start, end in queries:
+            self.assertEqual(index.overlap(start, end),
+                             [value for s, e, value in ordered if s < end and start < e])
+            self.assertEqual(index.contain(start, end),
+                             [value for s, e, value in ordered if s <= start and e >= end])
+
+    def random_queries(self, num):
+        queries = []
+        for i in range(num):
+            start = self.rand.randint(-100, 10600)
+            queries.append((start, start + self.rand.randint(1, 1000)))
+        return queries
+
+    def test_brute_force(self):
+        # sizes around powers of two exercise the partial right subtrees
+        for num in [0, 1, 2, 3, 7, 8, 9, 15, 16, 17, 31, 100, 255, 256, 257, 1000]:
+            self.check(random_intervals(self.rand, num), self.random_queries(200))
+
+    def test_nested_intervals(self):
+        # long intervals hidden in the left subtree have to be found through max_ends
+        intervals = [(i, 10000 - i, i) for i in range(0, 5000, 7)] + random_intervals(self.rand, 300)
+        self.check(intervals, self.random_queries(200))
+
+    def test_boundaries(self):
+        index = gene_index.IntervalIndex([(10, 20, 'a')])
+        self.assertEqual(index.overlap(19, 30), ['a'])
+        self.assertEqual(index.overlap(20, 30), [])  # half-open
+        self.assertEqual(index.overlap(0, 11), ['a'])
+        self.assertEqual(index.overlap(0, 10), [])
+        self.assertEqual(index.contain(10, 20), ['a'])
+        self.assertEqual(index.contain(9, 20), [])
+
+
+class TestGeneAnnotation(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.gene_dict = read_gene_annotation(EXAMPLE_GTF)
+
+    def genes(self):
+        for chr in self.gene_dict:
+            for gene_key, gene in self.gene_dict[chr].items():
+                yield chr, gene_key, gene
+
+    def test_indexes_built_lazily(self):
+        gene_dict = read_gene_annotation(EXAMPLE_GTF)
+        self.assertTrue(gene_dict.gene_index is None and gene_dict.exon_index is None)
+        gene_dict.exon_genes('chr2', '+', 0, 1)
+        self.assertTrue(gene_dict.gene_index is not None)
+
+    def test_exon_genes(self):
+        for chr, gene_key, gene in self.genes():
+            for start, end in gene['exons']:
+                expected = [key for c, key, g in self.genes()
+                            if c == chr and g['strand'] == gene['strand'] and (start, end) in g['exons']]
+                self.assertEqual(sorted(self.gene_dict.exon_genes(chr, gene['strand'], start, end)), sorted(expected))
+
+    def test_containing_genes(self):
+        for chr, gene_key, gene in self.genes():
+            for start, end in gene['exons']:
+                expected = [key for c, key, g in self.genes()
+                            if c == chr and g['strand'] == gene['strand'] and g['start'] <= start and g['end'] >= end]
+                self.assertEqual(sorted(self.gene_dict.containing_genes(chr, gene['strand'], start, end)), sorted(expected))
+
+    def test_overlapping_genes(self):
+        # genes touching the query by a single base are found like the scan
+        # get_weakly_connected_tx used before the index
+        for chr, gene_key, gene in self.genes():
+            for start, end in [(gene['end'], gene['end'] + 100), (gene['start'] - 100, gene['start']),
+                               (gene['end'] + 1, gene['end'] + 100), (gene['start'] - 100, gene['start'] - 1)]:
+                expected = [key for c, key, g in self.genes()
+                            if c == chr and g['strand'] == gene['strand'] and g['start'] <= end and g['end'] >= start]
+                self.assertEqual(sorted(self.gene_dict.overlapping_genes(chr, gene['strand'], start, end)), sorted(expected))
+            self.assertTrue(gene_key in self.gene_dict.overlapping_genes(chr, gene['strand'], gene['end'], gene['end'] + 100))
+            self.assertTrue(gene_key in self.gene_dict.overlapping_genes(chr, gene['strand'], gene['start'] - 100, gene['start']))
+            self.assertFalse(gene_key in self.gene_dict.overlapping_genes(chr, gene['strand'], gene['end'] + 1, gene['end'] + 100))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_gtf.py
+Author: Collin Tokheim
+Description: Checks gtf.exon_reader against the Gtf class it replaced and
+the external merge sort of gtf.sort_gtf against sorting every exon line
+in memory. Random GTFs made by write_random_gtf are also used by the tests
+of compact_annotation.py.
+'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import gtf
+
+EXAMPLE_GTF = 'example/example.gtf'
+
+
+def write_random_gtf(path, seed=0, num_genes=60, chrs=('chr1', 'chr2', 'chrX'), shuffle=True):
+    """
+    Write a GTF of random genes with gene/transcript/CDS lines besides the
+    exons and a few attribute layouts. Lines are shuffled unless shuffle is
+    False, in which case they are grouped by seqname in gene order.
+    """
+    rand = random.Random(seed)
+    lines = ['#!genome-build made up\n']
+    for g in range(num_genes):
+        chr, strand = rand.choice(chrs), rand.choice('+-')
+        gene_start = rand.randint(1, 10 ** 6)
+        exons = []
+        pos = gene_start
+        for i in range(rand.randint(1, 8)):
+            exons.append((pos, pos + rand.randint(50, 300)))
+            pos = exons[-1][1] + rand.randint(100, 5000)
+        gene_id = 'G%03d' % g
+        lines.append('%s\tmade_up\tgene\t%d\t%d\t.\t%s\t.\tgene_id "%s";\n' % (chr, exons[0][0], exons[-1][1], strand, gene_id))
+        for t in range(rand.randint(1, 4)):
+            tx_id = '%s.T%d' % (gene_id, t)
+            tx = [exons[0]] + [exon for exon in exons[1:-1] if rand.random() < .6] + exons[1:][-1:]
+            if rand.random() < .2 and len(tx) > 1:
+                tx[-1] = (tx[-1][0], tx[-1][1] + 20)  # alternative end
+            if rand.random() < .5:
+                attribute = 'gene_id "%s"; transcript_id "%s"; gene_name "N%d";' % (gene_id, tx_id, g)
+            else:
+                attribute = 'transcript_id "%s";  gene_id "%s"' % (tx_id, gene_id)
+            for start, end in tx:
+                feature = 'exon' if rand.random() < .95 else 'EXON'
+                lines.append('%s\tmade_up\t%s\t%d\t%d\t.\t%s\t.\t%s\n' % (chr, feature, start, end, strand, attribute))
+                if rand.random() < .5:
+                    lines.append('%s\tmade_up\tCDS\t%d\t%d\t.\t%s\t0\t%s\n' % (chr, start + 10, end, strand, attribute))
+    if shuffle:
+        header, body = lines[:1], lines[1:]
+        rand.shuffle(body)
+        lines = header + body
+    else:
+        lines = lines[:1] + sorted(lines[1:], key=lambda line: chrs.index(line.split('\t', 1)[0]))
+    with open(path, 'wb') as handle:
+        handle.writelines(lines)
+    return path
+
+
+def exon_tuples(exons):
+    return [(e.seqname, e.start, e.end, e.strand, e.gene_id, e.transcript_id) for e in exons]
+
+
+class TestExonReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check(self, path):
+        with open(path) as handle:
+            old = [(g.seqname, g.start, g.end, g.strand, g.attribute['gene_id'], g.attribute['transcript_id'])
+                   for g in gtf.gtf_reader((line for line in handle if not line.startswith('#')), '\t')]
+        with open(path) as handle:
+            new = exon_tuples(gtf.exon_reader(handle))
+        self.assertTrue(len(new) > 0)
+        self.assertEqual(new, old)
+
+    def test_example_gtf(self):
+        self.check(EXAMPLE_GTF)
+
+    def test_random_gtf(self):
+        for seed in range(3):
+            self.check(write_random_gtf(os.path.join(self.tmp_dir, 'random%d.gtf' % seed), seed))
+
+    def test_sorted_exon_reader(self):
+        path = write_random_gtf(os.path.join(self.tmp_dir, 'random.gtf'))
+        with open(path) as handle:
+            self.assertRaises(gtf.GtfSortError, list, gtf.sorted_exon_reader(handle))
+        gtf.sort_gtf(path, path + '.sorted', tmp_dir=self.tmp_dir)
+        with open(path + '.sorted') as handle:
+            self.assertTrue(len(list(gtf.sorted_exon_reader(handle))) > 0)
+
+
+class TestSortGtf(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.max_merge_runs = gtf.MAX_MERGE_RUNS
+        self.path = write_random_gtf(os.path.join(self.tmp_dir, 'random.gtf'), num_genes=200)
+        with open(self.path) as handle:
+            lines = [line.rstrip('\n').split('\t') for line in handle if not line.startswith('#')]
+        exon_lines = [line for line in lines if line[gtf.FEATURE].lower() == 'exon']
+        self.expected = ['\t'.join(line) + '\n' for line in sorted(exon_lines, key=gtf.gtf_sort_key)]
+
+    def tearDown(self):
+        gtf.MAX_MERGE_RUNS = self.max_merge_runs
+        shutil.rmtree(self.tmp_dir)
+
+    def check_sort(self, memory, workers, chunk_factor=1):
+        output = os.path.join(self.tmp_dir, 'sorted.gtf')
+        old_factor = gtf.SORT_MEMORY_FACTOR
+        gtf.SORT_MEMORY_FACTOR = chunk_factor
+        try:
+            gtf.sort_gtf(self.path, output, memory=memory, workers=workers, tmp_dir=self.tmp_dir)
+        finally:
+            gtf.SORT_MEMORY_FACTOR = old_factor
+        with open(output) as handle:
+            self.assertEqual(handle.readlines(), self.expected)
+        self.assertTrue(gtf.is_gtf_sorted(output))
+        self.assertEqual(sorted(os.listdir(self.tmp_dir)), ['random.gtf', 'sorted.gtf'])  # runs are removed
+
+    def test_single_run(self):
+        self.check_sort(memory=1536, workers=1)
+
+    def test_many_runs(self):
+        # 1 MB / 2**16 gives 16 byte chunks, i.e. about one line per run
+        self.check_sort(memory=1, workers=1, chunk_factor=2 ** 16)
+
+    def test_merge_rounds(self):
+        gtf.MAX_MERGE_RUNS = 4
+        self.check_sort(memory=1, workers=1, chunk_factor=2 ** 14)
+
+    def test_workers(self):
+        self.check_sort(memory=1, workers=2, chunk_factor=2 ** 12)
+
+    def test_chromosome_offsets(self):
+        output = os.path.join(self.tmp_dir, 'sorted.gtf')
+        gtf.sort_gtf(self.path, output, tmp_dir=self.tmp_dir)
+        blocks = gtf.seqname_blocks(output)
+        ranges = gtf.chromosome_offsets(output, min_step=64)
+        self.assertEqual(sorted(ranges), sorted((chr, blocks[chr][0][0], blocks[chr][0][1]) for chr in blocks))
+        self.assertTrue(all(len(blocks[chr]) == 1 for chr in blocks))
+
+
+if __name__ == '__main__':
+    unittest.main()
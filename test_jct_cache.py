@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_jct_cache.py
+Author: Collin Tokheim
+Description: Checks the least recently used order, size limit and on disk
+tier of jct_cache.JunctionCache.
+'''
+import shutil
+import tempfile
+import unittest
+import jct_cache
+import junction_index
+
+
+def make_junctions(num):
+    """JunctionIndex of num junctions on chr1"""
+    return junction_index.JunctionIndex(junction_index.make_tables(
+        dict((('chr1', 100 * i, 100 * i + 50, 8), i + 1) for i in range(num))))
+
+
+class TestJunctionCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.cache_dir = jct_cache.JCT_CACHE_DIR
+        jct_cache.JCT_CACHE_DIR = self.tmp_dir
+        self.junctions = make_junctions(10)
+        self.size = jct_cache.region_size(self.junctions)
+
+    def tearDown(self):
+        jct_cache.JCT_CACHE_DIR = self.cache_dir
+        shutil.rmtree(self.tmp_dir)
+
+    def test_least_recently_used(self):
+        cache = jct_cache.JunctionCache(3 * self.size)
+        for key in 'abc':
+            cache.put(key, self.junctions)
+        self.assertTrue(cache.get('a') is self.junctions)  # now b is the least recently used
+        cache.put('d', self.junctions)
+        self.assertTrue(cache.get('b') is None)
+        for key in 'acd':
+            self.assertTrue(cache.get(key) is self.junctions)
+        self.assertEqual(cache.stats(), {'hits': 4, 'disk_hits': 0, 'misses': 1, 'evictions': 1,
+                                         'regions': 3, 'bytes': 3 * self.size})
+
+    def test_size_limit(self):
+        cache = jct_cache.JunctionCache(self.size + 1)
+        cache.put('big', make_junctions(1000))  # larger than the whole cache so never kept
+        self.assertTrue(cache.get('big') is None)
+        cache.put('a', self.junctions)
+        cache.put('a', self.junctions)  # replacing a region does not count it twice
+        self.assertEqual(cache.stats()['bytes'], self.size)
+        cache.put('b', self.junctions)
+        self.assertEqual((cache.get('a'), cache.stats()['regions']), (None, 1))
+        cache.clear()
+        self.assertEqual((cache.get('b'), cache.stats()['bytes']), (None, 0))
+
+    def test_disk_tier(self):
+        cache = jct_cache.JunctionCache(self.size, use_disk=True)
+        cache.put(('bam', 1.0, 'chr1', 0, 10), self.junctions)
+        cache.put(('bam', 1.0, 'chr1', 10, 20), make_junctions(3))  # evicts the first region from memory
+        junctions = cache.get(('bam', 1.0, 'chr1', 0, 10))
+        self.assertEqual(junctions.counts(1), self.junctions.counts(1))
+        self.assertEqual(cache.stats()['disk_hits'], 1)
+
+        # a new cache (i.e. a later run) reads the regions from disk
+        cache = jct_cache.JunctionCache(self.size, use_disk=True)
+        self.assertEqual(cache.get(('bam', 1.0, 'chr1', 10, 20)).counts(1), make_junctions(3).counts(1))
+        self.assertTrue(cache.get(('bam', 2.0, 'chr1', 10, 20)) is None)  # BAM changed
+        self.assertTrue(jct_cache.JunctionCache(self.size).get(('bam', 1.0, 'chr1', 10, 20)) is None)
+
+
+if __name__ == '__main__':
+    unittest.main()
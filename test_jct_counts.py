@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_jct_counts.py
+Author: Collin Tokheim
+Description: Checks the NumPy and python junction counters of jct_counts.py
+and their parallel versions against the regular expression based counter
+they replaced, on random SAM files.
+'''
+import csv
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+import jct_counts
+
+
+def old_count(sam_path, anchor):
+    """The junction counter of jct_counts.main before the NumPy version"""
+    inc_search, skip_search, error_search = re.compile('\d+(?=M)'), re.compile('\d+(?=N)'), re.compile('[^MN0-9]')
+    QNAME, FLAG, RNAME, POS, MAPQ, CIGAR = range(6)  # define some SAM columns
+    weights = {}
+    with open(sam_path) as file_input:
+        for line in csv.reader(file_input, delimiter='\t'):
+            if line[0][0] == '@': continue  # skip line if head character
+            if error_search.search(line[CIGAR]): continue  # other cigar characters found
+            skips = map(int, skip_search.findall(line[CIGAR]))
+            if not len(skips): continue  # skip if not junction
+            incs = map(int, inc_search.findall(line[CIGAR]))
+            valid_anchor_lengths = map(lambda x: x >= anchor, incs)
+            start_pos = int(line[POS]) - 1  # init to start pos of mapped read
+            for i in range(len(incs) - 1):
+                jct_start = start_pos + incs[i]
+                jct_stop = jct_start + skips[i]
+                if valid_anchor_lengths[i] and valid_anchor_lengths[i+1]:
+                    weights.setdefault((line[RNAME], jct_start, jct_stop), 0)
+                    weights[(line[RNAME], jct_start, jct_stop)] += 1
+                start_pos = jct_stop
+    return weights
+
+
+def random_cigar(rand):
+    kind = rand.random()
+    if kind < .3:
+        return '%dM' % rand.randint(1, 100)
+    elif kind < .7:
+        # single junction reads, including anchors shorter than 8 and long gaps
+        return '%dM%dN%dM' % (rand.choice([1, 3, 7, 8, 20, 75]), rand.choice([50, 1000, 123456789]), rand.randint(1, 99))
+    elif kind < .85:
+        ops = []
+        for i in range(rand.randint(2, 5)):
+            ops.append('%dM' % rand.randint(1, 40))
+            ops.append('%dN' % rand.randint(1, 20000))
+        return ''.join(ops[:-1])
+    elif kind < .95:
+        return rand.choice(['5S45M100N50M', '10M2I30M500N60M', '30M500N40M5S', '*', '50M100N', '100N50M'])
+    return '%dM%dN%dM' % (rand.randint(1, 100), rand.randint(1, 1000), rand.randint(1, 100))
+
+
+def write_random_sam(path, seed=0, num_reads=3000):
+    rand = random.Random(seed)
+    names = ['chr1', 'chr2', 'chrX', 'GL000192.1_random_name_longer_than_32_characters']
+    lines = ['@HD\tVN:1.0\tSO:unsorted\n'] + ['@SQ\tSN:%s\tLN:1000000000\n' % name for name in names]
+    for i in range(num_reads):
+        flag = rand.choice([0, 0, 0, 16, 256, 4, 20])
+        lines.append('read%d\t%d\t%s\t%d\t%d\t%s\t*\t0\t0\tACGT\tIIII\tNH:i:1\n' %
+                     (i, flag, rand.choice(names), rand.choice([1, rand.randint(1, 10 ** 6), 2 ** 31 - 10 ** 9]),
+                      rand.randint(0, 255), random_cigar(rand)))
+    with open(path, 'wb') as handle:
+        handle.writelines(lines)
+    return path
+
+
+class TestJctCounts(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.batch_size = jct_counts.BATCH_SIZE
+        self.sam_paths = [write_random_sam(os.path.join(self.tmp_dir, 'random%d.sam' % seed), seed)
+                          for seed in range(3)]
+
+    def tearDown(self):
+        jct_counts.BATCH_SIZE = self.batch_size
+        shutil.rmtree(self.tmp_dir)
+
+    def count(self, sam_path, anchor, use_numpy, skip_unmapped=False):
+        with open(sam_path, 'rb') as handle:
+            return jct_counts.count_sam_file(handle, anchor, use_numpy=use_numpy, skip_unmapped=skip_unmapped)
+
+    def test_same_as_old_counter(self):
+        for sam_path in self.sam_paths:
+            for anchor in (1, 8, 30):
+                expected = old_count(sam_path, anchor)
+                self.assertTrue(len(expected) > 0)
+                self.assertEqual(self.count(sam_path, anchor, True), expected)
+                self.assertEqual(self.count(sam_path, anchor, False), expected)
+                self.assertEqual(jct_counts.filter_anchor(self.count(sam_path, None, True), anchor), expected)
+                self.assertEqual(jct_counts.filter_anchor(self.count(sam_path, None, False), anchor), expected)
+
+    def test_small_batches(self):
+        # lines are split between batches
+        expected = old_count(self.sam_paths[0], 1)
+        for batch_size in (7, 100, 4096):
+            jct_counts.BATCH_SIZE = batch_size
+            self.assertEqual(self.count(self.sam_paths[0], 1, True), expected)
+
+    def test_skip_unmapped(self):
+        mapped_path = os.path.join(self.tmp_dir, 'mapped.sam')
+        with open(self.sam_paths[0]) as handle:
+            with open(mapped_path, 'wb') as mapped:
+                mapped.writelines(line for line in handle if line[0] == '@' or not int(line.split('\t')[1]) & 4)
+        expected = old_count(mapped_path, 8)
+        self.assertNotEqual(expected, old_count(self.sam_paths[0], 8))
+        self.assertEqual(self.count(self.sam_paths[0], 8, True, skip_unmapped=True), expected)
+        self.assertEqual(self.count(self.sam_paths[0], 8, False, skip_unmapped=True), expected)
+
+    def test_parallel(self):
+        expected = old_count(self.sam_paths[0], 8)
+        for workers in (1, 2):
+            for chunk_size in (1000, 12345, 10 ** 7):
+                for use_numpy in (True, False):
+                    self.assertEqual(jct_counts.count_sam_parallel(self.sam_paths[0], 8, workers, use_numpy=use_numpy,
+                                                                   chunk_size=chunk_size), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_junction_index.py
+Author: Collin Tokheim
+Description: Checks the junction counts of junction_index.JunctionIndex
+against a scan of the counted junctions and against the junctions that
+sam.Sam.extractSamRegion reads from example/example.sorted.bam.
+'''
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import jct_counts
+import junction_index
+import sam
+from test_jct_counts import write_random_sam
+
+EXAMPLE_BAM = 'example/example.sorted.bam'
+
+
+def scan_query(weights, chr, start, end, anchor):
+    """junction_index.JunctionIndex.query by a scan of (chr, start, stop, min anchor) counts"""
+    junctions = {}
+    for (c, jct_start, jct_stop, min_anchor), count in weights.iteritems():
+        if c == chr and min_anchor >= anchor and jct_stop >= start and jct_start <= end:
+            junctions[(c, jct_start, jct_stop)] = junctions.get((c, jct_start, jct_stop), 0) + count
+    return junctions
+
+
+class TestJunctionIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.weights = junction_index.count_junctions(EXAMPLE_BAM)
+        cls.junctions = junction_index.JunctionIndex(junction_index.make_tables(cls.weights))
+
+    def setUp(self):
+        self.rand = random.Random(0)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sam_backend = sam.SAM_BACKEND
+
+    def tearDown(self):
+        sam.SAM_BACKEND = self.sam_backend
+        shutil.rmtree(self.tmp_dir)
+
+    def regions(self, num):
+        # regions starting and ending right at junction ends
+        ends = sorted(set(pos for key in self.weights for pos in key[1:3]))
+        regions = [('chr2', 216235000, 216300000), ('chr2', 0, 1), ('chr2', 0, 2 ** 30), ('chrX', 0, 10 ** 6)]
+        for i in range(num):
+            start = self.rand.choice(ends) + self.rand.choice([-1, 0, 1])
+            regions.append(('chr2', start, start + self.rand.choice([0, 1, 100, 10000, 100000])))
+        return regions
+
+    def test_query(self):
+        self.assertTrue(len(self.weights) > 0)
+        for chr, start, end in self.regions(200):
+            for anchor in (1, 8, 20):
+                self.assertEqual(self.junctions.query(chr, start, end, anchor),
+                                 scan_query(self.weights, chr, start, end, anchor))
+                self.assertEqual(self.junctions.region(chr, start, end).counts(anchor),
+                                 scan_query(self.weights, chr, start, end, anchor))
+        self.assertEqual(self.junctions.counts(8), scan_query(self.weights, 'chr2', 0, 2 ** 30, 8))
+
+    def test_extract_sam_region(self):
+        # the reads overlapping a region may also have junctions outside of it
+        sam.SAM_BACKEND = 'python'
+        sam_obj = sam.Sam(EXAMPLE_BAM)
+        for chr, start, end in self.regions(30):
+            for anchor in (1, 8):
+                sam_obj.set_anchor_length(anchor)
+                extracted = sam_obj.extractSamRegion(chr, start, end)
+                expected = self.junctions.query(chr, start, end, anchor)
+                self.assertEqual(dict((key, count) for key, count in extracted.iteritems()
+                                      if key[2] >= start and key[1] <= end), expected)
+                self.assertTrue(set(expected) <= set(extracted))
+
+    def test_parallel_bam(self):
+        for chunk_size in (2 ** 12, 2 ** 15):
+            self.assertEqual(junction_index.count_junctions_parallel(EXAMPLE_BAM, 2, chunk_size), self.weights)
+
+    def test_sam(self):
+        sam_path = write_random_sam(os.path.join(self.tmp_dir, 'random.sam'))
+        with open(sam_path, 'rb') as handle:
+            expected = jct_counts.count_sam_file(handle, None, skip_unmapped=True)
+        self.assertEqual(junction_index.count_junctions(sam_path), expected)
+        self.assertEqual(junction_index.count_junctions_parallel(sam_path, 2, 10000), expected)
+
+    def test_save_load(self):
+        bam_path = os.path.join(self.tmp_dir, 'example.bam')
+        shutil.copy(EXAMPLE_BAM, bam_path)
+        self.assertTrue(junction_index.load(bam_path) is None)
+        self.assertEqual(junction_index.save(bam_path, junction_index.make_tables(self.weights)),
+                         junction_index.index_path(bam_path))
+        self.assertEqual(junction_index.load(bam_path).counts(1), self.junctions.counts(1))
+        with open(bam_path, 'ab') as handle:
+            handle.write('changed')
+        self.assertTrue(junction_index.load(bam_path) is None)  # out of date
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_sam.py
+Author: Collin Tokheim
+Description: Checks that sam.Sam falls back to ExtractSamRegion.jar when
+the extraction daemon fails, when a sorted BAM is reused by
+sam.is_converted and the .jct files written with KEEP_TMP_FILES. The jars
+are replaced by bam.BamReader or a random SAM file since the tests do not
+need a JRE.
+'''
+import os
+import shutil
+import tempfile
+import unittest
+import bam
+import jct_cache
+import jct_counts
+import java_daemon
+import sam
+from test_jct_counts import write_random_sam
+
+EXAMPLE_BAM = 'example/example.sorted.bam'
+EXAMPLE_REGION = ('chr2', 216235000, 216300000)
+
+
+class FailingDaemon(object):
+    """java_daemon.JavaDaemon that always gives up"""
+    def query(self, requests):
+        raise java_daemon.DaemonError('Extraction daemon for %s died 4 times' % EXAMPLE_BAM)
+
+
+def make_sam():
+    """Sam object of the example BAM with an empty junction cache of its own"""
+    sam_obj = sam.Sam(EXAMPLE_BAM)
+    sam_obj.cache = jct_cache.JunctionCache(2 ** 20)
+    return sam_obj
+
+
+class TestDaemonFallback(unittest.TestCase):
+
+    def setUp(self):
+        self.saved = sam.SAM_BACKEND, java_daemon.get_daemon, java_daemon.is_available
+        sam.SAM_BACKEND = 'python'
+        self.regions = [EXAMPLE_REGION, ('chr2', 216240000, 216250000), ('chr2', 216290000, 216310000)]
+        python_sam = make_sam()
+        self.expected = [python_sam.extractSamRegion(*region) for region in self.regions]
+        self.expected_tables = python_sam.extract_batch(self.regions)
+        self.reader = bam.BamReader(EXAMPLE_BAM)
+        sam.SAM_BACKEND = 'daemon'
+        java_daemon.is_available = lambda: True
+        java_daemon.get_daemon = lambda path, memory: FailingDaemon()
+
+    def tearDown(self):
+        sam.SAM_BACKEND, java_daemon.get_daemon, java_daemon.is_available = self.saved
+
+    def jar_sam(self):
+        """Sam object whose ExtractSamRegion.jar calls are read with self.reader"""
+        sam_obj = make_sam()
+        self.jar_calls = []
+
+        def extract_with_jar(chr, start, end):
+            self.jar_calls.append((chr, start, end))
+            junctionDict = {}
+            for pos, cigar in self.reader.fetch(chr, start, end, anchor=1):
+                incs, skips = bam.junction_blocks(cigar)
+                jct_counts.add_junctions(junctionDict, chr, pos, incs, skips, None)
+            return junctionDict
+
+        def jar_reads(chr, start, end):
+            self.jar_calls.append((chr, start - 1, end))
+            return [sam.read_span(pos, bam.junction_blocks(cigar))
+                    for pos, cigar in self.reader.fetch(chr, start - 1, end, anchor=1)]
+        sam_obj._Sam__extract_with_jar = extract_with_jar
+        sam_obj._Sam__jar_reads = jar_reads
+        return sam_obj
+
+    def test_extract_sam_region(self):
+        self.assertTrue(len(self.expected[0]) > 0)
+        sam_obj = self.jar_sam()
+        self.assertEqual([sam_obj.extractSamRegion(*region) for region in self.regions], self.expected)
+        self.assertEqual(self.jar_calls, self.regions)
+
+    def test_extract_batch(self):
+        sam_obj = self.jar_sam()
+        tables = sam_obj.extract_batch(self.regions)
+        self.assertEqual(sorted(tables), sorted(self.regions))
+        for region in self.regions:
+            self.assertEqual(tables[region].counts(8), self.expected_tables[region].counts(8))
+        self.assertEqual(sorted(self.jar_calls), sorted(self.regions))
+
+
+class TestIsConverted(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.sam_path = os.path.join(self.tmp_dir, 'reads.sam')
+        self.bam_path = os.path.join(self.tmp_dir, 'reads.sorted.bam')
+        for path in (self.sam_path, self.bam_path):
+            with open(path, 'wb') as handle:
+                handle.write('made up reads of %s\n' % path)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def set_mtimes(self, sam_mtime, bam_mtime):
+        os.utime(self.sam_path, (sam_mtime, sam_mtime))
+        os.utime(self.bam_path, (bam_mtime, bam_mtime))
+
+    def test_missing_source(self):
+        # a sorted BAM converted before .src files were written is reused
+        for bam_mtime in (1000000, 2000000):
+            if os.path.exists(sam.source_path(self.bam_path)): os.remove(sam.source_path(self.bam_path))
+            self.set_mtimes(1000000, bam_mtime)
+            self.assertTrue(sam.is_converted(self.sam_path, self.bam_path))
+            self.assertTrue(os.path.exists(sam.source_path(self.bam_path)))
+            self.assertTrue(sam.is_converted(self.sam_path, self.bam_path))
+
+    def test_older_bam(self):
+        self.set_mtimes(2000000, 1000000)
+        self.assertFalse(sam.is_converted(self.sam_path, self.bam_path))
+        self.assertFalse(os.path.exists(sam.source_path(self.bam_path)))
+
+    def test_changed_source(self):
+        self.set_mtimes(1000000, 2000000)
+        self.assertTrue(sam.is_converted(self.sam_path, self.bam_path))
+        with open(self.sam_path, 'ab') as handle:
+            handle.write('one more read\n')
+        self.set_mtimes(1500000, 2000000)  # the sorted BAM is still newer
+        self.assertFalse(sam.is_converted(self.sam_path, self.bam_path))
+        os.remove(self.bam_path)
+        self.assertFalse(sam.is_converted(self.sam_path, self.bam_path))
+
+
+class TestKeepTmpFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.saved = sam.KEEP_TMP_FILES, sam.JCT_DIR
+        sam.KEEP_TMP_FILES, sam.JCT_DIR = True, self.tmp_dir + '/'
+
+    def tearDown(self):
+        sam.KEEP_TMP_FILES, sam.JCT_DIR = self.saved
+        shutil.rmtree(self.tmp_dir)
+
+    def test_jct_file(self):
+        # the .jct file of the tmp SAM is the same as jct_counts.py writes
+        sam_path = write_random_sam(os.path.join(self.tmp_dir, 'region.sam'))
+        for anchor in (1, 8, 20):
+            sam_obj = make_sam()
+            sam_obj.set_anchor_length(anchor)
+            sam_obj._Sam__write_tmp_sam = lambda chr, start, end: sam_path
+            junctionDict = sam_obj._Sam__extract_to_file('chr1', 1, 1000)
+            self.assertTrue(os.path.exists(sam_path))
+            expected_path = os.path.join(self.tmp_dir, 'expected.jct')
+            jct_counts.main({'sam': sam_path, 'output': expected_path, 'anchor': anchor})
+            with open(expected_path) as handle:
+                expected = handle.read()
+            with open(os.path.join(self.tmp_dir, 'region.jct')) as handle:
+                self.assertEqual(handle.read(), expected)
+            self.assertTrue(len(expected) > 0)
+            with open(sam_path, 'rb') as handle:
+                self.assertEqual(junctionDict, jct_counts.count_sam_file(handle, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
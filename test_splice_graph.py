@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+# Copyright (C) 2012-2013  Collin Tokheim
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+'''
+File: test_splice_graph.py
+Author: Collin Tokheim
+Description: Checks that component scoped extraction (annotation_region
+followed by complete_edge_weights) gives the pooled and per BAM file splice
+graphs the same exons around the target as extracting the whole gene.
+'''
+import random
+import unittest
+import exon_graph
+import gene_index
+import gtf
+import splice_graph
+
+OPTIONS = {'both_flag': True, 'read_threshold': 5, 'min_jct_count': 1}
+
+
+class FakeSam(object):
+    """Sam object whose extractSamRegion looks junctions up in a dict"""
+    def __init__(self, junctions, anchor_length=8):
+        self.junctions = junctions  # (chr, start, stop) -> count
+        self.anchor_length = anchor_length
+        self.regions = []
+
+    def extractSamRegion(self, chr, start, end):
+        # junctions touching [start, end] like junction_index.JunctionIndex.query
+        self.regions.append((chr, start, end))
+        return dict((jct, count) for jct, count in self.junctions.items()
+                    if jct[0] == chr and jct[1] <= end and jct[2] >= start)
+
+
+def make_gene(transcripts, target, chr='chr1'):
+    """gene dictionary like gene_index.GeneAnnotation.add_transcript makes"""
+    return {'chr': chr, 'strand': '+', 'graph': transcripts, 'target': target,
+            'exons': set(exon for tx in transcripts for exon in tx),
+            'start': min(tx[0][0] for tx in transcripts), 'end': max(tx[-1][1] for tx in transcripts)}
+
+
+def event_graphs(edge_weights_list, gene_dict):
+    """Exons of target_exons and their weighted edges in the pooled and each per BAM splice graph"""
+    graphs = [splice_graph.construct_splice_graph(edge_weights_list, gene_dict, gene_dict['chr'], '+',
+                                                  OPTIONS['read_threshold'], OPTIONS['min_jct_count'],
+                                                  output_type='single', both=True)]
+    graphs += splice_graph.construct_splice_graph(edge_weights_list, gene_dict, gene_dict['chr'], '+',
+                                                  OPTIONS['read_threshold'], OPTIONS['min_jct_count'],
+                                                  output_type='list', both=True)
+    events = []
+    for sg in graphs:
+        exons = splice_graph.target_exons(sg.get_graph(), gene_dict['target'])
+        events.append((sorted(exons), sorted(sg.get_graph().subgraph(exons).edge_weights().items())))
+    return events
+
+
+class TestCompleteEdgeWeights(unittest.TestCase):
+
+    def setUp(self):
+        self.region_mode, self.region_margin = splice_graph.REGION_MODE, splice_graph.REGION_MARGIN
+        splice_graph.REGION_MODE, splice_graph.REGION_MARGIN = 'component', 200
+
+    def tearDown(self):
+        splice_graph.REGION_MODE, splice_graph.REGION_MARGIN = self.region_mode, self.region_margin
+
+    def complete(self, sam_obj_list, gene_dict):
+        """Edge weights of the target's region after both extraction stages"""
+        region = splice_graph.annotation_region(gene_dict, gene_dict['chr'], '+')
+        edge_weights_list = [sam_obj.extractSamRegion(*region) for sam_obj in sam_obj_list]
+        return splice_graph.complete_edge_weights(sam_obj_list, edge_weights_list, region, gene_dict,
+                                                  gene_dict['chr'], '+', OPTIONS)
+
+    def check(self, sam_obj_list, gene_dict):
+        gene_region = (gene_dict['chr'], gene_dict['start'], gene_dict['end'])
+        expected = event_graphs([sam_obj.extractSamRegion(*gene_region) for sam_obj in sam_obj_list], gene_dict)
+        self.assertEqual(event_graphs(self.complete(sam_obj_list, gene_dict), gene_dict), expected)
+        return expected
+
+    def test_novel_junction_outside_region(self):
+        # a, b only reach the block of the target through c and d, so the
+        # novel a-b junction, which lies before the first stage region, puts
+        # them in a cycle with the target
+        a, b, c, t, d, e = (0, 100), (5000, 5100), (20000, 20100), (22000, 22100), (24000, 24100), (40000, 40100)
+        gene_dict = make_gene([[a, c, t, d, e], [a, c, d, e], [b, d, e]], t)
+        region = splice_graph.annotation_region(gene_dict, 'chr1', '+')
+        self.assertTrue(region[1] > b[1])
+        sam_obj_list = [FakeSam({('chr1', a[1], b[0]): 10, ('chr1', t[1], d[0]): 7}),
+                        FakeSam({('chr1', a[1], b[0]): 6})]
+        self.assertEqual(sam_obj_list[0].extractSamRegion(*region), {('chr1', t[1], d[0]): 7})
+        sam_obj_list[0].regions = []
+        expected = self.check(sam_obj_list, gene_dict)
+        for exons, edges in expected:
+            self.assertEqual(exons, [a, b, c, t, d])
+        # the whole gene, the first stage region and the region widened to a
+        self.assertEqual(sam_obj_list[0].regions, [('chr1', 0, e[1]), region, ('chr1', 0, region[2])])
+
+    def test_pooled_only_junction(self):
+        # a-b has too few reads in each BAM file, so only the pooled graph has it
+        a, b, c, t, d, e = (0, 100), (5000, 5100), (20000, 20100), (22000, 22100), (24000, 24100), (40000, 40100)
+        gene_dict = make_gene([[a, c, t, d, e], [a, c, d, e], [b, d, e]], t)
+        sam_obj_list = [FakeSam({('chr1', a[1], b[0]): 3}), FakeSam({('chr1', a[1], b[0]): 3})]
+        expected = self.check(sam_obj_list, gene_dict)
+        self.assertEqual(expected[0][0], [a, b, c, t, d])
+        self.assertEqual(expected[1][0], [c, t, d])
+
+    def test_random_genes(self):
+        rand = random.Random(0)
+        for i in range(200):
+            num_exons = rand.randint(3, 20)
+            transcripts = exon_graph.synthetic_gene(num_exons, min(rand.randint(1, 3), 2 ** (num_exons - 2)), seed=i)
+            exons = sorted(set(exon for tx in transcripts for exon in tx))
+            gene_dict = make_gene(transcripts, rand.choice(transcripts[0]))
+            sam_obj_list = []
+            for j in range(rand.randint(1, 3)):
+                junctions = {}
+                for k in range(rand.randint(0, 2 * num_exons)):
+                    u, v = sorted(rand.sample(exons, 2))
+                    junctions[('chr1', u[1], v[0])] = rand.randint(1, 9)
+                junctions[('chr1', rand.randint(0, exons[-1][1]), exons[-1][1] + 10)] = 10  # no exon ends there
+                junctions[('chr2', exons[0][1], exons[-1][0])] = 10  # other chromosome
+                sam_obj_list.append(FakeSam(junctions))
+            self.check(sam_obj_list, gene_dict)
+
+
+class TestGeneLookup(unittest.TestCase):
+
+    def setUp(self):
+        self.gene_dict = gene_index.GeneAnnotation()
+        for gene_id, tx in [('G1', [(100, 200), (300, 400)]), ('G2', [(300, 400), (500, 600)]),
+                            ('G3', [(600, 700), (800, 900)])]:
+            self.gene_dict.add_transcript([gtf.GtfExon('chr1', start, end, '+', gene_id, gene_id + '.1')
+                                           for start, end in tx])
+
+    def test_gene_name(self):
+        # the target is an exon of G1 and G2, the left most gene is used
+        gene, gene_name = splice_graph.get_from_gtf_using_gene_name(self.gene_dict, '+', 'chr1', 300, 400)
+        self.assertEqual(gene_name, 'G1')
+        self.assertEqual(gene['graph'], self.gene_dict['chr1']['G1']['graph'])
+        self.assertEqual(gene['target'], (300, 400))
+        self.assertFalse('target' in self.gene_dict['chr1']['G1'])
+        gene, gene_name = splice_graph.get_from_gtf_using_gene_name(self.gene_dict, '+', 'chr1', 500, 600)
+        self.assertEqual(gene_name, 'G2')
+
+    def test_weakly_connected(self):
+        # G3 touches G2 but shares no exon with it
+        gene, gene_name = splice_graph.get_weakly_connected_tx(self.gene_dict, '+', 'chr1', 500, 600)
+        self.assertEqual(sorted(gene['graph']), [[(100, 200), (300, 400)], [(300, 400), (500, 600)]])
+        self.assertEqual((gene['start'], gene['end'], gene['target']), (100, 600, (500, 600)))
+
+
+if __name__ == '__main__':
+    unittest.main()